@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Measures blocks per second when importing full blocks through Blockchain.add_block, against the previous
+write path that string-formatted and executed one INSERT per transaction.
+
+Usage: python -m benchmarks.add_block [--blocks N] [--transactions N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.connection import ConnectionPool
+
+# lightweight stand-ins so that scrypt and merkle hashing do not pollute the measurement of the write path
+BenchBlockHeader = collections.namedtuple(
+    'BenchBlockHeader', ['hash', 'previous_hash', 'merkle_root', 'nonce', 'timestamp', 'version'])
+BenchBlock = collections.namedtuple('BenchBlock', ['height', 'transactions', 'block_header'])
+
+
+def make_blocks(blocks, transactions):
+    result = []
+    for height in range(2, blocks + 2):
+        block_hash = "{:064x}".format(height)
+        txs = [Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value, timestamp=height,
+                           tx_hash="c{:063x}".format(height), signature="",
+                           prev_hash="c{:063x}".format(height - 1))]
+        txs.extend(Transaction("src{}".format(i), "dest{}".format(i), 1, 0.01, timestamp=height,
+                               tx_hash="{:032x}{:032x}".format(height, i), signature="sig",
+                               prev_hash="p{:031x}{:032x}".format(height, i))
+                   for i in range(transactions - 1))
+        header = BenchBlockHeader(block_hash, "{:064x}".format(height - 1), block_hash, 0, height, 1)
+        result.append(BenchBlock(height, txs, header))
+    return result
+
+
+def init_db(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(open('config/init_blockchain.sql', 'r').read())
+        conn.execute("INSERT INTO branches (id, currentHash, currentHeight) VALUES (0, ?, 1)", ("{:064x}".format(1),))
+        conn.execute("INSERT INTO blocks (hash, prevHash, merkleRoot, height, nonce, timestamp, version, branch)"
+                     " VALUES (?, '', '', 1, 0, 1, 1, 0)", ("{:064x}".format(1),))
+
+
+def legacy_add_block(db_path, block, branch=0):
+    # the write path prior to parameterized batching, without the branch lookups
+    sql_strings = list()
+    sql_strings.append("INSERT INTO blocks (hash, prevhash, merkleRoot, height, nonce, timestamp, version, branch" +
+                       ") VALUES ('{}', '{}', '{}', {}, {}, {}, {}, {})"
+                       .format(block.block_header.hash, block.block_header.previous_hash,
+                               block.block_header.merkle_root, block.height, block.block_header.nonce,
+                               block.block_header.timestamp, block.block_header.version, branch))
+    for transaction in block.transactions:
+        sql_strings.append("INSERT INTO transactions (hash, src, dest, amount, fee, timestamp, signature, type," +
+                           " blockHash, asset, data, branch, prevHash)" +
+                           " VALUES ('{}', '{}', '{}', {}, {}, {}, '{}', {},'{}', '{}', '{}', {}, '{}')".format(
+                               transaction.tx_hash, transaction.source, transaction.destination,
+                               transaction.amount, transaction.fee, transaction.timestamp, transaction.signature,
+                               transaction.tx_type, block.block_header.hash, transaction.asset, transaction.data,
+                               branch, transaction.prev_hash))
+    sql_strings.append("UPDATE branches SET currentHash = '{}', currentHeight = {} WHERE id = {}".format(
+                       block.block_header.hash, block.height, branch))
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        for sql in sql_strings:
+            cursor.execute(sql)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Blockchain.add_block import benchmark')
+    parser.add_argument('--blocks', type=int, default=50)
+    parser.add_argument('--transactions', type=int, default=Blockchain.MAX_TRANSACTIONS_PER_BLOCK)
+    args = parser.parse_args()
+    blocks = make_blocks(args.blocks, args.transactions)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        legacy_db = os.path.join(tmpdir, 'legacy.db')
+        init_db(legacy_db)
+        start = time.time()
+        for block in blocks:
+            legacy_add_block(legacy_db, block)
+        before = len(blocks) / (time.time() - start)
+
+        batched_db = os.path.join(tmpdir, 'batched.db')
+        init_db(batched_db)
+        Blockchain.CHAIN_DB = batched_db
+        blockchain = Blockchain()
+        start = time.time()
+        for block in blocks:
+            if not blockchain.add_block(block):
+                raise RuntimeError("add_block failed at height {}".format(block.height))
+        after = len(blocks) / (time.time() - start)
+        ConnectionPool.instance(batched_db).close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("{} blocks of {} transactions".format(args.blocks, args.transactions))
+    print("per-statement string formatting: {:>8.1f} blocks/s".format(before))
+    print("parameterized executemany:       {:>8.1f} blocks/s".format(after))
+    print("speedup:                         {:>8.1f}x".format(after / before))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Times how long a syncing node takes to download a run of blocks from a peer.  The per-block path is the previous
+catch-up sync: a header request, a transaction inventory request and a transactions request for every block.  The
+range path pulls the blocks whole through the full blocks endpoint, MAX_BLOCKS_BATCH blocks per request.  The
+peer is a bottle server in its own process on 127.0.0.2 and --latency adds a delay to every request to stand in
+for the network round trip.
+
+Usage: python -m benchmarks.block_download [--blocks N] [--transactions N] [--latency MS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+from mock import Mock, patch
+
+from benchmarks.add_block import init_db
+from benchmarks.compact_block import CountingApiClient, serve, HOST, PORT
+from crankycoin.models.block import Block
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
+from crankycoin.repository.peers import Peers
+
+
+def make_chain(blocks, transactions):
+    chain = []
+    previous_hash = "{:064x}".format(1)
+    for height in range(2, blocks + 2):
+        coinbase = Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value,
+                               prev_hash="c{}".format(height), timestamp=1524041935 + height, signature="")
+        txs = [Transaction("src{}".format(i), "dest{}".format(i), 1, 0.01, prev_hash="p{}-{}".format(height, i),
+                           timestamp=1524041935 + height, signature="f" * 142) for i in range(transactions - 1)]
+        block = Block(height, [coinbase] + txs, previous_hash, timestamp=1524041935 + height)
+        chain.append(block)
+        previous_hash = block.block_header.hash
+    return chain
+
+
+def per_block_path(api_client, block_hashes):
+    count = 0
+    for block_hash in block_hashes:
+        block_header = api_client.request_block_header(HOST, PORT, block_hash=block_hash)
+        tx_hashes = api_client.request_transactions_inv(HOST, PORT, block_header.hash)
+        count += len(api_client.request_transactions(HOST, PORT, tx_hashes))
+    return count
+
+
+def range_path(api_client, start_height, end_height):
+    return sum(len(block.transactions) for block in api_client.request_blocks(HOST, PORT, start_height, end_height))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='catch-up block download benchmark')
+    parser.add_argument('--blocks', type=int, default=400)
+    parser.add_argument('--transactions', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=5.0, help='milliseconds added to every request')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    tmpdir = tempfile.mkdtemp()
+    sender = None
+    try:
+        chain = make_chain(args.blocks, args.transactions)
+        chain_db = os.path.join(tmpdir, "chain.db")
+        pool_db = os.path.join(tmpdir, "pool.db")
+        init_db(chain_db)
+        with patch.object(Blockchain, "CHAIN_DB", chain_db), patch.object(Mempool, "POOL_DB", pool_db):
+            blockchain = Blockchain()
+            for block in chain:
+                assert blockchain.add_block(block)
+
+        sender = mp.Process(target=serve, args=(chain_db, pool_db, args.latency / 1000.0))
+        sender.start()
+        time.sleep(1)
+        expected = args.blocks * args.transactions
+
+        api_client = CountingApiClient(Mock(Peers))
+        start = time.time()
+        assert per_block_path(api_client, [block.block_header.hash for block in chain]) == expected
+        per_block_seconds = time.time() - start
+        per_block_trips = api_client.round_trips
+
+        api_client = CountingApiClient(Mock(Peers))
+        start = time.time()
+        assert range_path(api_client, chain[0].height, chain[-1].height) == expected
+        range_seconds = time.time() - start
+
+        print("{} blocks of {} transactions, {} ms added per request".format(args.blocks, args.transactions,
+                                                                               args.latency))
+        for name, trips, seconds in (("per block", per_block_trips, per_block_seconds),
+                                     ("range", api_client.round_trips, range_seconds)):
+            print("{:<10} {:>6} requests  {:>9.1f} ms  {:>8.1f} blocks/s".format(name, trips, 1000 * seconds,
+                                                                               args.blocks / seconds))
+    finally:
+        if sender is not None:
+            sender.terminate()
+            sender.join()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Compares finding the last block shared with a peer whose chain forked off ours --depth blocks below our tip.  The
+previous search fetched the peer's hashes from 100 blocks below our tip and looked each one up locally until one
+was unknown.  The block locator search sends exponentially spaced hashes of our chain and the peer answers with
+one query, naming a shared block at most as far below the fork as the locator spacing there; sync resumes from
+it.  Both chains live in temporary databases and no network is involved.
+
+Usage: python -m benchmarks.block_locator [--blocks N] [--depth N [N ...]]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from mock import patch
+
+from benchmarks.add_block import init_db
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.connection import ConnectionPool
+from crankycoin.repository.mempool import Mempool
+
+
+def build_chain(db_path, blocks, fork_height, prefix):
+    # the blocks table is all the searches read, so the chain is written directly
+    init_db(db_path)
+    rows = []
+    previous_hash = "{:064x}".format(1)
+    for height in range(2, blocks + 2):
+        block_hash = "{:064x}".format(height) if height <= fork_height else "{}{:063x}".format(prefix, height)
+        rows.append((block_hash, previous_hash, block_hash, height, 0, height, 1, 0))
+        previous_hash = block_hash
+    with patch.object(Blockchain, "CHAIN_DB", db_path):
+        blockchain = Blockchain()
+    with blockchain.pool.writer() as conn:
+        conn.executemany("INSERT INTO blocks (hash, prevHash, merkleRoot, height, nonce, timestamp, version, branch)"
+                         " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("UPDATE branches SET currentHash = ?, currentHeight = ? WHERE id = 0",
+                     (previous_hash, blocks + 1))
+    return blockchain
+
+
+def linear_search(local, peer):
+    # the previous __synchronize: the peer's hashes from 100 blocks below our tip, looked up one at a time
+    current_height = local.get_height()
+    start_height = current_height - 100 if current_height > 100 else 1
+    peer_blocks_inv = peer.get_hashes_range(start_height, min(start_height + 500, peer.get_height()))
+    queries = 1
+    last_common_block = None
+    for block_hash in peer_blocks_inv:
+        queries += 1
+        block = local.get_block_header_by_hash(block_hash)
+        if block is None:
+            break
+        last_common_block = block
+    return (None if last_common_block is None else last_common_block[2]), queries, len(peer_blocks_inv)
+
+
+def locator_search(local, peer):
+    locator = local.get_block_locator()
+    fork_point = peer.find_fork_point(locator)
+    return (None if fork_point is None else fork_point[1]), 2, len(locator)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fork point search benchmark')
+    parser.add_argument('--blocks', type=int, default=100000)
+    parser.add_argument('--depth', type=int, nargs='+', default=[10, 100, 1000, 10000, 90000])
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with patch.object(Mempool, "POOL_DB", os.path.join(tmpdir, "pool.db")):
+            print("{} blocks on each side".format(args.blocks))
+            for depth in args.depth:
+                fork_height = args.blocks + 1 - depth
+                local = build_chain(os.path.join(tmpdir, "local{}.db".format(depth)), args.blocks, fork_height, "a")
+                peer = build_chain(os.path.join(tmpdir, "peer{}.db".format(depth)), args.blocks, fork_height, "b")
+                for name, search in (("linear", linear_search), ("locator", locator_search)):
+                    start = time.time()
+                    found, queries, hashes = search(local, peer)
+                    seconds = time.time() - start
+                    # the locator answers with the tallest locator block at or below the fork
+                    below = "missed" if found is None or found > fork_height else fork_height - found
+                    print("depth {:>6}  {:<8} {:>6} below fork  {:>4} queries  {:>4} hashes sent  {:>7.2f} ms".format(
+                        depth, name, below, queries, hashes, 1000 * seconds))
+                for blockchain in (local, peer):
+                    blockchain.pool.close()
+                ConnectionPool._pools.clear()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Measures block connect latency through Blockchain.add_block on chains of --heights blocks.  Compares the fork choice
+lookups add_block made in SQL before the block tree (branch of the previous block, chain height and branches
+building on the previous block) with the same answers from the tree, and reports the time and memory taken to load
+the tree and the latency of blocks connected after another process connected the one before.
+
+Usage: python -m benchmarks.block_tree [--heights N [N ...]] [--blocks N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from mock import patch
+
+from benchmarks.add_block import BenchBlock, BenchBlockHeader
+from benchmarks.chain import build_chain
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.block_tree import BlockTree
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.connection import ConnectionPool
+from crankycoin.repository.mempool import Mempool
+from crankycoin.services.chain_tip import ChainTip
+
+
+def make_blocks(previous_hash, start_height, count):
+    blocks = []
+    for height in range(start_height, start_height + count):
+        block_hash = "{:064x}".format(height)
+        coinbase = Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value, timestamp=height,
+                               tx_hash="c{:063x}".format(height), signature="", prev_hash="c{:063x}".format(height - 1))
+        blocks.append(BenchBlock(height, [coinbase], BenchBlockHeader(block_hash, previous_hash, block_hash, 0,
+                                                                        height, 1)))
+        previous_hash = block_hash
+    return blocks
+
+
+def sql_fork_choice(blockchain, block):
+    # the lookups add_block made before the block tree
+    with blockchain.pool.writer():
+        branch = blockchain.get_branch_by_hash(block.block_header.previous_hash)
+        blockchain.get_height()
+        return branch in blockchain.get_branches_by_prevhash(block.block_header.previous_hash)
+
+
+def tree_fork_choice(blockchain, block):
+    with blockchain.pool.writer() as conn:
+        tree = blockchain.block_tree
+        tree.synchronize(conn.cursor())
+        branch = tree.get_branch(block.block_header.previous_hash)
+        return block.height > tree.height or tree.has_child(block.block_header.previous_hash, branch)
+
+
+def per_call_us(function, blockchain, blocks):
+    start = time.time()
+    for block in blocks:
+        function(blockchain, block)
+    return 1e6 * (time.time() - start) / len(blocks)
+
+
+def percentile(samples, fraction):
+    return sorted(samples)[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='block tree connect latency benchmark')
+    parser.add_argument('--heights', type=int, nargs='+', default=[100000, 200000])
+    parser.add_argument('--blocks', type=int, default=2000, help='blocks connected at each height')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with patch.object(Mempool, "POOL_DB", os.path.join(tmpdir, "pool.db")), patch.object(ChainTip, "publish"):
+            for height in args.heights:
+                db_path = os.path.join(tmpdir, "chain{}.db".format(height))
+                hashes = build_chain(db_path, height, real_hashes=False)
+                with patch.object(Blockchain, "CHAIN_DB", db_path):
+                    blockchain = Blockchain()
+                blocks = make_blocks(hashes[-1], height + 1, args.blocks)
+
+                start = time.time()
+                with blockchain.pool.writer() as conn:
+                    blockchain.block_tree.synchronize(conn.cursor())
+                load_seconds = time.time() - start
+                # loaded again under tracemalloc, which slows loading too much to time it
+                tracemalloc.start()
+                with blockchain.pool.writer() as conn:
+                    blockchain.block_tree.load(conn.cursor())
+                tree_bytes = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+
+                sql_us = per_call_us(sql_fork_choice, blockchain, blocks)
+                tree_us = per_call_us(tree_fork_choice, blockchain, blocks)
+
+                latencies = []
+                for block in blocks:
+                    start = time.time()
+                    assert blockchain.add_block(block)
+                    latencies.append(1e6 * (time.time() - start))
+
+                # another process connects every other block, which this process replays from the log on its next
+                # write
+                other = Blockchain.__new__(Blockchain)
+                other.pool = ConnectionPool(db_path)
+                other.block_tree = BlockTree(other.pool)
+                catch_up = []
+                for index, block in enumerate(make_blocks(blocks[-1].block_header.hash, height + args.blocks + 1,
+                                                          args.blocks)):
+                    if index % 2 == 0:
+                        assert other.add_block(block)
+                        continue
+                    start = time.time()
+                    assert blockchain.add_block(block)
+                    catch_up.append(1e6 * (time.time() - start))
+                other.pool.close()
+
+                print("height {}".format(height))
+                print("  tree load            {:>9.1f} ms  {:>6.1f} MB".format(1000 * load_seconds,
+                                                                            tree_bytes / 1e6))
+                print("  fork choice, SQL     {:>9.1f} us".format(sql_us))
+                print("  fork choice, tree    {:>9.1f} us".format(tree_us))
+                print("  add_block            {:>9.1f} us mean  {:>7.1f} us p50  {:>7.1f} us p99".format(
+                    sum(latencies) / len(latencies), percentile(latencies, 0.5), percentile(latencies, 0.99)))
+                print("  add_block, catch up  {:>9.1f} us mean  {:>7.1f} us p50  {:>7.1f} us p99".format(
+                    sum(catch_up) / len(catch_up), percentile(catch_up, 0.5), percentile(catch_up, 0.99)))
+                blockchain.pool.close()
+                ConnectionPool._pools.pop(db_path, None)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
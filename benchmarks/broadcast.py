@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Times ApiClient broadcasts to stub peers listening on loopback addresses 127.0.0.2 and up.  Most stubs answer
+immediately, some answer slowly and some never answer within the timeout.  Compares posting to one peer after
+another (the previous ApiClient behaviour) with the concurrent fan-out.
+
+Usage: python -m benchmarks.broadcast [--peers N] [--slow N] [--hung N] [--delay S] [--timeout S] [--workers N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from mock import Mock
+
+from crankycoin.repository.peers import Peers
+from crankycoin.services.api_client import ApiClient, requests
+
+PORT = 30099
+BODY = b'{"success": true}'
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def stub_handler(delay):
+    class StubInbox(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            time.sleep(delay)
+            try:
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(BODY)))
+                self.end_headers()
+                self.wfile.write(BODY)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+    return StubInbox
+
+
+def start_stub(host, delay):
+    server = StubServer((host, PORT), stub_handler(delay))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def sequential_broadcast(api_client, data):
+    for node in api_client.peers.get_all_peers():
+        url = api_client.INBOX_URL.format(node, api_client.FULL_NODE_PORT)
+        try:
+            requests.post(url, json=data, timeout=api_client.BROADCAST_TIMEOUT)
+        except requests.exceptions.RequestException:
+            api_client.peers.record_downtime(node)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='broadcast fan-out benchmark')
+    parser.add_argument('--peers', type=int, default=30)
+    parser.add_argument('--slow', type=int, default=3, help='peers answering after --delay seconds')
+    parser.add_argument('--hung', type=int, default=1, help='peers answering after twice --timeout')
+    parser.add_argument('--delay', type=float, default=0.5)
+    parser.add_argument('--timeout', type=float, default=1.0)
+    parser.add_argument('--workers', type=int, default=ApiClient.BROADCAST_WORKERS)
+    args = parser.parse_args()
+
+    hosts = ["127.0.0.{}".format(i + 2) for i in range(args.peers)]
+    servers = []
+    for i, host in enumerate(hosts):
+        if i < args.hung:
+            delay = 2 * args.timeout
+        elif i < args.hung + args.slow:
+            delay = args.delay
+        else:
+            delay = 0
+        servers.append(start_stub(host, delay))
+
+    mock_peers = Mock(Peers)
+    mock_peers.get_all_peers.return_value = hosts
+    api_client = ApiClient(mock_peers)
+    api_client.FULL_NODE_PORT = PORT
+    api_client.BROADCAST_TIMEOUT = args.timeout
+    ApiClient.BROADCAST_WORKERS = args.workers
+    data = {"host": "127.0.0.1", "type": 2, "data": ["f" * 64]}
+    try:
+        start = time.time()
+        sequential_broadcast(api_client, data)
+        print("{:<12} {:>8.1f} ms".format("sequential", 1000 * (time.time() - start)))
+        # warm up the thread pool
+        api_client.broadcast(data)
+        start = time.time()
+        accepted = api_client.broadcast(data)
+        print("{:<12} {:>8.1f} ms  ({} of {} peers accepted, {} workers, {}s timeout)".format(
+            "concurrent", 1000 * (time.time() - start), len(accepted), len(hosts), args.workers, args.timeout))
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
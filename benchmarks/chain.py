@@ -0,0 +1,50 @@
+"""
+Helpers for building throwaway chain databases for the benchmarks
+"""
+
+import sqlite3
+
+from crankycoin.models.block import BlockHeader
+from crankycoin.models.enums import TransactionType
+
+GENESIS_TIMESTAMP = 1524041935
+
+
+def build_chain(db_path, height, real_hashes=True):
+    """
+    Creates a chain database holding a primary branch of the given height, one coinbase transaction per block
+
+    :param db_path: path of the sqlite database to create
+    :type db_path: str
+    :param height: number of blocks
+    :type height: int
+    :param real_hashes: store true scrypt header hashes.  Synthetic hashes are much faster to generate but do not
+        match BlockHeader.hash of the stored headers
+    :type real_hashes: bool
+    :return: block hashes ordered by height
+    :rtype: list
+    """
+    hashes = []
+    previous_hash = ""
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(open('config/init_blockchain.sql', 'r').read())
+        conn.executescript(open('config/init_balances.sql', 'r').read())
+        for h in range(1, height + 1):
+            coinbase_hash = "c{:063x}".format(h)
+            timestamp = GENESIS_TIMESTAMP + h * 600
+            header = BlockHeader(previous_hash, coinbase_hash, timestamp, 0, 1)
+            block_hash = header.hash if real_hashes else "{:064x}".format(h)
+            conn.execute("INSERT INTO blocks (hash, prevHash, merkleRoot, height, nonce, timestamp, version, branch)"
+                         " VALUES (?, ?, ?, ?, 0, ?, 1, 0)", (block_hash, previous_hash, coinbase_hash, h, timestamp))
+            conn.execute("INSERT INTO transactions (hash, src, dest, amount, fee, timestamp, signature, type,"
+                         " blockHash, asset, data, branch, prevHash) VALUES (?, '0', 'miner', 50, 0, ?, '', ?, ?,"
+                         " '29bb7eb4fa78fc709e1b8b88362b7f8cb61d9379667ad4aedc8ec9f664e16680', '', 0, ?)",
+                         (coinbase_hash, timestamp, TransactionType.COINBASE.value, block_hash,
+                          "c{:063x}".format(h - 1)))
+            hashes.append(block_hash)
+            previous_hash = block_hash
+        conn.execute("INSERT INTO branches (id, currentHash, currentHeight) VALUES (0, ?, ?)", (previous_hash, height))
+        conn.executemany("INSERT INTO balances (address, asset, branch, amount) VALUES"
+                         " (?, '29bb7eb4fa78fc709e1b8b88362b7f8cb61d9379667ad4aedc8ec9f664e16680', 0, ?)",
+                         (('miner', 50 * height), ('0', -50 * height)))
+    return hashes
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Compares relaying a large block to a peer whose mempool already holds most of its transactions.
+
+The header path announces the block hash, then the receiver fetches the header, the transaction inventory and the
+missing transactions.  The compact path pushes the compact block, then the receiver rebuilds the block from its
+mempool and fetches the missing transactions in one request.  The sender is a bottle server in its own process on
+127.0.0.2 and --latency adds a delay to every request to stand in for the network round trip.  Reports round trips,
+bytes received and wall time up to the point where the receiver holds every transaction of the block.
+
+Usage: python -m benchmarks.compact_block [--transactions N] [--missing PERCENT] [--mempool N] [--latency MS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+from bottle import Bottle
+from mock import Mock, patch
+
+from benchmarks.add_block import init_db
+from crankycoin.models.block import Block, CompactBlock
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
+from crankycoin.repository.peers import Peers
+from crankycoin.services.api_client import ApiClient
+
+HOST = "127.0.0.2"
+PORT = 30097
+
+
+def serve(chain_db, pool_db, latency, host=HOST):
+    from crankycoin.routes import permissioned
+    from crankycoin.routes.public import public_app
+    logging.disable(logging.WARNING)
+    Blockchain.CHAIN_DB = chain_db
+    Mempool.POOL_DB = pool_db
+    permissioned.valid_ip = lambda: True
+    app = Bottle()
+    app.merge(public_app)
+    app.merge(permissioned.permissioned_app)
+    app.add_hook('before_request', lambda: time.sleep(latency))
+    app.run(host=host, port=PORT, quiet=True)
+
+
+class CountingApiClient(ApiClient):
+    # tallies round trips and response bytes
+
+    def __init__(self, peers):
+        super(CountingApiClient, self).__init__(peers)
+        self.round_trips = 0
+        self.bytes = 0
+
+    def _request(self, method, node, url, **kwargs):
+        response = super(CountingApiClient, self)._request(method, node, url, **kwargs)
+        self.round_trips += 1
+        self.bytes += len(response.content)
+        return response
+
+
+def make_block(transactions):
+    coinbase = Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value, timestamp=1524041935,
+                           signature="")
+    txs = [Transaction("src{}".format(i), "dest{}".format(i), 1, 0.01, prev_hash="p{}".format(i),
+                       timestamp=1524041935, signature="f" * 142) for i in range(transactions - 1)]
+    return Block(2, [coinbase] + txs, "{:064x}".format(1), timestamp=1524041935)
+
+
+def header_path(api_client, block_hash, mempool):
+    block_header = api_client.request_block_header(HOST, PORT, block_hash=block_hash)
+    tx_hashes = api_client.request_transactions_inv(HOST, PORT, block_header.hash)
+    known = mempool.get_unconfirmed_transactions_by_hashes(tx_hashes)
+    missing = [tx_hash for tx_hash in tx_hashes if tx_hash not in known]
+    fetched = api_client.request_transactions(HOST, PORT, missing)
+    return len(known) + len(fetched)
+
+
+def compact_path(api_client, payload, mempool):
+    compact_block = CompactBlock.from_dict(json.loads(payload))
+    mempool_index = {}
+    for tx_hash in mempool.get_unconfirmed_transaction_hashes():
+        mempool_index[compact_block.short_id(tx_hash)] = tx_hash
+    matched = [mempool_index.get(short_id) for short_id in compact_block.short_ids]
+    known = mempool.get_unconfirmed_transactions_by_hashes([tx_hash for tx_hash in matched if tx_hash])
+    missing = [index + 1 for index, tx_hash in enumerate(matched) if tx_hash not in known]
+    fetched = api_client.request_block_transactions(HOST, PORT, compact_block.block_header.hash, missing)
+    return 1 + len(known) + len(fetched)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compact block relay benchmark')
+    parser.add_argument('--transactions', type=int, default=2000)
+    parser.add_argument('--missing', type=float, default=5.0, help='percent of transactions not in the mempool')
+    parser.add_argument('--mempool', type=int, default=5000, help='unrelated transactions in the mempool')
+    parser.add_argument('--latency', type=float, default=20.0, help='milliseconds added to every request')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    tmpdir = tempfile.mkdtemp()
+    sender = None
+    try:
+        block = make_block(args.transactions)
+        block_hash = block.block_header.hash
+        # the sender holds the block in its chain
+        sender_chain_db = os.path.join(tmpdir, "sender_chain.db")
+        init_db(sender_chain_db)
+        with patch.object(Blockchain, "CHAIN_DB", sender_chain_db), \
+                patch.object(Mempool, "POOL_DB", os.path.join(tmpdir, "sender_pool.db")):
+            assert Blockchain().add_block(block)
+        # the receiver's mempool holds most of the block plus unrelated transactions
+        with patch.object(Mempool, "POOL_DB", os.path.join(tmpdir, "receiver_pool.db")):
+            mempool = Mempool()
+        known_count = int(len(block.transactions[1:]) * (100 - args.missing) / 100)
+        for transaction in block.transactions[1:known_count + 1]:
+            mempool.push_unconfirmed_transaction(transaction)
+        for i in range(args.mempool):
+            mempool.push_unconfirmed_transaction(Transaction("other{}".format(i), "dest", 1, 0.01,
+                                                             prev_hash="o{}".format(i), timestamp=1524041935,
+                                                             signature="f" * 142))
+
+        sender = mp.Process(target=serve, args=(sender_chain_db, os.path.join(tmpdir, "sender_pool.db"),
+                                                args.latency / 1000.0))
+        sender.start()
+        time.sleep(1)
+
+        api_client = CountingApiClient(Mock(Peers))
+        start = time.time()
+        # both announcements are pushed to the receiver's inbox, which costs one round trip
+        time.sleep(args.latency / 1000.0)
+        inv_bytes = len(json.dumps({"host": HOST, "type": 2, "data": [block_hash]}))
+        assert header_path(api_client, block_hash, mempool) == len(block.transactions)
+        header_seconds = time.time() - start
+        header_trips, header_bytes = api_client.round_trips + 1, api_client.bytes + inv_bytes
+
+        api_client = CountingApiClient(Mock(Peers))
+        compact_block = CompactBlock.from_transactions(block.height, block.block_header, block.transactions)
+        payload = json.dumps({"host": HOST, "type": 7, "data": compact_block.to_dict()})
+        start = time.time()
+        time.sleep(args.latency / 1000.0)
+        assert compact_path(api_client, json.dumps(compact_block.to_dict()), mempool) == len(block.transactions)
+        compact_seconds = time.time() - start
+        compact_trips, compact_bytes = api_client.round_trips + 1, api_client.bytes + len(payload)
+
+        print("{} transactions, {}% missing from a mempool of {}, {} ms added per request".format(
+            len(block.transactions), args.missing, mempool.get_unconfirmed_transactions_count(), args.latency))
+        print("{:<8} {:>3} round trips  {:>9} bytes  {:>8.1f} ms".format("header", header_trips, header_bytes,
+                                                                        1000 * header_seconds))
+        print("{:<8} {:>3} round trips  {:>9} bytes  {:>8.1f} ms".format("compact", compact_trips, compact_bytes,
+                                                                        1000 * compact_seconds))
+    finally:
+        if sender is not None:
+            sender.terminate()
+            sender.join()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Counts scrypt invocations per validated block along the FullNode block relay path
+(transactions inv request, Validator.validate_block_header, Blockchain.add_block, inv re-broadcast),
+with and without the memoized BlockHeader.hash.
+
+Usage: python -m benchmarks.header_hash [--blocks N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+from mock import Mock, patch
+
+from crankycoin.models import block as block_module
+from crankycoin.models.block import BlockHeader
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.node import FullNode
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
+from crankycoin.repository.peers import Peers
+from crankycoin.services.api_client import ApiClient
+from crankycoin.services.validator import Validator
+
+
+class UncachedBlockHeader(BlockHeader):
+    # behaves like the header prior to memoization: every read recomputes the digest
+    __slots__ = ()
+
+    @property
+    def hash(self):
+        object.__setattr__(self, '_hash', None)
+        return BlockHeader.hash.fget(self)
+
+
+def relay(header_cls, blocks):
+    mock_blockchain = Mock(Blockchain)
+    mock_blockchain.get_block_header_by_hash.side_effect = \
+        lambda block_hash: None if block_hash != "genesis" else (Mock(BlockHeader), 0, 1)
+    mock_blockchain.calculate_hash_difficulty.return_value = 0
+    mock_blockchain.get_reward.return_value = 50
+    mock_blockchain.find_duplicate_transactions.return_value = False
+    # add_block keys the block row, its transactions and branches update on the block hash
+    mock_blockchain.add_block.side_effect = lambda b: b.block_header.hash is not None
+    mock_mempool = Mock(Mempool)
+    mock_mempool.get_unconfirmed_transaction.return_value = None
+    with patch.object(Blockchain, "__init__", return_value=None), \
+            patch.object(Mempool, "__init__", return_value=None):
+        validator = Validator()
+    validator.blockchain = mock_blockchain
+    validator.mempool = mock_mempool
+    mock_api_client = Mock(ApiClient)
+    node = FullNode(Mock(Peers), mock_api_client, mock_blockchain, mock_mempool, validator)
+
+    calls = 0
+    start = time.time()
+    with patch.object(block_module, 'BlockHeader', header_cls):
+        for i in range(blocks):
+            coinbase = Transaction("0", "miner", 50, 0, prev_hash=str(i), tx_type=TransactionType.COINBASE.value,
+                                   timestamp=1524041935 + i, signature="")
+            mock_api_client.request_transactions_inv.return_value = [coinbase.tx_hash]
+            mock_api_client.request_transaction.return_value = coinbase
+            header = header_cls("genesis", coinbase.tx_hash, 1524041935 + i, i)
+            with patch.object(block_module, 'scrypt_hash', wraps=block_module.scrypt_hash) as patched_scrypt:
+                node._FullNode__process_block_header(header, "127.0.0.2")
+            calls += patched_scrypt.call_count
+    return calls / float(blocks), blocks / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BlockHeader.hash memoization benchmark')
+    parser.add_argument('--blocks', type=int, default=20)
+    args = parser.parse_args()
+
+    before_calls, before_rate = relay(UncachedBlockHeader, args.blocks)
+    after_calls, after_rate = relay(BlockHeader, args.blocks)
+    print("uncached header: {:>5.1f} scrypt calls/block {:>8.1f} blocks/s".format(before_calls, before_rate))
+    print("memoized header: {:>5.1f} scrypt calls/block {:>8.1f} blocks/s".format(after_calls, after_rate))
+
+
+if __name__ == "__main__":
+    main()
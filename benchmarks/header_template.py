@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Reports single process mining hashes per second with the per-nonce header loop (set BlockHeader.nonce, read
+hash_difficulty) against batched HeaderTemplate.search over the precomputed header bytes.
+
+Usage: python -m benchmarks.header_template [--seconds N] [--batch N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from crankycoin.models.block import BlockHeader, HeaderTemplate
+
+# unreachable so that every nonce is hashed
+TARGET_DIFFICULTY = 64
+
+
+def sample_header():
+    return BlockHeader("{:064x}".format(1), "{:064x}".format(2), 1524041935, 0)
+
+
+def per_nonce_rate(seconds):
+    block_header = sample_header()
+    nonce = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        block_header.nonce = nonce
+        if block_header.hash_difficulty >= TARGET_DIFFICULTY:
+            break
+        nonce += 1
+    return nonce / (time.time() - start)
+
+
+def template_rate(seconds, batch):
+    template = HeaderTemplate(sample_header())
+    nonce = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        found, hashes = template.search(range(nonce, nonce + batch), TARGET_DIFFICULTY)
+        if found is not None:
+            break
+        nonce += hashes
+    return nonce / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mining header template benchmark')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--batch', type=int, default=64)
+    args = parser.parse_args()
+
+    before = per_nonce_rate(args.seconds)
+    after = template_rate(args.seconds, args.batch)
+    print("per-nonce header: {:>10.1f} hashes/s".format(before))
+    print("header template:  {:>10.1f} hashes/s ({:+.1f}%)".format(after, (after / before - 1) * 100))
+
+
+if __name__ == "__main__":
+    main()
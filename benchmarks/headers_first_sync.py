@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Measures catch-up sync in blocks per second.  A run of blocks is served by bottle servers in their own processes on
+127.0.0.2 and up, and a FullNode with an empty chain database synchronizes from them through FullNode.__synchronize,
+block validation and Blockchain.add_block included.  Compares the single-peer range sync against headers-first sync
+from one peer and from --peers peers.  --latency delays every request on the syncing side to stand in for the
+network round trip.
+
+Usage: python -m benchmarks.headers_first_sync [--blocks N] [--peers N] [--latency MS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from mock import Mock, patch
+
+from benchmarks.compact_block import serve, PORT
+from crankycoin.models.block import Block
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.node import FullNode
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
+from crankycoin.repository.peers import Peers
+from crankycoin.services.api_client import ApiClient
+from crankycoin.services.validator import Validator
+
+
+class LatentApiClient(ApiClient):
+    # delays every request in the calling thread, so concurrent requests wait out their round trips together
+
+    latency = 0
+
+    def _request(self, method, node, url, **kwargs):
+        time.sleep(self.latency)
+        return super(LatentApiClient, self)._request(method, node, url, **kwargs)
+
+
+def mine_block(height, previous_hash):
+    coinbase = Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value,
+                           prev_hash="c{}".format(height), timestamp=1524041935 + height, signature="")
+    block = Block(height, [coinbase], previous_hash, timestamp=1524041935 + height)
+    while block.block_header.hash_difficulty < Blockchain.MINIMUM_HASH_DIFFICULTY:
+        block.block_header.nonce += 1
+    return block
+
+
+def init_db(db_path, genesis):
+    # syncing walks back to the genesis block, so its stored hash must be the hash of its header
+    block_header = genesis.block_header
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(open('config/init_blockchain.sql', 'r').read())
+        conn.execute("INSERT INTO branches (id, currentHash, currentHeight) VALUES (0, ?, 1)", (block_header.hash,))
+        conn.execute("INSERT INTO blocks (hash, prevHash, merkleRoot, height, nonce, timestamp, version, branch)"
+                     " VALUES (?, ?, ?, 1, ?, ?, ?, 0)", (block_header.hash, block_header.previous_hash,
+                                                         block_header.merkle_root, block_header.nonce,
+                                                         block_header.timestamp, block_header.version))
+
+
+def mine_chain(genesis, blocks):
+    chain = []
+    previous_hash = genesis.block_header.hash
+    for height in range(2, blocks + 2):
+        block = mine_block(height, previous_hash)
+        chain.append(block)
+        previous_hash = block.block_header.hash
+    return chain
+
+
+def synchronize(tmpdir, name, genesis, hosts, headers_first, latency):
+    mock_peers = Mock(Peers)
+    mock_peers.get_all_peers.return_value = hosts
+    chain_db = os.path.join(tmpdir, "{}.db".format(name))
+    init_db(chain_db, genesis)
+    with patch.object(Blockchain, "CHAIN_DB", chain_db), \
+            patch.object(Mempool, "POOL_DB", os.path.join(tmpdir, "{}_pool.db".format(name))):
+        blockchain = Blockchain()
+        api_client = LatentApiClient(mock_peers)
+        api_client.latency = latency
+        api_client.FULL_NODE_PORT = PORT
+        api_client.broadcast_block_inv = Mock(return_value=[])
+        api_client.broadcast_compact_block = Mock(return_value=[])
+        node = FullNode(mock_peers, api_client, blockchain, Mempool(), Validator())
+        node.FULL_NODE_PORT = PORT
+        node.HEADERS_FIRST_SYNC = headers_first
+        start = time.time()
+        node._FullNode__synchronize(hosts[0])
+        seconds = time.time() - start
+        return blockchain.get_height() - 1, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='catch-up sync benchmark')
+    parser.add_argument('--blocks', type=int, default=1000)
+    parser.add_argument('--peers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=20.0, help='milliseconds added to every request')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    tmpdir = tempfile.mkdtemp()
+    servers = []
+    try:
+        genesis = mine_block(1, "")
+        chain = mine_chain(genesis, args.blocks)
+        chain_db = os.path.join(tmpdir, "chain.db")
+        pool_db = os.path.join(tmpdir, "pool.db")
+        init_db(chain_db, genesis)
+        with patch.object(Blockchain, "CHAIN_DB", chain_db), patch.object(Mempool, "POOL_DB", pool_db):
+            blockchain = Blockchain()
+            for block in chain:
+                assert blockchain.add_block(block)
+        hosts = ["127.0.0.{}".format(i + 2) for i in range(args.peers)]
+        for host in hosts:
+            server = mp.Process(target=serve, args=(chain_db, pool_db, 0),
+                                kwargs=dict(host=host))
+            server.start()
+            servers.append(server)
+        time.sleep(1)
+
+        print("{} blocks, {} ms added per request".format(args.blocks, args.latency))
+        for name, peers, headers_first in (("range", 1, False), ("headers 1", 1, True),
+                                           ("headers {}".format(args.peers), args.peers, True)):
+            synced, seconds = synchronize(tmpdir, name.replace(" ", "_"), genesis, hosts[:peers],
+                                          headers_first, args.latency / 1000.0)
+            assert synced == args.blocks
+            print("{:<12} {:>2} peers  {:>9.1f} ms  {:>8.1f} blocks/s".format(name, peers, 1000 * seconds,
+                                                                            synced / seconds))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.join()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
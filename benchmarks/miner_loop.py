@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Compares the miner's hash rate when the target difficulty and chain tip are queried from the database on every
+nonce against the current loop, which computes the target once per template and learns about tip changes from
+ChainTip notifications.
+
+Usage: python -m benchmarks.miner_loop [--height N] [--seconds N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from crankycoin.miner import Miner
+from crankycoin.models.block import Block
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.connection import ConnectionPool
+from crankycoin.repository.mempool import Mempool
+from benchmarks.chain import build_chain
+
+
+def legacy_loop(blockchain, block, previous_hash, new_block_height, seconds):
+    # the nonce loop prior to per-template difficulty and tip notifications
+    hashes = 0
+    deadline = time.time() + seconds
+    while block.block_header.hash_difficulty < blockchain.calculate_hash_difficulty() and time.time() < deadline:
+        latest_block = blockchain.get_tallest_block_header()
+        if latest_block is not None:
+            latest_block_header = latest_block[0]
+            latest_block_height = latest_block[2]
+            if latest_block_height >= new_block_height or latest_block_header.hash != previous_hash:
+                break
+        hashes += 1
+        block.block_header.nonce = hashes
+    return hashes / seconds
+
+
+def current_loop(miner, seconds):
+    # mine_block only returns once the template goes stale, so another "worker" connects a block after the deadline
+    def connect_block():
+        time.sleep(seconds)
+        miner.tip_generation.value += 1
+    threading.Thread(target=connect_block).start()
+    miner.mine_block()
+    return miner.stats.hash_count.value / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Miner nonce loop benchmark')
+    parser.add_argument('--height', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        Blockchain.CHAIN_DB = os.path.join(tmpdir, 'chaindata.db')
+        Mempool.POOL_DB = os.path.join(tmpdir, 'pool.db')
+        build_chain(Blockchain.CHAIN_DB, args.height)
+        blockchain = Blockchain()
+        # an unreachable target keeps both loops hashing for the whole measurement
+        blockchain.MINIMUM_HASH_DIFFICULTY = 64
+        mempool = Mempool()
+        miner = Miner(blockchain, mempool)
+
+        latest_block_header, branch, height = blockchain.get_tallest_block_header()
+        coinbase = Transaction("0", "miner", 50, 0, prev_hash="0", tx_type=TransactionType.COINBASE.value,
+                               signature="")
+        template = Block(height + 1, [coinbase], latest_block_header.hash)
+        before = legacy_loop(blockchain, template, latest_block_header.hash, height + 1, args.seconds)
+        after = current_loop(miner, args.seconds)
+        ConnectionPool.instance(Blockchain.CHAIN_DB).close()
+        ConnectionPool.instance(Mempool.POOL_DB).close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("per-nonce database polling: {:>10.1f} hashes/s".format(before))
+    print("per-template target:        {:>10.1f} hashes/s".format(after))
+    print("recovered:                  {:>10.1f}%".format((after / before - 1) * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Reports block header hashes per second for each available scrypt backend and, with --verify, cross-checks that
+every backend produces identical digests on a sample of headers.
+
+Usage: python -m benchmarks.pow_backends [--seconds N] [--verify N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+from crankycoin.models import proof_of_work
+from crankycoin.models.block import BlockHeader
+
+
+def sample_hashables(count):
+    rng = random.Random(1524041935)
+    return [BlockHeader("{:064x}".format(rng.getrandbits(256)), "{:064x}".format(rng.getrandbits(256)),
+                        rng.randint(1524041935, 1924041935), rng.getrandbits(32)).to_hashable().encode('utf-8')
+            for _ in range(count)]
+
+
+def hash_rate(func, seconds):
+    hashable = sample_hashables(1)[0]
+    hashes = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        func(hashable)
+        hashes += 1
+    return hashes / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='scrypt proof-of-work backend benchmark')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--verify', type=int, default=0, metavar='N', help='cross-check N sample headers')
+    args = parser.parse_args()
+
+    if args.verify:
+        for hashable in sample_hashables(args.verify):
+            proof_of_work.compare_backends(hashable)
+        print("{} headers hashed identically by: {}".format(
+            args.verify, ", ".join(proof_of_work.available_backends())))
+
+    for name in proof_of_work.available_backends():
+        print("{:<10} {:>10.1f} hashes/s".format(name, hash_rate(proof_of_work.BACKENDS[name][0], args.seconds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Reports messages per second through the node message queue: producer -> Queue proxy process -> consumer process.
+Compares a fresh context and socket per message (the previous Queue behaviour) with the persistent per-process
+sockets, multipart batches, and the permissioned inbox route feeding the queue.
+
+Usage: python -m benchmarks.queue [--messages N] [--batch N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zmq
+from collections import OrderedDict
+from io import BytesIO
+from mock import patch
+
+from crankycoin.models.enums import MessageType
+from crankycoin.routes import permissioned
+from crankycoin.services.queue import Queue
+
+MESSAGE = {'host': '127.0.0.1', 'type': MessageType.UNCONFIRMED_TRANSACTION_INV.value, 'data': ['f' * 64]}
+
+
+def legacy_enqueue(msg):
+    context = zmq.Context()
+    socket = context.socket(zmq.PUSH)
+    socket.connect(Queue.LANES['all']['bind_in'])
+    socket.send_json(msg)
+
+
+def legacy_dequeue():
+    context = zmq.Context()
+    socket = context.socket(zmq.PULL)
+    socket.connect(Queue.LANES['all']['bind_out'])
+    return socket.recv_json()
+
+
+def consume(dequeue, messages, ready, received, done):
+    ready.set()
+    for _ in range(messages):
+        dequeue()
+        received.value += 1
+    done.value = time.time()
+
+
+def post_to_inbox(body):
+    data = json.dumps(body).encode('utf-8')
+    environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/inbox/', 'REMOTE_ADDR': '127.0.0.1',
+               'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(data)), 'wsgi.input': BytesIO(data),
+               'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http', 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '30013'}
+    b''.join(permissioned.permissioned_app(environ, lambda status, headers, exc_info=None: None))
+
+
+def inbox_message(i):
+    # unique hashes, so the inbox's seen-inventory filter passes every message through
+    return dict(MESSAGE, data=["{:064x}".format(i)])
+
+
+def run(label, produce, dequeue, messages):
+    ready, received, done = mp.Event(), mp.Value('L', 0), mp.Value('d', 0.0)
+    consumer = mp.Process(target=consume, args=(dequeue, messages, ready, received, done))
+    consumer.start()
+    ready.wait()
+    # give the consumer time to connect before the proxy starts distributing
+    time.sleep(0.5)
+    start = time.time()
+    produce(messages)
+    consumer.join(30)
+    if consumer.is_alive():
+        consumer.terminate()
+        print("{:<22} {} of {} messages delivered after 30s".format(label, received.value, messages))
+        return
+    print("{:<22} {:>10.1f} messages/s".format(label, messages / (done.value - start)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='message queue throughput benchmark')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=64)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    # a single lane keeps the comparison with the per-message sockets like for like
+    Queue.LANES = OrderedDict([('all', {'name': 'all', 'bind_in': "ipc://" + os.path.join(tmpdir, "in"),
+                                        'bind_out': "ipc://" + os.path.join(tmpdir, "out"), 'weight': 1,
+                                        'hwm': args.messages, 'types': [t.value for t in MessageType]})])
+    proxy = mp.Process(target=Queue.start_queue)
+    proxy.start()
+    try:
+        legacy_messages = min(args.messages, 2000)
+        run("per-message sockets", lambda n: [legacy_enqueue(MESSAGE) for _ in range(n)], legacy_dequeue,
+            legacy_messages)
+        # the per-message consumer strands messages on abandoned sockets, so also time the producer side alone
+        run("per-message producer", lambda n: [legacy_enqueue(MESSAGE) for _ in range(n)], Queue.dequeue,
+            legacy_messages)
+        run("persistent sockets", lambda n: [Queue.enqueue(MESSAGE) for _ in range(n)], Queue.dequeue,
+            args.messages)
+        run("batches of {}".format(args.batch),
+            lambda n: [Queue.enqueue_batch([MESSAGE] * min(args.batch, n - i)) for i in range(0, n, args.batch)],
+            Queue.dequeue, args.messages)
+        with patch.object(permissioned, 'valid_ip', return_value=True):
+            run("inbox", lambda n: [post_to_inbox(inbox_message(i)) for i in range(n)], Queue.dequeue,
+                args.messages)
+            run("inbox batches of {}".format(args.batch),
+                lambda n: [post_to_inbox([inbox_message(n + j) for j in range(i, min(i + args.batch, n))])
+                           for i in range(0, n, args.batch)],
+                Queue.dequeue, args.messages)
+    finally:
+        proxy.terminate()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Load test for the queue's priority lanes.  A producer floods UNCONFIRMED_TRANSACTION_INV messages faster than a
+simulated worker can process them while announcing a BLOCK_INV every interval, and the worker reports how long
+block messages waited in the queue.  Runs without spam, with every type in one lane, and with the configured
+priority lanes.
+
+Usage: python -m benchmarks.queue_lanes [--seconds N] [--tx-rate N] [--tx-cost MS] [--block-interval MS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+from crankycoin.models.enums import MessageType
+from crankycoin.services.queue import Queue
+
+
+def worker(blocks, tx_cost, results):
+    latencies = []
+    processed = 0
+    while len(latencies) < blocks:
+        msg = Queue.dequeue()
+        if msg['type'] == MessageType.BLOCK_INV.value:
+            latencies.append(time.time() - msg['data']['sent'])
+        else:
+            # stands in for the per-hash database lookups of the inventory handler
+            time.sleep(tx_cost)
+            processed += 1
+    results.put((latencies, processed))
+
+
+def produce(seconds, tx_rate, block_interval):
+    start = time.time()
+    sent_tx = 0
+    sent_blocks = 0
+    while True:
+        elapsed = time.time() - start
+        if elapsed >= seconds:
+            return sent_blocks
+        if elapsed >= sent_blocks * block_interval:
+            Queue.enqueue({'host': 'peer', 'type': MessageType.BLOCK_INV.value,
+                           'data': {'sent': time.time(), 'hashes': ['b' * 64]}})
+            sent_blocks += 1
+        if sent_tx < elapsed * tx_rate:
+            Queue.enqueue({'host': 'peer', 'type': MessageType.UNCONFIRMED_TRANSACTION_INV.value,
+                           'data': {'sent': time.time(), 'hashes': ['t' * 64]}})
+            sent_tx += 1
+        else:
+            time.sleep(0.0005)
+
+
+def run(label, lanes, args, tx_rate):
+    Queue.LANES = lanes
+    Queue._producers = Queue._consumers = None
+    blocks = int(args.seconds * 1000 / args.block_interval)
+    proxy = mp.Process(target=Queue.start_queue)
+    proxy.start()
+    results = mp.Queue()
+    consumer = mp.Process(target=worker, args=(blocks, args.tx_cost / 1000.0, results))
+    consumer.start()
+    time.sleep(0.5)
+    try:
+        produce(args.seconds, tx_rate, args.block_interval / 1000.0)
+        latencies, processed = results.get(timeout=args.seconds * 10 + 30)
+        latencies.sort()
+        print("{:<16} block latency p50 {:>8.1f} ms  p99 {:>8.1f} ms  max {:>8.1f} ms  ({} tx processed, "
+              "{} dropped)".format(label, 1000 * latencies[len(latencies) // 2],
+                                   1000 * latencies[int(len(latencies) * 0.99)], 1000 * latencies[-1], processed,
+                                   sum(Queue.dropped.values())))
+    finally:
+        consumer.terminate()
+        proxy.terminate()
+        proxy.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='queue priority lanes load test')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--tx-rate', type=int, default=2000, help='transaction inventory messages per second')
+    parser.add_argument('--tx-cost', type=float, default=1.0, help='worker milliseconds per transaction message')
+    parser.add_argument('--block-interval', type=float, default=100.0, help='milliseconds between block messages')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lanes = OrderedDict()
+        for name, lane in Queue.LANES.items():
+            lane = copy.deepcopy(lane)
+            lane['bind_in'] = "ipc://" + os.path.join(tmpdir, name + "-in")
+            lane['bind_out'] = "ipc://" + os.path.join(tmpdir, name + "-out")
+            lanes[name] = lane
+        single = OrderedDict([('all', dict(lanes[next(reversed(lanes))], name='all',
+                                           types=[t.value for t in MessageType]))])
+
+        run("no spam", lanes, args, 0)
+        run("single lane", single, args, args.tx_rate)
+        run("priority lanes", lanes, args, args.tx_rate)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
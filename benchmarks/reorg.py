@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Measures reorgs through Blockchain.add_block.  On a primary branch of --height blocks, --depth blocks are added to the
+primary branch and --depth + 1 blocks to an alternate branch forking off below them; the last alternate block makes
+the alternate branch the tallest and is timed.  Every block carries --transactions transactions besides its coinbase,
+half of them shared between the two branches, so the disconnected blocks return the other half to the mempool.
+
+Usage: python -m benchmarks.reorg [--height N] [--depth N [N ...]] [--transactions N] [--runs N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from mock import patch
+
+from benchmarks.add_block import BenchBlock, BenchBlockHeader
+from benchmarks.chain import build_chain
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.connection import ConnectionPool
+from crankycoin.repository.mempool import Mempool
+from crankycoin.services.chain_tip import ChainTip
+
+
+def make_branch(previous_hash, start_height, count, transactions, prefix):
+    blocks = []
+    for height in range(start_height, start_height + count):
+        block_hash = "{}{:063x}".format(prefix, height)
+        txs = [Transaction("0", prefix, 50, 0, tx_type=TransactionType.COINBASE.value, timestamp=height,
+                           tx_hash="c{}{:062x}".format(prefix, height), signature="",
+                           prev_hash="c{}{:062x}".format(prefix, height - 1))]
+        for index in range(transactions):
+            # even transactions are in the blocks of both branches at the same height
+            tx_prefix = "s" if index % 2 == 0 else prefix
+            tx_hash = "{}{:05x}{:058x}".format(tx_prefix, index, height)
+            # spent from the rewards below the fork, so that reorgs return them to the mempool as funded
+            txs.append(Transaction("miner", "bob", 1, 0.1, timestamp=height, tx_hash=tx_hash, signature="sig",
+                                   prev_hash="p" + tx_hash))
+        blocks.append(BenchBlock(height, txs, BenchBlockHeader(block_hash, previous_hash, block_hash, 0, height, 1)))
+        previous_hash = block_hash
+    return blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='reorg benchmark')
+    parser.add_argument('--height', type=int, default=10000, help='blocks below the fork')
+    parser.add_argument('--depth', type=int, nargs='+', default=[10, 100, 1000], help='blocks disconnected')
+    parser.add_argument('--transactions', type=int, default=10, help='transactions per block besides the coinbase')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with patch.object(ChainTip, "publish"):
+            print("{} blocks below the fork, {} transactions per block".format(args.height, args.transactions))
+            for depth in args.depth:
+                timings = []
+                for run in range(args.runs):
+                    db_path = os.path.join(tmpdir, "chain{}_{}.db".format(depth, run))
+                    pool_db_path = os.path.join(tmpdir, "pool{}_{}.db".format(depth, run))
+                    hashes = build_chain(db_path, args.height, real_hashes=False)
+                    with patch.object(Blockchain, "CHAIN_DB", db_path), \
+                            patch.object(Mempool, "POOL_DB", pool_db_path):
+                        blockchain = Blockchain()
+                        for block in make_branch(hashes[-1], args.height + 1, depth, args.transactions, "a"):
+                            assert blockchain.add_block(block)
+                        alt_blocks = make_branch(hashes[-1], args.height + 1, depth + 1, args.transactions, "b")
+                        for block in alt_blocks[:-1]:
+                            assert blockchain.add_block(block)
+                        start = time.time()
+                        assert blockchain.add_block(alt_blocks[-1])
+                        timings.append(time.time() - start)
+                        assert blockchain.get_branch_by_hash(alt_blocks[0].block_header.hash) == 0
+                        returned = Mempool().get_unconfirmed_transactions_count()
+                    blockchain.pool.close()
+                    for path in (db_path, pool_db_path):
+                        pool = ConnectionPool._pools.pop(path, None)
+                        if pool is not None and pool is not blockchain.pool:
+                            pool.close()
+                timings.sort()
+                print("depth {:>5}  reorg {:>9.1f} ms median  {:>9.1f} ms best  {:>6} transactions returned".format(
+                    depth, 1000 * timings[len(timings) // 2], 1000 * timings[0], returned))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Simulates transaction gossip in which every peer announces the same transactions, and reports how many
+announcements the inbox's seen-inventory filter drops and how much worker time goes to the mempool lookups of the
+UNCONFIRMED_TRANSACTION_INV handler with and without the filter.  Each message is taken to be processed before the
+next arrives, the workers marking its hashes seen.
+
+Usage: python -m benchmarks.seen_inventory [--transactions N] [--peers N] [--batch N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from mock import patch
+
+from crankycoin import config
+from crankycoin.models.enums import MessageType
+from crankycoin.repository.mempool import Mempool
+from crankycoin.routes import permissioned
+from crankycoin.services.bloom_filter import RollingBloomFilter
+
+
+def announcements(transactions, peers, batch):
+    # each peer relays every transaction once, in its own order and batching
+    tx_hashes = ["{:064x}".format(i) for i in range(transactions)]
+    msgs = []
+    for peer in range(peers):
+        order = list(tx_hashes)
+        random.shuffle(order)
+        for i in range(0, len(order), batch):
+            msgs.append({'host': "peer{}".format(peer), 'type': MessageType.UNCONFIRMED_TRANSACTION_INV.value,
+                         'data': order[i:i + batch]})
+    random.shuffle(msgs)
+    return msgs
+
+
+def lookups(mempool, msgs):
+    count = 0
+    for msg in msgs:
+        for tx_hash in msg['data']:
+            mempool.get_unconfirmed_transaction(tx_hash)
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='seen-inventory filter benchmark')
+    parser.add_argument('--transactions', type=int, default=5000)
+    parser.add_argument('--peers', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=16, help='hashes per announcement')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with patch.object(Mempool, "POOL_DB", os.path.join(tmpdir, "pool.db")):
+            mempool = Mempool()
+        msgs = announcements(args.transactions, args.peers, args.batch)
+        announced = sum(len(msg['data']) for msg in msgs)
+
+        start = time.time()
+        unfiltered = lookups(mempool, msgs)
+        unfiltered_seconds = time.time() - start
+
+        seen_inventory = RollingBloomFilter(config['user']['seen_inventory_capacity'],
+                                            config['user']['seen_inventory_ttl'],
+                                            config['user']['seen_inventory_fp_rate'])
+        with patch.object(permissioned, 'seen_inventory', seen_inventory):
+            fresh_msgs = []
+            filter_seconds = 0
+            for msg in msgs:
+                start = time.time()
+                fresh = permissioned.filter_seen_inventory([msg])
+                filter_seconds += time.time() - start
+                fresh_msgs.extend(fresh)
+                for fresh_msg in fresh:
+                    for tx_hash in fresh_msg['data']:
+                        seen_inventory.add(tx_hash)
+        start = time.time()
+        filtered = lookups(mempool, fresh_msgs)
+        filtered_seconds = time.time() - start
+
+        stats = seen_inventory.stats()
+        print("announced hashes      {:>10}  in {} messages".format(announced, len(msgs)))
+        print("dropped by filter     {:>10}  ({:.1%}), {} messages left, {} KiB".format(
+            stats['seen'], stats['seen_rate'], len(fresh_msgs), stats['bytes'] // 1024))
+        print("unfiltered lookups    {:>10}  {:>8.1f} ms".format(unfiltered, 1000 * unfiltered_seconds))
+        print("filtered lookups      {:>10}  {:>8.1f} ms  (+{:.1f} ms filtering)".format(
+            filtered, 1000 * filtered_seconds, 1000 * filter_seconds))
+        mempool.pool.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
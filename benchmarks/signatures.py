@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Reports signature verification throughput for blocks of signed transactions, serially, across the Validator's
+signature pool, and when every transaction is already in the verified cache.
+
+Usage: python -m benchmarks.signatures [--transactions N] [--blocks N] [--workers N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import coincurve
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+from mock import patch
+
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
+from crankycoin.services.validator import Validator
+
+
+def signed_transactions(count):
+    private_key = coincurve.PrivateKey()
+    public_key = private_key.public_key.format(compressed=True).hex()
+    transactions = []
+    for i in range(count):
+        transaction = Transaction(public_key, "destination", 1, 0.1, prev_hash=str(i), timestamp=1524041935)
+        transaction.sign(private_key.to_hex())
+        transactions.append(transaction)
+    return transactions
+
+
+def throughput(verify, transactions, blocks):
+    # warm up, which also starts the pool and fills the verified cache
+    assert verify(transactions)
+    start = time.time()
+    for _ in range(blocks):
+        assert verify(transactions)
+    return blocks * len(transactions) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='batch signature verification benchmark')
+    parser.add_argument('--transactions', type=int, default=2000, help='transactions per block')
+    parser.add_argument('--blocks', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=mp.cpu_count())
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with patch.object(Blockchain, "__init__", return_value=None), \
+                patch.object(Mempool, "POOL_DB", os.path.join(tmpdir, "pool.db")):
+            validator = Validator()
+        transactions = signed_transactions(args.transactions)
+
+        validator.SIGNATURE_WORKERS = 1
+        report("serial:", throughput(validator._verify_signatures, transactions, args.blocks), args.transactions)
+        if args.workers > 1:
+            validator.SIGNATURE_WORKERS = args.workers
+            report("pool of {} workers:".format(args.workers),
+                   throughput(validator._verify_signatures, transactions, args.blocks), args.transactions)
+        else:
+            print("pool skipped: only one CPU available (pass --workers to force)")
+        report("verified cache:", throughput(validator.verify_signatures, transactions, args.blocks),
+               args.transactions)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def report(label, rate, transactions):
+    print("{:<20}{:>10.1f} signatures/s {:>8.1f} ms/block".format(label, rate, 1000.0 * transactions / rate))
+
+
+if __name__ == "__main__":
+    main()
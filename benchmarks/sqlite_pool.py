@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Compares repository read throughput when opening a connection per query against the pooled WAL connections.
+
+Usage: python -m benchmarks.sqlite_pool [--blocks N] [--queries N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.connection import ConnectionPool
+
+
+def populate(db_path, blocks):
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(open('config/init_blockchain.sql', 'r').read())
+        conn.executemany(
+            "INSERT INTO blocks (hash, prevHash, merkleRoot, height, nonce, timestamp, version, branch) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            (("{:064x}".format(h), "{:064x}".format(h - 1), "{:064x}".format(h), h, 0, 1524041935 + h, 1)
+             for h in range(1, blocks + 1)))
+    return ["{:064x}".format(h) for h in range(1, blocks + 1)]
+
+
+def per_query_connection(db_path, hashes, queries):
+    # mirrors the pre-pool repository: connect, query and close on every call
+    start = time.time()
+    for i in range(queries):
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("SELECT MAX(height) FROM blocks").fetchone()
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("SELECT * FROM blocks WHERE hash='{}'".format(hashes[i % len(hashes)])).fetchone()
+    return (queries * 2) / (time.time() - start)
+
+
+def pooled(hashes, queries):
+    start = time.time()
+    for i in range(queries):
+        blockchain = Blockchain()
+        blockchain.get_height()
+        blockchain.get_block_header_by_hash(hashes[i % len(hashes)])
+    return (queries * 2) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite connection pool benchmark')
+    parser.add_argument('--blocks', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=5000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmpdir, 'chaindata.db')
+        hashes = populate(db_path, args.blocks)
+        before = per_query_connection(db_path, hashes, args.queries)
+        # every iteration builds a fresh Blockchain() the way the routes do
+        Blockchain.CHAIN_DB = db_path
+        after = pooled(hashes, args.queries)
+        ConnectionPool.instance(db_path).close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("connection per query: {:>10.0f} queries/s".format(before))
+    print("pooled WAL:           {:>10.0f} queries/s".format(after))
+    print("speedup:              {:>10.1f}x".format(after / before))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Times how long a node takes to retrieve the transactions of a large relayed block from its sender: one request per
+transaction hash (the previous behaviour) against the batched transactions endpoint.  The sender is a bottle server
+on 127.0.0.2 holding the transactions in a temporary mempool, and --latency adds a delay to every request to
+stand in for the network round trip.
+
+Usage: python -m benchmarks.transaction_fetch [--transactions N] [--latency MS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from bottle import Bottle
+from mock import Mock, patch
+
+from crankycoin import config
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
+from crankycoin.repository.peers import Peers
+from crankycoin.routes import permissioned
+from crankycoin.routes.permissioned import permissioned_app
+from crankycoin.routes.public import public_app
+from crankycoin.services.api_client import ApiClient
+
+HOST = "127.0.0.2"
+PORT = 30098
+
+
+def start_sender(latency):
+    app = Bottle()
+    app.merge(public_app)
+    app.merge(permissioned_app)
+    app.add_hook('before_request', lambda: time.sleep(latency))
+    thread = threading.Thread(target=app.run, kwargs=dict(host=HOST, port=PORT, quiet=True))
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='block transaction retrieval benchmark')
+    parser.add_argument('--transactions', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=5.0, help='milliseconds added to every request')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with patch.object(Mempool, "POOL_DB", os.path.join(tmpdir, "pool.db")):
+            mempool = Mempool()
+        tx_hashes = []
+        for i in range(args.transactions):
+            transaction = Transaction("src{}".format(i), "dest{}".format(i), 1, 0.01, prev_hash="p{}".format(i),
+                                      timestamp=1524041935, signature="sig")
+            mempool.push_unconfirmed_transaction(transaction)
+            tx_hashes.append(transaction.tx_hash)
+
+        with patch.object(permissioned, 'valid_ip', return_value=True), \
+                patch.object(Blockchain, "CHAIN_DB", os.path.join(tmpdir, "chain.db")), \
+                patch.object(Mempool, "POOL_DB", os.path.join(tmpdir, "pool.db")):
+            start_sender(args.latency / 1000.0)
+            api_client = ApiClient(Mock(Peers))
+            # the per-hash path of the sender's mempool
+            api_client.TRANSACTIONS_URL = config['network']['unconfirmed_transactions_url']
+
+            start = time.time()
+            transactions = [api_client.request_transaction(HOST, PORT, tx_hash) for tx_hash in tx_hashes]
+            per_hash_seconds = time.time() - start
+            assert all(transactions)
+
+            start = time.time()
+            transactions = api_client.request_transactions(HOST, PORT, tx_hashes)
+            batch_seconds = time.time() - start
+            assert [transaction.tx_hash for transaction in transactions] == tx_hashes
+
+        requests_per_batch = -(-len(tx_hashes) // api_client.MAX_TRANSACTIONS_BATCH)
+        print("{} transactions, {} ms added per request".format(len(tx_hashes), args.latency))
+        print("{:<10} {:>6} requests  {:>9.1f} ms".format("per hash", len(tx_hashes), 1000 * per_hash_seconds))
+        print("{:<10} {:>6} requests  {:>9.1f} ms".format("batched", requests_per_batch, 1000 * batch_seconds))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS balances(
+    address CHAR(70) NOT NULL,
+    asset CHAR(32) NOT NULL,
+    branch INTEGER DEFAULT 0,
+    amount REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (address, asset, branch)
+) WITHOUT ROWID;
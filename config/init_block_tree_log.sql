@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS block_tree_log(
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash CHAR(32) NOT NULL,
+    prevHash CHAR(32) NOT NULL,
+    height INTEGER NOT NULL,
+    branch INTEGER NOT NULL
+);
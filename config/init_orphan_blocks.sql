@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS orphan_blocks(
+    hash CHAR(64) NOT NULL,
+    prevHash CHAR(64) NOT NULL,
+    block TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    receivedAt INTEGER NOT NULL,
+    PRIMARY KEY (hash)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_orphan_blocks_prev_hash ON orphan_blocks(prevHash);
+CREATE INDEX IF NOT EXISTS idx_orphan_blocks_received_at ON orphan_blocks(receivedAt);
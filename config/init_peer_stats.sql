@@ -0,0 +1,14 @@
+CREATE TABLE IF NOT EXISTS peer_stats(
+    host CHAR(100) NOT NULL,
+    pid INTEGER NOT NULL,
+    requests INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    retries INTEGER NOT NULL,
+    rejected INTEGER NOT NULL,
+    circuitOpen INTEGER NOT NULL,
+    latencyMean REAL,
+    latencyP50 REAL,
+    latencyP95 REAL,
+    updatedAt INTEGER NOT NULL,
+    PRIMARY KEY (host, pid)
+) WITHOUT ROWID;
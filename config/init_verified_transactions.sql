@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS verified_transactions(
+    hash CHAR(32) NOT NULL,
+    verifiedAt INTEGER NOT NULL,
+    lastUsed INTEGER NOT NULL,
+    PRIMARY KEY (hash)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_verified_transactions_last_used ON verified_transactions(lastUsed);
+CREATE INDEX IF NOT EXISTS idx_verified_transactions_verified_at ON verified_transactions(verifiedAt);
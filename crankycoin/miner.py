@@ -1,20 +1,103 @@
+import json
 import logging
 import multiprocessing as mp
+import os
+import threading
 import time
+from collections import deque
 
-from crankycoin.models.block import Block
+from crankycoin.models.block import Block, HeaderTemplate
 from crankycoin.models.transaction import Transaction
 from crankycoin.models.enums import MessageType, TransactionType
+from crankycoin.services.chain_tip import ChainTip
 from crankycoin.services.queue import Queue
 from crankycoin import config, logger
 
 
+class MinerStats(object):
+    """
+    Mining counters shared by the worker processes.  Rolling rates are sampled by the process that started the
+    miner.
+    """
+
+    WINDOW = config['user']['miner_stats_window']
+
+    def __init__(self):
+        self.hash_count = mp.Value('L', 0)
+        self.templates_built = mp.Value('L', 0)
+        self.template_build_seconds = mp.Value('d', 0.0)
+        self.stale_templates = mp.Value('L', 0)
+        self.blocks_found = mp.Value('L', 0)
+        self.blocks_accepted = mp.Value('L', 0)
+        self.accept_seconds = mp.Value('d', 0.0)
+        self.samples = deque()
+
+    @staticmethod
+    def add(counter, amount=1):
+        with counter.get_lock():
+            counter.value += amount
+
+    def record_template(self, seconds):
+        self.add(self.templates_built)
+        self.add(self.template_build_seconds, seconds)
+
+    def record_block(self, accepted, seconds):
+        """
+        :param accepted: whether add_block connected the block
+        :type accepted: bool
+        :param seconds: time from finding the nonce to add_block returning
+        :type seconds: float
+        """
+        self.add(self.blocks_found)
+        if accepted:
+            self.add(self.blocks_accepted)
+            self.add(self.accept_seconds, seconds)
+
+    def snapshot(self):
+        """
+        Samples the counters.  The hash rate covers the last WINDOW seconds of samples.
+
+        :return: current mining statistics
+        :rtype: dict
+        """
+        now, hashes = time.time(), self.hash_count.value
+        self.samples.append((now, hashes))
+        # keep the newest sample taken at or before the start of the window
+        while len(self.samples) > 1 and now - self.samples[1][0] >= self.WINDOW:
+            self.samples.popleft()
+        first_time, first_hashes = self.samples[0]
+        templates_built = self.templates_built.value
+        stale_templates = self.stale_templates.value
+        blocks_accepted = self.blocks_accepted.value
+        return {
+            'timestamp': now,
+            'hash_rate': (hashes - first_hashes) / (now - first_time) if now > first_time else 0.0,
+            'hashes': hashes,
+            'templates_built': templates_built,
+            'stale_templates': stale_templates,
+            'stale_rate': float(stale_templates) / templates_built if templates_built else 0.0,
+            'template_build_ms': 1000 * self.template_build_seconds.value / templates_built
+            if templates_built else 0.0,
+            'blocks_found': self.blocks_found.value,
+            'blocks_accepted': blocks_accepted,
+            'accept_latency_ms': 1000 * self.accept_seconds.value / blocks_accepted if blocks_accepted else 0.0
+        }
+
+
 class Miner(object):
 
     HOST = config['user']['ip']
     REWARD_ADDRESS = config['user']['public_key']
     MAX_TRANSACTIONS_PER_BLOCK = config['network']['max_transactions_per_block']
-    miner_process = None
+    WORKER_PROCESSES = config['user']['miner_workers'] or mp.cpu_count()
+    MAX_NONCE = 0xffffffff
+    NONCE_BATCH_SIZE = 64
+    TIP_POLL_INTERVAL = config['user']['miner_tip_poll_interval']
+    STATS_FILE = config['user']['miner_stats_file']
+    STATS_INTERVAL = config['user']['miner_stats_interval']
+    miner_processes = None
+    tip_subscriber = None
+    stats_thread = None
 
     def __init__(self, blockchain, mempool):
         mp.log_to_stderr()
@@ -22,30 +105,96 @@ class Miner(object):
         mp_logger.setLevel(logging.DEBUG)
         self.blockchain = blockchain
         self.mempool = mempool
+        # shared across worker processes. tip_generation is bumped whenever a worker connects a block
+        self.tip_generation = mp.Value('L', 0)
+        self.stats = MinerStats()
+        self.stats_stop = threading.Event()
 
     def start(self):
-        logger.debug("mining process starting with reward address %s...", self.REWARD_ADDRESS)
-        self.miner_process = mp.Process(target=self.mine)
-        self.miner_process.start()
+        logger.debug("%s mining process(es) starting with reward address %s...",
+                     self.WORKER_PROCESSES, self.REWARD_ADDRESS)
+        self.miner_processes = [mp.Process(target=self.mine, args=(i, self.WORKER_PROCESSES))
+                                for i in range(self.WORKER_PROCESSES)]
+        for mp_process in self.miner_processes:
+            mp_process.start()
+        self.stats_stop.clear()
+        self.stats_thread = threading.Thread(target=self.report_stats)
+        self.stats_thread.daemon = True
+        self.stats_thread.start()
 
     def shutdown(self):
-        logger.debug("mining process with reward address %s shutting down...", self.REWARD_ADDRESS)
-        self.miner_process.terminate()
+        logger.debug("mining process(es) with reward address %s shutting down...", self.REWARD_ADDRESS)
+        for mp_process in self.miner_processes:
+            mp_process.terminate()
+        self.stats_stop.set()
+
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        stats['workers'] = self.WORKER_PROCESSES
+        return stats
 
-    def mine(self):
+    def report_stats(self):
+        while not self.stats_stop.wait(self.STATS_INTERVAL):
+            self.write_stats()
+
+    def write_stats(self):
+        """
+        Writes the current statistics as JSON to STATS_FILE.  The file is replaced atomically so readers never see
+        a partial write.
+        """
+        stats = self.get_stats()
+        logger.debug("mining at %.1f hashes/s, %s of %s templates stale", stats['hash_rate'],
+                     stats['stale_templates'], stats['templates_built'])
+        temp_path = self.STATS_FILE + ".tmp"
+        try:
+            with open(temp_path, 'w') as stats_file:
+                json.dump(stats, stats_file, sort_keys=True)
+            os.replace(temp_path, self.STATS_FILE)
+        except (IOError, OSError) as e:
+            logger.warn("could not write miner stats to %s: %s", self.STATS_FILE, e)
+
+    def mine(self, worker_index=0, worker_count=1):
+        self.tip_subscriber = ChainTip.subscribe()
         while True:
-            block = self.mine_block()
+            block = self.mine_block(worker_index, worker_count)
             if not block:
                 continue
+            found = time.time()
             logger.info("Block {} found at height {} and nonce {}"
                         .format(block.block_header.hash, block.height, block.block_header.nonce))
-            if self.blockchain.add_block(block):
-                self.mempool.remove_unconfirmed_transactions(block.transactions[1:])
-                message = {"host": self.HOST, "type": MessageType.BLOCK_HEADER.value, "data": block.block_header.to_json()}
-                Queue.enqueue(message)
+            accepted = self.connect_block(block)
+            self.stats.record_block(accepted, time.time() - found)
         return
 
-    def mine_block(self):
+    def connect_block(self, block):
+        """
+        Adds a solved block to the chain, clears its transactions from the mempool and announces it to peers
+
+        :param block: solved block
+        :type block: Block
+        :return: True if the block was connected
+        :rtype: bool
+        """
+        if not self.blockchain.add_block(block):
+            return False
+        # signal the other workers to abandon their templates
+        with self.tip_generation.get_lock():
+            self.tip_generation.value += 1
+        self.mempool.remove_unconfirmed_transactions(block.transactions[1:])
+        message = {"host": self.HOST, "type": MessageType.BLOCK_HEADER.value, "data": block.block_header.to_json()}
+        if not Queue.enqueue(message, wait=True):
+            logger.warn("Block {} connected but its announcement was dropped".format(block.block_header.hash))
+        return True
+
+    def create_block_template(self, nonce=0):
+        """
+        Builds an unsolved block on top of the tallest chain holding the coinbase and a chunk of the mempool
+
+        :param nonce: initial nonce
+        :type nonce: int
+        :return: unsolved block
+        :rtype: Block
+        """
         latest_block = self.blockchain.get_tallest_block_header()
         if latest_block is not None:
             latest_block_header = latest_block[0]
@@ -77,17 +226,66 @@ class Miner(object):
         transactions.insert(0, coinbase)
 
         timestamp = int(time.time())
-        i = 0
-        block = Block(new_block_height, transactions, previous_hash, timestamp)
-
-        while block.block_header.hash_difficulty < self.blockchain.calculate_hash_difficulty():
-            latest_block = self.blockchain.get_tallest_block_header()
-            if latest_block is not None:
-                latest_block_header = latest_block[0]
-                latest_block_height = latest_block[2]
-                if latest_block_height >= new_block_height or latest_block_header.hash != previous_hash:
-                    # Next block in sequence was mined by another node.  Stop mining current block.
+        return Block(new_block_height, transactions, previous_hash, timestamp, nonce=nonce)
+
+    def mine_block(self, worker_index=0, worker_count=1):
+        """
+        Searches the nonces congruent to worker_index modulo worker_count.  When that slice of the nonce space is
+        exhausted the timestamp is advanced and the search starts over.
+
+        :param worker_index: index of this mining process
+        :type worker_index: int
+        :param worker_count: total number of mining processes
+        :type worker_count: int
+        :return: solved block, or None if the chain tip moved
+        :rtype: Block
+        """
+        tip_generation = self.tip_generation.value
+        i = worker_index
+        build_start = time.time()
+        block = self.create_block_template(nonce=i)
+        previous_hash = block.block_header.previous_hash
+        new_block_height = block.height
+        template = HeaderTemplate(block.block_header)
+        # the target only depends on the chain the template extends
+        target_difficulty = self.blockchain.calculate_hash_difficulty()
+        self.stats.record_template(time.time() - build_start)
+        next_tip_poll = time.time() + self.TIP_POLL_INTERVAL
+
+        while True:
+            # nonces are hashed in batches.  Staleness is checked between batches
+            stop = min(i + worker_count * self.NONCE_BATCH_SIZE, self.MAX_NONCE + 1)
+            nonce, hashes = template.search(range(i, stop, worker_count), target_difficulty)
+            self._record_hashes(hashes)
+            if nonce is not None:
+                block.block_header.nonce = nonce
+                return block
+            if self.tip_generation.value != tip_generation:
+                # Another worker connected a block.  Stop mining current block.
+                self.stats.add(self.stats.stale_templates)
+                return None
+            if self.tip_subscriber is not None:
+                tip = ChainTip.poll(self.tip_subscriber)
+                if tip is not None and tip['hash'] != previous_hash:
+                    # Next block in sequence was connected.  Stop mining current block.
+                    self.stats.add(self.stats.stale_templates)
                     return None
-            i += 1
-            block.block_header.nonce = i
-        return block
+            if time.time() >= next_tip_poll:
+                # fall back to the database in case a tip notification was lost
+                next_tip_poll = time.time() + self.TIP_POLL_INTERVAL
+                latest_block = self.blockchain.get_tallest_block_header()
+                if latest_block is not None:
+                    latest_block_header = latest_block[0]
+                    latest_block_height = latest_block[2]
+                    if latest_block_height >= new_block_height or latest_block_header.hash != previous_hash:
+                        # Next block in sequence was mined by another node.  Stop mining current block.
+                        self.stats.add(self.stats.stale_templates)
+                        return None
+            i += worker_count * hashes
+            if i > self.MAX_NONCE:
+                i = worker_index
+                block.block_header.timestamp = max(int(time.time()), block.block_header.timestamp + 1)
+                template = HeaderTemplate(block.block_header)
+
+    def _record_hashes(self, hashes):
+        self.stats.add(self.stats.hash_count, hashes)
@@ -2,22 +2,34 @@ import codecs
 import hashlib
 import json
 import time
-import pyscrypt
 
+from crankycoin.models.enums import TransactionType
 from crankycoin.models.transaction import Transaction
 from crankycoin.models.errors import InvalidTransactions
+from crankycoin.models.proof_of_work import get_hash_function, scrypt_hash
 from crankycoin import config
 
 
 class BlockHeader(object):
 
+    # the memoized hash lives in a slot rather than __dict__ so it never leaks into to_dict(), to_json() or __eq__
+    __slots__ = ('_hash', '__dict__')
+    HASHABLE_FIELDS = frozenset(('version', 'previous_hash', 'merkle_root', 'timestamp', 'nonce'))
+
     def __init__(self, previous_hash, merkle_root, timestamp=None, nonce=0, version=None):
+        self._hash = None
         self.version = config['network']['version'] if version is None else int(version)
         self.previous_hash = previous_hash
         self.merkle_root = merkle_root
         self.nonce = int(nonce)
         self.timestamp = int(time.time()) if timestamp is None else int(timestamp)
 
+    def __setattr__(self, name, value):
+        if name in self.HASHABLE_FIELDS:
+            # any change to a hashed field invalidates the memoized hash
+            object.__setattr__(self, '_hash', None)
+        object.__setattr__(self, name, value)
+
     def to_hashable(self):
         return "{0:0>8x}".format(self.version) + \
             self.previous_hash + \
@@ -28,18 +40,15 @@ class BlockHeader(object):
     @property
     def hash(self):
         """
+        scrypt hash of the header.  Computed once and memoized until a hashed field changes
+
         :return: scrypt hash
         :rtype: str
         """
-        hashable = self.to_hashable().encode('utf-8')
-        hash_object = pyscrypt.hash(
-            password=hashable,
-            salt=hashable,
-            N=1024,
-            r=1,
-            p=1,
-            dkLen=32)
-        return codecs.encode(hash_object, 'hex')
+        if self._hash is None:
+            hash_object = scrypt_hash(self.to_hashable().encode('utf-8'))
+            self._hash = codecs.encode(hash_object, 'hex').decode('utf-8')
+        return self._hash
 
     @property
     def hash_difficulty(self):
@@ -80,6 +89,63 @@ class BlockHeader(object):
         return not self == other
 
 
+class HeaderTemplate(object):
+    """
+    Mining view of a block header.  The hashable form is encoded once and only its trailing 8 hex digit nonce is
+    rewritten between attempts.
+    """
+
+    NONCE_LENGTH = 8
+
+    def __init__(self, block_header):
+        self._buffer = bytearray(block_header.to_hashable().encode('utf-8'))
+        self._hash_function = get_hash_function()
+
+    @classmethod
+    def from_prefix(cls, header_prefix):
+        """
+        Rebuilds a template from the hashable header without its nonce, as handed out by getwork
+
+        :param header_prefix: hashable header minus the trailing nonce digits
+        :type header_prefix: str
+        :rtype: HeaderTemplate
+        """
+        template = cls.__new__(cls)
+        template._buffer = bytearray((header_prefix + '0' * cls.NONCE_LENGTH).encode('utf-8'))
+        template._hash_function = get_hash_function()
+        return template
+
+    @property
+    def header_prefix(self):
+        return bytes(self._buffer[:-self.NONCE_LENGTH]).decode('utf-8')
+
+    def search(self, nonces, target_difficulty):
+        """
+        Hashes candidate nonces until one meets the target difficulty
+
+        :param nonces: candidate nonces, each below 2**32
+        :type nonces: iterable of int
+        :param target_difficulty: required number of leading zeros in the hex digest
+        :type target_difficulty: int
+        :return: winning nonce or None, number of nonces hashed
+        :rtype: tuple(int, int)
+        """
+        buffer = self._buffer
+        hash_function = self._hash_function
+        # n leading hex zeros are n // 2 zero bytes, followed by a byte below 0x10 when n is odd
+        zero_bytes = target_difficulty // 2
+        zero_prefix = b'\x00' * zero_bytes
+        odd = target_difficulty % 2
+        count = 0
+        for nonce in nonces:
+            count += 1
+            buffer[-self.NONCE_LENGTH:] = b'%08x' % nonce
+            digest = hash_function(bytes(buffer))
+            if digest[:zero_bytes] == zero_prefix and (not odd or digest[zero_bytes] < 0x10):
+                return nonce, count
+        return None, count
+
+
 class Block(object):
 
     transactions = []
@@ -122,11 +188,11 @@ class Block(object):
             for i in range(0, len(merkle_base), 2):
                 if i == len(merkle_base) - 1:
                     temp_merkle_base.append(
-                        hashlib.sha256(merkle_base[i]).hexdigest()
+                        hashlib.sha256(merkle_base[i].encode('utf-8')).hexdigest()
                     )
                 else:
                     temp_merkle_base.append(
-                        hashlib.sha256(merkle_base[i] + merkle_base[i+1]).hexdigest()
+                        hashlib.sha256((merkle_base[i] + merkle_base[i+1]).encode('utf-8')).hexdigest()
                     )
             merkle_base = temp_merkle_base
         return merkle_base[0]
@@ -181,5 +247,81 @@ class Block(object):
         return not self == other
 
 
+class CompactBlock(object):
+    """
+    Block announcement carrying the header, the coinbase and a short id for each of the other transactions in block
+    order.  Receivers rebuild the block from their mempool and request only the transactions they lack.
+    """
+
+    # bytes of a short id.  Ids are keyed by the block hash so that collisions cannot be prepared ahead of a block
+    SHORT_ID_LENGTH = 6
+
+    def __init__(self, height, block_header, coinbase, short_ids):
+        """
+        :param height: height of the block
+        :type height: int
+        :param block_header: block header
+        :type block_header: BlockHeader
+        :param coinbase: coinbase transaction
+        :type coinbase: Transaction
+        :param short_ids: short ids of the other transactions in block order
+        :type short_ids: list of str
+        """
+        self.height = height
+        self.block_header = block_header
+        self.coinbase = coinbase
+        self.short_ids = short_ids
+
+    @staticmethod
+    def block_order(transactions):
+        # the coinbase first and the other transactions by hash, as in Block.transactions
+        return sorted(transactions, key=lambda t: (TransactionType(t.tx_type) != TransactionType.COINBASE, t.tx_hash))
+
+    @classmethod
+    def from_transactions(cls, height, block_header, transactions):
+        """
+        :param height: height of the block
+        :type height: int
+        :param block_header: block header
+        :type block_header: BlockHeader
+        :param transactions: transactions of the block, in any order
+        :type transactions: list of Transaction
+        :rtype: CompactBlock
+        """
+        transactions = cls.block_order(transactions)
+        block_hash = block_header.hash
+        return cls(height, block_header, transactions[0],
+                   [cls.calculate_short_id(block_hash, transaction.tx_hash) for transaction in transactions[1:]])
+
+    @classmethod
+    def calculate_short_id(cls, block_hash, tx_hash):
+        return hashlib.blake2b(tx_hash.encode('utf-8'), digest_size=cls.SHORT_ID_LENGTH,
+                               key=block_hash.encode('utf-8')[:64]).hexdigest()
+
+    def short_id(self, tx_hash):
+        return self.calculate_short_id(self.block_header.hash, tx_hash)
+
+    def to_dict(self):
+        return {
+            'height': self.height,
+            'block_header': self.block_header.to_dict(),
+            'coinbase': self.coinbase.to_dict(),
+            'short_ids': self.short_ids
+        }
+
+    @classmethod
+    def from_dict(cls, compact_block_dict):
+        # the coinbase hash is recomputed from its contents, so an altered coinbase fails the merkle root check
+        return cls(
+            compact_block_dict['height'],
+            BlockHeader.from_dict(compact_block_dict['block_header']),
+            Transaction.from_dict(compact_block_dict['coinbase']),
+            compact_block_dict['short_ids']
+        )
+
+    def __repr__(self):
+        return "<Compact Block {}>".format(self.block_header.hash)
+
+
 if __name__ == "__main__":
     pass
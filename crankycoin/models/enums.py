@@ -9,6 +9,7 @@ class MessageType(Enum):
     UNCONFIRMED_TRANSACTION_INV = 4
     BLOCK_TRANSACTION_INV = 5
     SYNCHRONIZE = 6
+    COMPACT_BLOCK = 7
 
 
 class TransactionType(Enum):
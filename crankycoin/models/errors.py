@@ -27,3 +27,7 @@ class InvalidTransactionHash(Exception):
 
 class InvalidCoinbaseTransaction(BlockchainException):
     pass
+
+
+class PowBackendMismatch(Exception):
+    pass
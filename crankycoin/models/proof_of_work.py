@@ -0,0 +1,127 @@
+from collections import OrderedDict
+import hashlib
+import random
+
+from crankycoin import config, logger
+from crankycoin.models.errors import PowBackendMismatch
+
+try:
+    import pyscrypt
+except ImportError:
+    pyscrypt = None
+
+SCRYPT_N = 1024
+SCRYPT_R = 1
+SCRYPT_P = 1
+SCRYPT_DKLEN = 32
+
+POW_BACKEND = config['user']['pow_backend']
+POW_CROSS_CHECK_RATE = config['user']['pow_cross_check_rate']
+
+
+def _hashlib_scrypt(hashable):
+    return hashlib.scrypt(hashable, salt=hashable, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=SCRYPT_DKLEN)
+
+
+def _pyscrypt(hashable):
+    return pyscrypt.hash(password=hashable, salt=hashable, N=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dkLen=SCRYPT_DKLEN)
+
+
+# backends in order of preference.  Each entry maps a name to a tuple of (hash function, availability check)
+BACKENDS = OrderedDict()
+_selected = None
+
+
+def register_backend(name, func, available=lambda: True):
+    """
+    Registers a scrypt(N=1024, r=1, p=1, dkLen=32) implementation taking the header bytes as password and salt
+
+    :param name: backend name as referenced by the pow_backend setting
+    :type name: str
+    :param func: callable returning the raw 32 byte digest
+    :type func: callable
+    :param available: callable reporting whether the backend can run in this interpreter
+    :type available: callable
+    """
+    global _selected
+    BACKENDS[name] = (func, available)
+    _selected = None
+
+
+register_backend('hashlib', _hashlib_scrypt, lambda: hasattr(hashlib, 'scrypt'))
+register_backend('pyscrypt', _pyscrypt, lambda: pyscrypt is not None)
+
+
+def available_backends():
+    return [name for name, (func, available) in BACKENDS.items() if available()]
+
+
+def get_backend(name=None):
+    """
+    :param name: backend name.  "auto" or None selects the most preferred available backend
+    :type name: str
+    :return: name and hash function of the backend
+    :rtype: tuple(str, callable)
+    """
+    if name is None or name == 'auto':
+        names = available_backends()
+        if not names:
+            raise RuntimeError("No scrypt backend available.  Install pyscrypt or an OpenSSL-backed hashlib")
+        name = names[0]
+    func, available = BACKENDS[name]
+    if not available():
+        raise RuntimeError("scrypt backend {} is not available".format(name))
+    return name, func
+
+
+def get_hash_function():
+    """
+    :return: hash function of the configured backend, without sampled cross-checks
+    :rtype: callable
+    """
+    global _selected
+    if _selected is None:
+        _selected = get_backend(POW_BACKEND)
+        logger.debug("using %s scrypt backend", _selected[0])
+    return _selected[1]
+
+
+def scrypt_hash(hashable):
+    """
+    Hashes a block header with the configured backend.  A sample of calls, set by pow_cross_check_rate, is also
+    hashed with every other available backend and compared.
+
+    :param hashable: utf-8 encoded block header
+    :type hashable: bytes
+    :return: raw scrypt digest
+    :rtype: bytes
+    """
+    digest = get_hash_function()(hashable)
+    if POW_CROSS_CHECK_RATE and random.random() < POW_CROSS_CHECK_RATE:
+        compare_backends(hashable, digest, _selected[0])
+    return digest
+
+
+def compare_backends(hashable, digest=None, reference=None):
+    """
+    Hashes the same input with every available backend and raises PowBackendMismatch on any disagreement
+
+    :param hashable: utf-8 encoded block header
+    :type hashable: bytes
+    :param digest: already computed digest of the reference backend, if any
+    :type digest: bytes
+    :param reference: name of the backend that produced digest
+    :type reference: str
+    :return: digest agreed on by all backends
+    :rtype: bytes
+    """
+    for name in available_backends():
+        if name == reference:
+            continue
+        other = BACKENDS[name][0](hashable)
+        if digest is None:
+            digest, reference = other, name
+        elif other != digest:
+            logger.error("scrypt backends %s and %s disagree on %s", reference, name, hashable)
+            raise PowBackendMismatch("scrypt backends {} and {} disagree on {}".format(reference, name, hashable))
+    return digest
@@ -0,0 +1,114 @@
+from unittest import TestCase
+from mock import patch
+
+from crankycoin.models import block
+from crankycoin.models.block import Block, BlockHeader, CompactBlock, HeaderTemplate
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.services.validator import Validator
+
+
+class TestBlockHeader(TestCase):
+
+    def setUp(self):
+        self.subject = BlockHeader("previous_hash", "merkle_root", timestamp=1524041935, nonce=7, version=1)
+
+    def test_hash_When_read_repeatedly_Computes_scrypt_once(self):
+        with patch.object(block, 'scrypt_hash', wraps=block.scrypt_hash) as patched_scrypt:
+            first = self.subject.hash
+            second = self.subject.hash
+            difficulty = self.subject.hash_difficulty
+
+        self.assertEqual(first, second)
+        self.assertEqual(patched_scrypt.call_count, 1)
+
+    def test_hash_When_hashed_field_changes_Recomputes(self):
+        for field, value in (('nonce', 8), ('timestamp', 1524041936), ('merkle_root', 'other_root'),
+                             ('previous_hash', 'other_hash'), ('version', 2)):
+            subject = BlockHeader("previous_hash", "merkle_root", timestamp=1524041935, nonce=7, version=1)
+            original = subject.hash
+
+            setattr(subject, field, value)
+
+            fresh = BlockHeader.from_dict(subject.to_dict())
+            self.assertNotEqual(subject.hash, original, field)
+            self.assertEqual(subject.hash, fresh.hash, field)
+
+    def test_to_dict_When_hash_memoized_Excludes_hash(self):
+        self.subject.hash
+
+        self.assertNotIn('hash', self.subject.to_dict())
+        self.assertEqual(self.subject, BlockHeader.from_dict(self.subject.to_dict()))
+
+
+class TestHeaderTemplate(TestCase):
+
+    def setUp(self):
+        self.block_header = BlockHeader("previous_hash", "merkle_root", timestamp=1524041935, nonce=0, version=1)
+
+    def test_search_When_nonce_meets_target_Agrees_with_block_header(self):
+        for target_difficulty in (1, 2):
+            nonce, count = HeaderTemplate(self.block_header).search(range(1000), target_difficulty)
+
+            self.assertEqual(count, nonce + 1)
+            for earlier in range(nonce):
+                self.block_header.nonce = earlier
+                self.assertLess(self.block_header.hash_difficulty, target_difficulty)
+            self.block_header.nonce = nonce
+            self.assertGreaterEqual(self.block_header.hash_difficulty, target_difficulty)
+
+    def test_search_When_no_nonce_meets_target_Returns_none_and_count(self):
+        nonce, count = HeaderTemplate(self.block_header).search(range(3, 15, 4), 64)
+
+        self.assertIsNone(nonce)
+        self.assertEqual(count, 3)
+
+
+class TestCompactBlock(TestCase):
+
+    def setUp(self):
+        self.coinbase = Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value, timestamp=1524041935,
+                                    signature="")
+        self.transactions = [Transaction("src{}".format(i), "dest", 1, 0, prev_hash="prev{}".format(i),
+                                         timestamp=1524041935, signature="sig") for i in range(5)]
+        self.block = Block(2, [self.coinbase] + self.transactions, "previous_hash", timestamp=1524041935)
+
+    def test_calculate_merkle_root_When_many_transactions_Agrees_with_validator(self):
+        tx_hashes = [transaction.tx_hash for transaction in self.block.transactions]
+
+        self.assertEqual(self.block.block_header.merkle_root, Validator.calculate_merkle_root(tx_hashes))
+
+    def test_from_transactions_Lists_short_ids_in_block_order(self):
+        subject = CompactBlock.from_transactions(2, self.block.block_header, list(reversed(self.transactions)) +
+                                                 [self.coinbase])
+
+        self.assertEqual(subject.coinbase, self.coinbase)
+        self.assertEqual(subject.short_ids, [subject.short_id(transaction.tx_hash)
+                                             for transaction in self.block.transactions[1:]])
+        self.assertEqual(len(subject.short_ids[0]), 2 * CompactBlock.SHORT_ID_LENGTH)
+
+    def test_short_id_Depends_on_block_hash(self):
+        other_header = BlockHeader("other_hash", "merkle_root", timestamp=1524041935, nonce=0, version=1)
+        tx_hash = self.transactions[0].tx_hash
+
+        self.assertNotEqual(CompactBlock.calculate_short_id(self.block.block_header.hash, tx_hash),
+                            CompactBlock.calculate_short_id(other_header.hash, tx_hash))
+
+    def test_from_dict_Restores_to_dict(self):
+        subject = CompactBlock.from_transactions(2, self.block.block_header, self.block.transactions)
+
+        restored = CompactBlock.from_dict(subject.to_dict())
+
+        self.assertEqual(restored.to_dict(), subject.to_dict())
+        self.assertEqual(restored.block_header.hash, self.block.block_header.hash)
+
+    def test_from_dict_When_coinbase_tampered_Recomputes_its_hash(self):
+        compact_block_dict = CompactBlock.from_transactions(2, self.block.block_header,
+                                                            self.block.transactions).to_dict()
+        compact_block_dict['coinbase']['destination'] = "thief"
+
+        restored = CompactBlock.from_dict(compact_block_dict)
+
+        self.assertNotEqual(restored.coinbase.tx_hash, self.coinbase.tx_hash)
+        tx_hashes = [restored.coinbase.tx_hash] + [transaction.tx_hash for transaction in self.transactions]
+        self.assertNotEqual(Validator.calculate_merkle_root(tx_hashes), self.block.block_header.merkle_root)
@@ -0,0 +1,34 @@
+from unittest import TestCase
+from mock import patch
+
+from crankycoin.models import proof_of_work
+from crankycoin.models.block import BlockHeader
+from crankycoin.models.errors import PowBackendMismatch
+
+
+class TestProofOfWork(TestCase):
+
+    def test_get_backend_When_auto_Returns_most_preferred_available_backend(self):
+        name, func = proof_of_work.get_backend('auto')
+
+        self.assertEqual(name, proof_of_work.available_backends()[0])
+
+    def test_get_backend_When_backend_unavailable_Raises_runtime_error(self):
+        with patch.dict(proof_of_work.BACKENDS, {'missing': (lambda h: h, lambda: False)}):
+            with self.assertRaises(RuntimeError):
+                proof_of_work.get_backend('missing')
+
+    def test_compare_backends_Returns_digest_shared_by_all_backends(self):
+        for nonce in range(3):
+            hashable = BlockHeader("previous_hash", "merkle_root", 1524041935, nonce, 1).to_hashable().encode('utf-8')
+            expected = proof_of_work.get_backend('auto')[1](hashable)
+
+            result = proof_of_work.compare_backends(hashable)
+
+            self.assertEqual(result, expected)
+            self.assertEqual(len(result), proof_of_work.SCRYPT_DKLEN)
+
+    def test_compare_backends_When_backends_disagree_Raises_pow_backend_mismatch(self):
+        with patch.dict(proof_of_work.BACKENDS, {'broken': (lambda h: b'\x00' * 32, lambda: True)}):
+            with self.assertRaises(PowBackendMismatch):
+                proof_of_work.compare_backends(b'header')
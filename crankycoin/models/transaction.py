@@ -1,3 +1,4 @@
+import codecs
 import coincurve
 import hashlib
 import json
@@ -37,7 +38,7 @@ class Transaction(object):
         if asset is None:
             self._asset = '29bb7eb4fa78fc709e1b8b88362b7f8cb61d9379667ad4aedc8ec9f664e16680'
         if tx_hash is None and signature is not None:
-            self._tx_hash = self._calculate_tx_hash()
+            self._tx_hash = self.calculate_tx_hash()
 
     @property
     def source(self):
@@ -83,7 +84,7 @@ class Transaction(object):
     def signature(self):
         return self._signature
 
-    def _calculate_tx_hash(self):
+    def calculate_tx_hash(self):
         """
         Calculates sha256 hash of transaction (source, destination, amount, timestamp, signature)
 
@@ -107,9 +108,10 @@ class Transaction(object):
         return hash_object.hexdigest()
 
     def sign(self, private_key):
-        signature = codecs.encode(coincurve.PrivateKey.from_hex(private_key).sign(self.to_signable()), 'hex')
+        signature = codecs.encode(coincurve.PrivateKey.from_hex(private_key).sign(self.to_signable().encode('utf-8')),
+                                  'hex').decode('utf-8')
         self._signature = signature
-        self._tx_hash = self._calculate_tx_hash()
+        self._tx_hash = self.calculate_tx_hash()
         return signature
 
     def to_signable(self):
@@ -126,7 +128,25 @@ class Transaction(object):
         ))
 
     def verify(self):
-        return coincurve.PublicKey(codecs.decode(self._source, 'hex')).verify(codecs.decode(self._signature, 'hex'), self.to_signable())
+        return self.verify_signature(self._source, self._signature, self.to_signable())
+
+    @staticmethod
+    def verify_signature(source, signature, signable):
+        """
+        :param source: hex encoded public key
+        :type source: str
+        :param signature: hex encoded signature
+        :type signature: str
+        :param signable: output of to_signable()
+        :type signable: str
+        :return: True if signature is valid for signable under source.  Malformed keys or signatures are invalid
+        :rtype: bool
+        """
+        try:
+            return coincurve.PublicKey(codecs.decode(source, 'hex')).verify(codecs.decode(signature, 'hex'),
+                                                                            signable.encode('utf-8'))
+        except (ValueError, TypeError):
+            return False
 
     def to_json(self):
         return json.dumps(self, default=lambda o: {key.lstrip('_'): value for key, value in o.__dict__.items()},
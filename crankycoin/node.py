@@ -1,13 +1,17 @@
 import json
 import logging
 import multiprocessing as mp
+import time
 from bottle import Bottle
 
-from crankycoin.models.block import Block, BlockHeader
+from crankycoin.models.block import Block, BlockHeader, CompactBlock
 from crankycoin.models.transaction import Transaction
 from crankycoin.models.enums import MessageType, TransactionType
+from crankycoin.services.block_downloader import BlockDownloader
+from crankycoin.services.chain_tip import ChainTip
 from crankycoin.services.queue import Queue
-from crankycoin.routes.permissioned import permissioned_app
+from crankycoin.routes.mining import mining_app
+from crankycoin.routes.permissioned import permissioned_app, seen_inventory
 from crankycoin.routes.public import public_app
 from crankycoin import config, logger
 
@@ -52,9 +56,13 @@ class FullNode(NodeMixin):
     NODE_TYPE = "full"
     HOST = config['user']['ip']
     WORKER_PROCESSES = config['user']['queue_processing_workers']
+    HEADERS_FIRST_SYNC = config['user']['headers_first_sync']
+    SYNC_REPORT_INTERVAL = config['user']['sync_report_interval']
+    ORPHAN_SYNC_LENGTH = config['user']['orphan_sync_length']
     blockchain = None
     bottle_process = None
     queue_process = None
+    chain_tip_process = None
     worker_processes = None
 
     def __init__(self, peers, api_client, blockchain, mempool, validator):
@@ -65,6 +73,7 @@ class FullNode(NodeMixin):
         self.app = Bottle()
         self.app.merge(public_app)
         self.app.merge(permissioned_app)
+        self.app.merge(mining_app)
         self.blockchain = blockchain
         self.mempool = mempool
         self.validator = validator
@@ -73,6 +82,9 @@ class FullNode(NodeMixin):
         logger.debug("queue process starting...")
         self.queue_process = mp.Process(target=Queue.start_queue)
         self.queue_process.start()
+        logger.debug("chain tip proxy process starting...")
+        self.chain_tip_process = mp.Process(target=ChainTip.start_proxy)
+        self.chain_tip_process.start()
         logger.debug("worker process(es) starting...")
         self.worker_processes = [mp.Process(target=self.worker) for _ in range(self.WORKER_PROCESSES)]
         for wp in self.worker_processes:
@@ -90,6 +102,8 @@ class FullNode(NodeMixin):
             wp.terminate()
         logger.debug("queue process shutting down...")
         self.queue_process.terminate()
+        logger.debug("chain tip proxy process shutting down...")
+        self.chain_tip_process.terminate()
 
     def check_peers(self):
         known_peers = self.discover_peers()
@@ -105,10 +119,13 @@ class FullNode(NodeMixin):
             if msg_type == MessageType.BLOCK_HEADER:
                 block_header = BlockHeader.from_dict(json.loads(data))
                 if sender == self.HOST:
-                    self.api_client.broadcast_block_inv([block_header.hash], self.HOST)
+                    self.__broadcast_block(block_header)
                 else:
                     self.__process_block_header(block_header, sender)
                 continue
+            elif msg_type == MessageType.COMPACT_BLOCK:
+                self.__process_compact_block(CompactBlock.from_dict(data), sender)
+                continue
             elif msg_type == MessageType.UNCONFIRMED_TRANSACTION:
                 unconfirmed_transaction = Transaction.from_dict(data)
                 if sender == self.HOST:
@@ -124,37 +141,43 @@ class FullNode(NodeMixin):
                 for block_hash in data:
                     # aggregate unknown block header hashes
                     block_header = self.blockchain.get_block_header_by_hash(block_hash)
-                    if block_header is None:
+                    if block_header is None and not self.mempool.has_orphan_block(block_hash):
                         missing_block_headers.append(block_hash)
+                    else:
+                        seen_inventory.add(block_hash)
                 for block_hash in missing_block_headers:
                     # We don't have these blocks in our database.  Fetch them from the sender
                     block_header = self.api_client.request_block_header(sender, self.FULL_NODE_PORT,
                                                                         block_hash=block_hash)
-                    self.__process_block_header(block_header, sender)
+                    if block_header is None:
+                        continue
+                    # announcements of blocks that could not be fetched or processed are let through again.  A block
+                    # held in the orphan pool counts as processed, so that it is not downloaded again
+                    if (self.__process_block_header(block_header, sender) or
+                            self.mempool.has_orphan_block(block_hash)) and block_header.hash == block_hash:
+                        seen_inventory.add(block_hash)
                 continue
             elif msg_type == MessageType.UNCONFIRMED_TRANSACTION_INV:
-                missing_transactions = []
                 new_unconfirmed_transactions = []
-                for tx_hash in data:
-                    # skip known unconfirmed transactions
-                    transaction = self.blockchain.get_transaction_by_hash(tx_hash)
-                    if transaction:
-                        continue
-                    unconfirmed_transaction = self.mempool.get_unconfirmed_transaction(tx_hash)
-                    if unconfirmed_transaction:
-                        continue
-                    missing_transactions.append(tx_hash)
-                for tx_hash in missing_transactions:
-                    # retrieve unknown unconfirmed transactions
-                    transaction = self.api_client.request_transaction(sender, self.FULL_NODE_PORT, tx_hash)
-                    valid = self.validator.validate_transaction(transaction)
-                    if valid:
-                        # validate and store retrieved unconfirmed transactions
-                        self.mempool.push_unconfirmed_transaction(transaction)
-                        new_unconfirmed_transactions.append(tx_hash)
+                # skip known confirmed and unconfirmed transactions
+                known_transactions = self.blockchain.get_transactions_by_hashes(data)
+                known_transactions.update(self.mempool.get_unconfirmed_transactions_by_hashes(data))
+                missing_transactions = [tx_hash for tx_hash in data if tx_hash not in known_transactions]
+                for tx_hash in known_transactions:
+                    seen_inventory.add(tx_hash)
+                if missing_transactions:
+                    # retrieve unknown unconfirmed transactions in batches
+                    transactions = self.api_client.request_transactions(sender, self.FULL_NODE_PORT,
+                                                                        missing_transactions) or []
+                    for transaction in transactions:
+                        if self.validator.validate_transaction(transaction):
+                            # validate and store retrieved unconfirmed transactions
+                            self.mempool.push_unconfirmed_transaction(transaction)
+                            new_unconfirmed_transactions.append(transaction.tx_hash)
+                            seen_inventory.add(transaction.tx_hash)
                 if len(new_unconfirmed_transactions):
                     # broadcast new unconfirmed transactions
-                    self.api_client.broadcast_unconfirmed_transaction_inv(new_unconfirmed_transactions)
+                    self.api_client.broadcast_unconfirmed_transaction_inv(new_unconfirmed_transactions, self.HOST)
                 continue
             else:
                 logger.warn("Encountered unknown message type %s from %s", msg_type, sender)
@@ -168,76 +191,346 @@ class FullNode(NodeMixin):
         :param sender:
         :return:
         """
+        if self.mempool.has_orphan_block(block_header.hash):
+            # already held until its parent arrives
+            return False
         # request transactions inv and missing transactions and add block
         transactions_inv = self.api_client.request_transactions_inv(sender, self.FULL_NODE_PORT, block_header.hash)
         valid_block_height = self.validator.validate_block_header(block_header, transactions_inv)
         if valid_block_height:
             block_transactions, missing_transactions_inv = self.validator.validate_block_transactions_inv(
                 transactions_inv)
-            for tx_hash in missing_transactions_inv:
-                transaction = self.api_client.request_transaction(sender, self.FULL_NODE_PORT, tx_hash)
+            missing_transactions = []
+            fetched_transactions = []
+            if missing_transactions_inv:
+                fetched_transactions = self.api_client.request_transactions(sender, self.FULL_NODE_PORT,
+                                                                            missing_transactions_inv)
+                if fetched_transactions is None or len(fetched_transactions) != len(missing_transactions_inv):
+                    logger.warn("Could not retrieve the transactions of block {} from {}"
+                                .format(block_header.hash, sender))
+                    return False
+            for transaction in fetched_transactions:
                 if TransactionType(transaction.tx_type) == TransactionType.COINBASE:
                     block_transactions.insert(0, transaction)
                 else:
-                    if not self.validator.validate_transaction(transaction):
-                        return False
-                    block_transactions.append(transaction)
+                    missing_transactions.append(transaction)
+            # fetched transactions are validated as one batch
+            if missing_transactions and not self.validator.validate_transactions(missing_transactions):
+                return False
+            block_transactions.extend(missing_transactions)
             block = Block(
                 valid_block_height,
                 block_transactions,
                 block_header.previous_hash,
                 timestamp=block_header.timestamp,
                 nonce=block_header.nonce)
-            if self.validator.validate_block(block, block_header.merkle_root) and self.blockchain.add_block(block):
-                self.api_client.broadcast_block_inv([block_header.hash], self.HOST)
+            return self.__connect_block(block, block_header)
         elif valid_block_height is None:
+            # the parent is unknown.  Fetch the whole block to hold until the parent arrives
+            block = self.api_client.request_block(sender, self.FULL_NODE_PORT, block_header.hash)
+            if block is None or block.block_header != block_header:
+                logger.warn("Could not retrieve orphan block {} from {}".format(block_header.hash, sender))
+                return False
+            return self.__process_orphan_block(block, sender)
+
+    def __process_block(self, block, sender, relay=True, connect_orphans=True):
+        """
+        Validate and add a block retrieved whole from a peer, as during catch-up sync
+
+        :param block:
+        :param sender:
+        :param relay: relay the block to peers once added
+        :param connect_orphans: connect the orphan blocks waiting on this block once added
+        :return:
+        """
+        valid_block_height = self.validator.validate_block_header(
+            block.block_header, [transaction.tx_hash for transaction in block.transactions])
+        if not valid_block_height:
+            return False
+        if valid_block_height != block.height:
+            logger.warn("Block {} from {} has height {} but follows height {}".format(
+                block.block_header.hash, sender, block.height, valid_block_height - 1))
+            return False
+        # the transactions of a retrieved block are validated as one batch
+        if len(block.transactions) > 1 and not self.validator.validate_transactions(block.transactions[1:]):
+            return False
+        return self.__connect_block(block, block.block_header, relay, connect_orphans)
+
+    def __process_compact_block(self, compact_block, sender):
+        """
+        Rebuild a block from a compact block and the mempool.  Transactions missing from the mempool are requested
+        from the sender in a single round trip.  Falls back to the full header path if the rebuilt block does not
+        match the header
+
+        :param compact_block:
+        :param sender:
+        :return:
+        """
+        block_header = compact_block.block_header
+        if self.blockchain.get_block_header_by_hash(block_header.hash):
+            return False
+        # index the mempool by short id.  Ambiguous short ids are treated as missing
+        mempool_index = {}
+        for tx_hash in self.mempool.get_unconfirmed_transaction_hashes():
+            short_id = compact_block.short_id(tx_hash)
+            mempool_index[short_id] = None if short_id in mempool_index else tx_hash
+        matched_hashes = [mempool_index.get(short_id) for short_id in compact_block.short_ids]
+        mempool_transactions = self.mempool.get_unconfirmed_transactions_by_hashes(
+            [tx_hash for tx_hash in matched_hashes if tx_hash])
+        transactions = [mempool_transactions.get(tx_hash) if tx_hash else None for tx_hash in matched_hashes]
+        missing_indexes = [index for index, transaction in enumerate(transactions) if transaction is None]
+        missing_transactions = []
+        if missing_indexes:
+            missing_transactions = self.api_client.request_block_transactions(
+                sender, self.FULL_NODE_PORT, block_header.hash, [index + 1 for index in missing_indexes])
+            if missing_transactions is None or len(missing_transactions) != len(missing_indexes):
+                logger.warn("Could not complete compact block {} from {}".format(block_header.hash, sender))
+                return False
+            for index, transaction in zip(missing_indexes, missing_transactions):
+                transactions[index] = transaction
+        tx_hashes = [compact_block.coinbase.tx_hash] + [transaction.tx_hash for transaction in transactions]
+        if block_header.merkle_root != self.validator.calculate_merkle_root(tx_hashes):
+            # a short id matched the wrong mempool transaction
+            logger.warn("Compact block {} does not match its header.  Requesting the full block".format(
+                block_header.hash))
+            return self.__process_block_header(block_header, sender)
+        valid_block_height = self.validator.validate_block_header(block_header, tx_hashes)
+        if valid_block_height is None:
+            # transactions are validated once the parent arrives and the orphan is connected
+            return self.__process_orphan_block(Block(
+                compact_block.height,
+                [compact_block.coinbase] + transactions,
+                block_header.previous_hash,
+                timestamp=block_header.timestamp,
+                nonce=block_header.nonce), sender)
+        if not valid_block_height:
+            return False
+        if self.blockchain.get_transactions_by_hashes(list(mempool_transactions)):
+            logger.warn('Block not valid.  Double-spend prevented: {}'.format(block_header.hash))
+            return False
+        # transactions from the mempool were validated on arrival.  Fetched ones are validated as one batch
+        if missing_transactions and not self.validator.validate_transactions(missing_transactions):
+            return False
+        block = Block(
+            valid_block_height,
+            [compact_block.coinbase] + transactions,
+            block_header.previous_hash,
+            timestamp=block_header.timestamp,
+            nonce=block_header.nonce)
+        return self.__connect_block(block, block_header)
+
+    def __connect_block(self, block, block_header, relay=True, connect_orphans=True):
+        # add a relayed block, drop its transactions from the mempool and relay it on as a compact block
+        if not (self.validator.validate_block(block, block_header.merkle_root) and self.blockchain.add_block(block)):
+            return False
+        if len(block.transactions) > 1:
+            self.mempool.remove_unconfirmed_transactions(block.transactions[1:])
+        if relay:
+            self.api_client.broadcast_compact_block(
+                CompactBlock.from_transactions(block.height, block_header, block.transactions), self.HOST)
+        if connect_orphans:
+            self.__connect_orphan_blocks(block_header.hash)
+        return True
+
+    def __process_orphan_block(self, block, sender):
+        """
+        Hold a block whose parent is unknown in the orphan pool rather than synchronizing on every block relayed
+        out of order.  Falls back to synchronizing with the sender once ORPHAN_SYNC_LENGTH orphans wait on the same
+        missing block
+
+        :param block:
+        :param sender:
+        :return: True if the block was connected
+        """
+        block_header = block.block_header
+        # proof of work is checked up front so that filling the pool costs mined blocks
+        if not self.validator.validate_headers(block_header.previous_hash, [block_header]):
+            return False
+        if not self.mempool.add_orphan_block(block, sender):
+            logger.warn("Orphan block {} from {} does not fit the orphan pool".format(block_header.hash, sender))
+            return False
+        length, missing_hash = self.mempool.get_orphan_chain(block_header.hash)
+        if length == 0:
+            # already taken out of the pool by the worker that connected its parent
+            return False
+        if self.blockchain.get_block_header_by_hash(missing_hash):
+            # the parent was connected while the block was being pooled
+            return self.__connect_orphan_blocks(missing_hash) > 0
+        if length >= self.ORPHAN_SYNC_LENGTH:
+            logger.warn("{} orphan blocks wait on block {}.  Synchronizing with {}".format(
+                length, missing_hash, sender))
             self.__synchronize(sender)
+        return False
+
+    def __connect_orphan_blocks(self, block_hash):
+        # connect the orphans building on a newly added block, then the orphans building on those in turn
+        connected = 0
+        parents = [block_hash]
+        while parents:
+            for block, sender in self.mempool.pop_orphan_blocks(parents.pop()):
+                if self.__process_block(block, sender, connect_orphans=False):
+                    connected += 1
+                    parents.append(block.block_header.hash)
+        return connected
+
+    def __broadcast_block(self, block_header):
+        # announce a locally mined block as a compact block
+        block = self.blockchain.get_block_header_by_hash(block_header.hash)
+        if block is None:
+            return
+        _, _, height = block
+        transactions = self.blockchain.get_transactions_by_block_hash(block_header.hash)
+        self.api_client.broadcast_compact_block(CompactBlock.from_transactions(height, block_header, transactions),
+                                                self.HOST)
 
     def __synchronize(self, node):
         # synchronize with sender
+        if self.HEADERS_FIRST_SYNC:
+            return self.__synchronize_headers_first(node)
         repeat_sync = True
         while repeat_sync is True:
             current_height = self.blockchain.get_height()
             peer_height = self.api_client.request_height(node)
             if peer_height is not None and peer_height > current_height:
-                # 100 blocks of overlap should be sufficient to find a common block lest we are on a forked branch
-                start_height = current_height - 100 if current_height > 100 else 1
-                if current_height < peer_height - 500:
+                last_common_block = self.__find_fork_point(node)
+                if last_common_block is None:
+                    logger.warn("Completely out of sync with peer at {}".format(node))
+                    break
+                block_header, branch, height = last_common_block
+                if peer_height > height + 500:
                     # we are way behind.
-                    end_height = start_height + 500
+                    end_height = height + 500
                 else:
                     end_height = peer_height
                     repeat_sync = False
-                peer_blocks_inv = self.api_client.audit(node, start_height, end_height)
-                last_common_block = self.__find_last_common_block(peer_blocks_inv)
-                if last_common_block is None:
-                    logger.warn("Completely out of sync with peer at {}".format(node))
+                peer_blocks_inv = self.api_client.audit(node, height, end_height)
+                if not peer_blocks_inv or peer_blocks_inv[0] != block_header.hash:
+                    logger.warn("Could not retrieve blocks inventory from peer at {}".format(node))
                     break
-                block_header, branch, height = last_common_block
                 # construct list of missing block hashes to request from the peer
-                hashes_to_query = peer_blocks_inv[peer_blocks_inv.index(block_header.hash)+1:]
-                for block_hash in hashes_to_query:
-                    block_header = self.api_client.request_block_header(node, self.FULL_NODE_PORT,
-                                                                        block_hash=block_hash)
-                    self.__process_block_header(block_header, node)
+                hashes_to_query = peer_blocks_inv[1:]
+                if not hashes_to_query:
+                    break
+                # pull the missing blocks whole, hundreds per request
+                blocks = self.api_client.request_blocks(node, self.FULL_NODE_PORT, height + 1,
+                                                        height + len(hashes_to_query))
+                if not blocks:
+                    logger.warn("Could not retrieve blocks from peer at {}".format(node))
+                    break
+                for block_hash, block in zip(hashes_to_query, blocks):
+                    if block.block_header.hash != block_hash or not self.__process_block(block, node):
+                        # the peer's chain changed under us or sent an invalid block
+                        repeat_sync = False
+                        break
             else:
                 repeat_sync = False
 
-    def __find_last_common_block(self, peer_blocks_inv):
+    def __synchronize_headers_first(self, node):
         """
-        Identify the last common between the local chain and the peer chain.
-        :param peer_blocks_inv:
-        :return: latest common block height, latest common block hash
-        :rtype: tuple(int, string)
+        Catch-up sync in two stages.  The header chain is downloaded from the tallest peer and checked, then the block
+        bodies are downloaded in parallel from every peer ahead of us and connected in height order.  Headers are
+        processed MAX_HEADERS_BATCH at a time.  Blocks connected during catch-up are not relayed one by one; the new
+        tip is announced once at the end
+
+        :param node: peer that triggered the sync
+        :return: number of blocks connected
+        :rtype: int
         """
-        last_common_block = None
-        for hash in peer_blocks_inv:
-            block = self.blockchain.get_block_header_by_hash(hash)
-            if block is None:
+        peer_heights = {}
+        for peer in set([node] + self.peers.get_all_peers()):
+            peer_height = self.api_client.request_height(peer)
+            if peer_height is not None:
+                peer_heights[peer] = peer_height
+        current_height = self.blockchain.get_height()
+        if not peer_heights or max(peer_heights.values()) <= current_height:
+            return 0
+        # the sender wins ties for the tallest peer
+        best_node = max(peer_heights, key=lambda peer: (peer_heights[peer], peer == node))
+        peer_height = peer_heights[best_node]
+        last_common_block = self.__find_fork_point(best_node)
+        if last_common_block is None:
+            logger.warn("Completely out of sync with peer at {}".format(best_node))
+            return 0
+        tip_header, branch, tip_height = last_common_block
+        # the tallest peer is asked first
+        nodes = sorted((peer for peer, height in peer_heights.items() if height > tip_height),
+                       key=lambda peer: peer != best_node)
+        connected = 0
+        start = last_report = time.time()
+        while tip_height < peer_height:
+            block_headers = self.api_client.request_headers(
+                best_node, self.FULL_NODE_PORT, tip_height + 1,
+                min(tip_height + self.api_client.MAX_HEADERS_BATCH, peer_height))
+            if not block_headers or not self.validator.validate_headers(tip_header.hash, block_headers):
+                logger.warn("Could not retrieve a valid header chain from peer at {}".format(best_node))
+                break
+            for block in BlockDownloader(self.api_client, nodes, self.FULL_NODE_PORT, block_headers, tip_height + 1):
+                if not self.__process_block(block, best_node, relay=False):
+                    break
+                connected += 1
+                tip_header, tip_height = block.block_header, block.height
+                if time.time() - last_report >= self.SYNC_REPORT_INTERVAL:
+                    last_report = time.time()
+                    self.__report_sync_progress(connected, tip_height, peer_height, last_report - start)
+            if tip_header.hash != block_headers[-1].hash:
+                # a block could not be downloaded or connected
                 break
-            last_common_block = block
-        return last_common_block
+        self.__report_sync_progress(connected, tip_height, peer_height, time.time() - start)
+        if connected:
+            self.api_client.broadcast_block_inv([tip_header.hash], self.HOST)
+        return connected
+
+    @staticmethod
+    def __report_sync_progress(connected, height, peer_height, seconds):
+        logger.info("Synchronized {} blocks, height {} of {}, {:.1f} blocks/s".format(
+            connected, height, peer_height, connected / seconds if seconds else 0))
+
+    def __find_fork_point(self, node):
+        """
+        Identify the last block shared with a peer by sending it our block locator.  Takes one round trip and one
+        query on each side if the fork is within the locator's dense hashes, and O(log n) more round trips for a
+        fork n blocks deep
+        :param node:
+        :return: BlockHeader, branch and height of the last common block, or None
+        :rtype: tuple(BlockHeader, int, int)
+        """
+        locator = self.blockchain.get_block_locator()
+        fork_point = self.api_client.request_fork_point(node, self.FULL_NODE_PORT, locator)
+        if fork_point is None:
+            return None
+        block_hash, height = fork_point
+        index = locator.index(block_hash)
+        if index > 0:
+            # below its dense hashes the locator only bounds the fork by the next locator block up, so the blocks
+            # in between that the peer shares with us are skipped rather than downloaded again
+            next_locator_block = self.blockchain.get_block_header_by_hash(locator[index - 1])
+            if next_locator_block is not None:
+                block_hash = self.__bisect_fork_point(node, block_hash, height, next_locator_block[2])
+        return self.blockchain.get_block_header_by_hash(block_hash)
 
+    def __bisect_fork_point(self, node, block_hash, height, unshared_height):
+        """
+        Bisect the heights between a block shared with a peer and a block of our main chain the peer does not have,
+        comparing one hash of each side per step.  Takes O(log n) round trips for a gap of n blocks
+        :param node:
+        :param block_hash: hash of a block shared with the peer
+        :param height: height of that block
+        :param unshared_height: height of a block on our main chain that the peer does not have
+        :return: hash of the last block shared with the peer
+        :rtype: str
+        """
+        while unshared_height - height > 1:
+            middle = (height + unshared_height) // 2
+            peer_blocks_inv = self.api_client.audit(node, middle, middle + 1)
+            local_blocks_inv = self.blockchain.get_hashes_range(middle, middle)
+            if not peer_blocks_inv or not local_blocks_inv:
+                # the peer could not be reached.  The fork lies no lower than the last block known to be shared
+                break
+            if peer_blocks_inv[0] == local_blocks_inv[0]:
+                block_hash, height = local_blocks_inv[0], middle
+            else:
+                unshared_height = middle
+        return block_hash
 
 if __name__ == "__main__":
     pass
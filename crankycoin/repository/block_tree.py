@@ -0,0 +1,209 @@
+import sys
+import threading
+
+from crankycoin import config
+
+
+class BlockTree(object):
+    """
+    In-memory index of a chain database: every block hash maps to its previous hash, height and branch, and the tip of
+    every branch is kept at hand, so fork choice and ancestry questions are answered without a query.
+
+    There is one tree per connection pool, that is per process and database.  It is loaded on first use and kept
+    current from within write transactions: blocks added or relabelled are appended to the block_tree_log table in
+    the same transaction, and a tree that finds the database changed by another process since its last write replays
+    the log entries it has not seen.  PRAGMA data_version tells whether that is needed without reading the log.
+    """
+
+    LOG_SIZE = config['user']['block_tree_log_size']
+
+    _trees = {}
+    _trees_lock = threading.Lock()
+
+    def __init__(self, pool):
+        self.pool = pool
+        # hash -> (previous hash, height, branch)
+        self.blocks = {}
+        # (previous hash, branch) of every block, as in the UNIQUE constraint of the blocks table
+        self.links = set()
+        # branch -> (hash, height) of its tallest block
+        self.tips = {}
+        self.height = 0
+        self.seq = None
+        self.data_version = None
+
+    @classmethod
+    def instance(cls, pool):
+        """
+        Returns the tree of a connection pool.  A pool replaced after a fork gets a new tree
+
+        :param pool: connection pool of a chain database
+        :type pool: ConnectionPool
+        :return: block tree, not loaded until first synchronized
+        :rtype: BlockTree
+        """
+        with cls._trees_lock:
+            tree = cls._trees.get(pool.db_path)
+            if tree is None or tree.pool is not pool:
+                tree = cls(pool)
+                cls._trees[pool.db_path] = tree
+        return tree
+
+    def synchronize(self, cursor):
+        """
+        Brings the tree up to date.  Called with a cursor of the write transaction the tree is consulted in, so no
+        other process can change the chain until it commits
+
+        :param cursor: cursor of the pool's writer connection
+        :type cursor: sqlite3.Cursor
+        """
+        data_version = cursor.execute("PRAGMA data_version").fetchone()[0]
+        if self.seq is None:
+            self.load(cursor)
+        elif data_version != self.data_version:
+            rows = cursor.execute("SELECT seq, hash, prevHash, height, branch FROM block_tree_log WHERE seq > ?"
+                                  " ORDER BY seq", (self.seq,)).fetchall()
+            if rows and rows[0][0] != self.seq + 1:
+                # entries this tree has not seen were trimmed from the log
+                self.load(cursor)
+            elif rows:
+                for seq, block_hash, previous_hash, height, branch in rows:
+                    self._set(block_hash, previous_hash, height, branch)
+                self.seq = rows[-1][0]
+                self._load_tips(cursor)
+        self.data_version = data_version
+
+    def load(self, cursor):
+        # the log position is read first.  Entries committed in between are replayed over blocks already loaded
+        seq = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'block_tree_log'").fetchone()
+        self.seq = 0 if seq is None else seq[0]
+        self.blocks = {}
+        self.links = set()
+        self.height = 0
+        for block_hash, previous_hash, height, branch in cursor.execute(
+                "SELECT hash, prevHash, height, branch FROM blocks"):
+            self._set(block_hash, previous_hash, height, branch)
+        self._load_tips(cursor)
+
+    def _load_tips(self, cursor):
+        self.tips = {branch: (block_hash, height) for branch, block_hash, height in cursor.execute(
+            "SELECT id, currentHash, currentHeight FROM branches")}
+
+    def _set(self, block_hash, previous_hash, height, branch):
+        # a hash is held once in memory whether it appears as a key or as the previous hash of a block
+        block_hash = sys.intern(block_hash)
+        previous_hash = sys.intern(previous_hash)
+        block = self.blocks.get(block_hash)
+        if block is not None:
+            self.links.discard((block[0], block[2]))
+        self.blocks[block_hash] = (previous_hash, height, branch)
+        self.links.add((previous_hash, branch))
+        if height > self.height:
+            self.height = height
+
+    def invalidate(self):
+        # a write transaction that rolled back may have left changes in the tree.  Reload on next use
+        self.seq = None
+
+    def add(self, cursor, block_hash, previous_hash, height, branch):
+        """
+        Records a block inserted as the tip of its branch in the caller's write transaction
+        """
+        self._set(block_hash, previous_hash, height, branch)
+        self.tips[branch] = (block_hash, height)
+        self._log(cursor, [(block_hash, previous_hash, height, branch)])
+
+    def relabel(self, cursor, block_hashes, branch):
+        """
+        Records blocks moved to another branch in the caller's write transaction.  Branch tips are set by the caller
+        """
+        rows = []
+        for block_hash in block_hashes:
+            previous_hash, height, _ = self.blocks[block_hash]
+            self._set(block_hash, previous_hash, height, branch)
+            rows.append((block_hash, previous_hash, height, branch))
+        self._log(cursor, rows)
+
+    def _log(self, cursor, rows):
+        if not rows:
+            return
+        cursor.executemany("INSERT INTO block_tree_log (hash, prevHash, height, branch) VALUES (?, ?, ?, ?)", rows)
+        # the tree is current within the write transaction, so the entries follow on from its position
+        self.seq += len(rows)
+        cursor.execute("DELETE FROM block_tree_log WHERE seq <= ?", (self.seq - self.LOG_SIZE,))
+
+    def get_branch(self, block_hash):
+        """
+        :return: branch of the block, or 0 if the block is unknown
+        :rtype: int
+        """
+        block = self.blocks.get(block_hash)
+        return 0 if block is None else block[2]
+
+    def has_child(self, block_hash, branch):
+        """
+        :return: True if a block on the branch builds on the block
+        :rtype: bool
+        """
+        return (block_hash, branch) in self.links
+
+    def get_ancestor(self, block_hash, height):
+        """
+        :param block_hash: hash of a known block
+        :type block_hash: str
+        :param height: height of the ancestor, at most the height of the block
+        :type height: int
+        :return: hash of the block's ancestor at the height, or None if the block is unknown
+        :rtype: str
+        """
+        block = self.blocks.get(block_hash)
+        while block is not None and block[1] > height:
+            block_hash = block[0]
+            block = self.blocks.get(block_hash)
+        return None if block is None else block_hash
+
+    def find_fork_point(self, block_hash, other_hash):
+        """
+        :return: hash of the tallest block that both blocks build on, or None if they share no known block
+        :rtype: str
+        """
+        block = self.blocks.get(block_hash)
+        other = self.blocks.get(other_hash)
+        if block is None or other is None:
+            return None
+        height = min(block[1], other[1])
+        block_hash = self.get_ancestor(block_hash, height)
+        other_hash = self.get_ancestor(other_hash, height)
+        while block_hash != other_hash:
+            if block_hash not in self.blocks or other_hash not in self.blocks:
+                return None
+            block_hash = self.blocks[block_hash][0]
+            other_hash = self.blocks[other_hash][0]
+        return block_hash
+
+    def get_branch_hashes(self, branch):
+        """
+        :return: hashes of the blocks of a branch from its tip down, branches being contiguous runs of blocks
+        :rtype: list of str
+        """
+        hashes = []
+        block_hash = self.tips.get(branch, (None, None))[0]
+        block = self.blocks.get(block_hash)
+        while block is not None and block[2] == branch:
+            hashes.append(block_hash)
+            block_hash = block[0]
+            block = self.blocks.get(block_hash)
+        return hashes
+
+    def get_chain_hashes(self, block_hash, stop_height):
+        """
+        :return: hashes of a block and its ancestors down to stop_height included, from the block down
+        :rtype: list of str
+        """
+        hashes = []
+        block = self.blocks.get(block_hash)
+        while block is not None and block[1] >= stop_height:
+            hashes.append(block_hash)
+            block_hash = block[0]
+            block = self.blocks.get(block_hash)
+        return hashes
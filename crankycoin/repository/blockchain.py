@@ -4,7 +4,12 @@ import sqlite3
 
 from crankycoin import config, logger
 from crankycoin.models.block import BlockHeader
+from crankycoin.models.enums import TransactionType
 from crankycoin.models.transaction import Transaction
+from crankycoin.repository.block_tree import BlockTree
+from crankycoin.repository.connection import ConnectionPool
+from crankycoin.repository.mempool import Mempool
+from crankycoin.services.chain_tip import ChainTip
 
 
 class Blockchain(object):
@@ -18,70 +23,107 @@ class Blockchain(object):
     SIGNIFICANT_DIGITS = config['network']['significant_digits']
     SHORT_CHAIN_TOLERANCE = config['network']['short_chain_tolerance']
     CHAIN_DB = config['user']['chain_db']
+    # stays below SQLite's bound parameter limit
+    TRANSACTION_QUERY_CHUNK = 500
+    # the locator lists the tip and the blocks just below it one by one, then doubles the step back to genesis
+    LOCATOR_DENSE_HASHES = 10
+    # blocks relabelled per statement in a reorg.  Two lists of their hashes stay below SQLite's bound parameter limit
+    REORG_CHUNK_SIZE = 250
 
     def __init__(self):
         self.blocks_lock = Lock()
+        self.pool = ConnectionPool.instance(self.CHAIN_DB)
+        self.block_tree = BlockTree.instance(self.pool)
         self.db_init()
 
     def db_init(self):
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        # the schema check only runs once per process
+        if self.pool.initialized:
+            return
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute("PRAGMA table_info(blocks)")
-            if len(cursor.fetchall()) > 0:
-                return
-            sql = open('config/init_blockchain.sql', 'r').read()
-            cursor = conn.cursor()
-            cursor.executescript(sql)
+            if len(cursor.fetchall()) == 0:
+                sql = open('config/init_blockchain.sql', 'r').read()
+                cursor.executescript(sql)
+            cursor.execute("PRAGMA table_info(balances)")
+            if len(cursor.fetchall()) == 0:
+                # chain databases created before balances were materialized are backfilled from their history
+                sql = open('config/init_balances.sql', 'r').read()
+                cursor.executescript(sql)
+                self.rebuild_balances()
+            cursor.execute("PRAGMA table_info(block_tree_log)")
+            if len(cursor.fetchall()) == 0:
+                sql = open('config/init_block_tree_log.sql', 'r').read()
+                cursor.executescript(sql)
+        self.pool.initialized = True
         return
 
     def add_block(self, block):
         status = False
-        branch = self.get_branch_by_hash(block.block_header.previous_hash)
-        max_height = self.get_height()
-        if block.height > max_height:
-            # we're working on the tallest branch
-            if branch > 0:
-                # if an alternate branch is the tallest branch, it becomes our primary branch
-                self.restructure_primary_branch(branch)
-                branch = 0
-        else:
-            # we're not on the tallest branch, so there could be a split here
-            competing_branches = self.get_branches_by_prevhash(block.block_header.previous_hash)
-            if competing_branches and branch in competing_branches:
-                branch = self.get_new_branch_number(block.block_header.hash, block.height)
-
-        sql_strings = list()
-        sql_strings.append("INSERT INTO blocks (hash, prevhash, merkleRoot, height, nonce, timestamp, version, branch" +
-                           ") VALUES ('{}', '{}', '{}', {}, {}, {}, {}, {})"
-                           .format(block.block_header.hash, block.block_header.previous_hash,
-                                   block.block_header.merkle_root, block.height, block.block_header.nonce,
-                                   block.block_header.timestamp, block.block_header.version, branch))
-        for transaction in block.transactions:
-            sql_strings.append("INSERT INTO transactions (hash, src, dest, amount, fee, timestamp, signature, type," +
-                               " blockHash, asset, data, branch, prevHash)" +
-                               " VALUES ('{}', '{}', '{}', {}, {}, {}, '{}', {},'{}', '{}', '{}', {}, '{}')".format(
-                                    transaction.tx_hash, transaction.source, transaction.destination,
-                                    transaction.amount, transaction.fee, transaction.timestamp, transaction.signature,
-                                    transaction.tx_type, block.block_header.hash, transaction.asset, transaction.data,
-                                    branch, transaction.prev_hash))
-        sql_strings.append("UPDATE branches SET currentHash = '{}', currentHeight = {} WHERE id = {}".format(
-                            block.block_header.hash, block.height, branch))
-
+        block_hash = block.block_header.hash
+        block_sql = "INSERT INTO blocks (hash, prevhash, merkleRoot, height, nonce, timestamp, version, branch)" \
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        tx_sql = "INSERT INTO transactions (hash, src, dest, amount, fee, timestamp, signature, type, blockHash," \
+                 " asset, data, branch, prevHash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        branch_sql = "UPDATE branches SET currentHash = ?, currentHeight = ? WHERE id = ?"
+        reorganization = None
         try:
-            with sqlite3.connect(self.CHAIN_DB) as conn:
+            # branch selection, restructuring and the inserts below share a single transaction
+            with self.pool.writer() as conn:
                 cursor = conn.cursor()
-                for sql in sql_strings:
-                    cursor.execute(sql)
+                # fork choice is answered from the block tree
+                self.block_tree.synchronize(cursor)
+                branch = self.block_tree.get_branch(block.block_header.previous_hash)
+                if block.height > self.block_tree.height:
+                    # we're working on the tallest branch
+                    if branch > 0:
+                        # if an alternate branch is the tallest branch, it becomes our primary branch
+                        reorganization = self.restructure_primary_branch(branch)
+                        branch = 0
+                elif self.block_tree.has_child(block.block_header.previous_hash, branch):
+                    # we're not on the tallest branch and the previous block already has a successor on its branch
+                    branch = self.get_new_branch_number(block_hash, block.height)
+
+                cursor.execute(block_sql, (block_hash, block.block_header.previous_hash,
+                                           block.block_header.merkle_root, block.height, block.block_header.nonce,
+                                           block.block_header.timestamp, block.block_header.version, branch))
+                cursor.executemany(tx_sql, ((transaction.tx_hash, transaction.source, transaction.destination,
+                                             transaction.amount, transaction.fee, transaction.timestamp,
+                                             transaction.signature, transaction.tx_type, block_hash,
+                                             transaction.asset, transaction.data, branch, transaction.prev_hash)
+                                            for transaction in block.transactions))
+                cursor.execute(branch_sql, (block_hash, block.height, branch))
+                self._update_balances(cursor, self._calculate_balance_deltas(block.transactions), branch)
+                self.block_tree.add(cursor, block_hash, block.block_header.previous_hash, block.height, branch)
                 status = True
-        except sqlite3.OperationalError as err:
-            logger.error("Database Error: ", err.message)
+        except sqlite3.Error as err:
+            logger.error("Database Error: %s", err)
+            self.block_tree.invalidate()
+        if status and reorganization is not None:
+            # the chain and the pool are separate databases, so the pool follows in its own transaction once the
+            # reorg has committed
+            Mempool().apply_reorganization(*reorganization)
+        if status and branch == 0:
+            ChainTip.publish(block_hash, block.height)
         return status
 
+    @staticmethod
+    def _calculate_balance_deltas(transactions):
+        deltas = {}
+        for transaction in transactions:
+            key = (transaction.source, transaction.asset)
+            deltas[key] = deltas.get(key, 0) - (transaction.amount + transaction.fee)
+            if transaction.destination != transaction.source:
+                key = (transaction.destination, transaction.asset)
+                deltas[key] = deltas.get(key, 0) + transaction.amount
+        return [(address, asset, delta) for (address, asset), delta in deltas.items()]
+
     def get_new_branch_number(self, block_hash, height):
-        sql = "INSERT INTO branches (currentHash, currentHeight) VALUES ('{}', {})".format(block_hash, height)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        sql = "INSERT INTO branches (currentHash, currentHeight) VALUES (?, ?)"
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
-            cursor.execute(sql)
+            cursor.execute(sql, (block_hash, height))
             return cursor.lastrowid
 
     def prune(self):
@@ -89,48 +131,186 @@ class Blockchain(object):
             .format(self.SHORT_CHAIN_TOLERANCE)
         tx_sql = 'DELETE FROM transactions WHERE branch IN ({})'
         block_sql = 'DELETE FROM transactions WHERE branch IN ({})'
+        balance_sql = 'DELETE FROM balances WHERE branch IN ({})'
         branch_sql = 'DELETE FROM branches WHERE id IN ({})'
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
-            branches = [branch[0] for branch in cursor.fetchall()]
+            branches = [str(branch[0]) for branch in cursor.fetchall()]
             cursor.execute(tx_sql.format(",".join(branches)))
             cursor.execute(block_sql.format(",".join(branches)))
+            cursor.execute(balance_sql.format(",".join(branches)))
             cursor.execute(branch_sql.format(",".join(branches)))
         return
 
     def restructure_primary_branch(self, branch):
-        block_header, block_branch, block_height = self.get_tallest_block_header(branch=branch)
-        alt_branch_hashes = []
-        stop_height = block_height
-        start_height = block_height
-        eob = False
-        while not eob:
-            block_header, block_branch, block_height = self.get_block_header_by_hash(block_header.previous_hash)
-            if block_branch > 0:
-                # Still in alternate branch.  Continue traversing
-                alt_branch_hashes.append(block_header.hash)
+        """
+        Makes an alternate branch the primary branch.  The blocks to disconnect and to connect are the runs from each
+        tip down to the fork point, found in the block tree.  Blocks, transactions and balances are moved between
+        branches in chunks of REORG_CHUNK_SIZE blocks, all within the caller's write transaction
+
+        :param branch: branch to make primary
+        :type branch: int
+        :return: transactions of the disconnected blocks to return to the mempool, and hashes of the transactions
+            of the connected blocks
+        :rtype: tuple(list of Transaction, list of str)
+        """
+        branch_sql = 'UPDATE branches SET currentHash = ?, currentHeight = ? WHERE id = ?'
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            tree = self.block_tree
+            tree.synchronize(cursor)
+            if branch not in tree.tips or 0 not in tree.tips:
+                return [], []
+            primary_tip_hash = tree.tips[0][0]
+            alt_tip_hash = tree.tips[branch][0]
+            fork_hash = tree.find_fork_point(primary_tip_hash, alt_tip_hash)
+            if fork_hash is None:
+                return [], []
+            fork_height = tree.blocks[fork_hash][1]
+            connect_hashes = tree.get_chain_hashes(alt_tip_hash, fork_height + 1)
+            disconnect_hashes = tree.get_chain_hashes(primary_tip_hash, fork_height + 1)
+            # the connected blocks may span several branches when the alternate branch forked off another one
+            connect_branches = set(tree.blocks[block_hash][2] for block_hash in connect_hashes)
+            connect_deltas = self._get_balance_deltas(cursor, connect_hashes)
+            disconnect_deltas = self._get_balance_deltas(cursor, disconnect_hashes)
+            returned_transactions, connected_tx_hashes = self._get_reorg_transactions(
+                cursor, disconnect_hashes, connect_hashes)
+            # blocks and transactions are unique on (prevHash, branch), so the primary branch is parked on a
+            # temporary branch while the alternate branch takes its place
+            self._relabel_blocks(cursor, disconnect_hashes, -1)
+            self._relabel_blocks(cursor, connect_hashes, 0)
+            self._relabel_blocks(cursor, disconnect_hashes, branch)
+            # balances of a branch other than 0 hold only the changes made by its own blocks
+            for from_branch in connect_branches:
+                self._update_balances(cursor, [(address, asset, -delta) for delta_branch, address, asset, delta
+                                               in connect_deltas if delta_branch == from_branch], from_branch)
+            self._update_balances(cursor, [(address, asset, delta) for _, address, asset, delta in connect_deltas], 0)
+            self._update_balances(cursor, [(address, asset, -delta) for _, address, asset, delta in disconnect_deltas],
+                                  0)
+            self._update_balances(cursor, [(address, asset, delta) for _, address, asset, delta in disconnect_deltas],
+                                  branch)
+            returned_transactions = self._get_funded_transactions(cursor, returned_transactions)
+            tree.relabel(cursor, connect_hashes, 0)
+            tree.relabel(cursor, disconnect_hashes, branch)
+            tree.tips[0] = (alt_tip_hash, tree.blocks[alt_tip_hash][1])
+            cursor.execute(branch_sql, (alt_tip_hash, tree.tips[0][1], 0))
+            if disconnect_hashes:
+                tree.tips[branch] = (primary_tip_hash, tree.blocks[primary_tip_hash][1])
+                cursor.execute(branch_sql, (primary_tip_hash, tree.tips[branch][1], branch))
             else:
-                # End of branch has been found
-                start_height = block_height
-                eob = True
-        primary_branch_hashes = [b[0].hash
-                                 for b in self.get_block_headers_range_iter(start_height, stop_height, branch=0)]
-        block_sql = 'UPDATE blocks SET branch={} WHERE hash IN ({})'
-        tx_sql = 'UPDATE transactions SET branch={} WHERE blockHash IN ({})'
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+                del tree.tips[branch]
+                cursor.execute('DELETE FROM branches WHERE id = ?', (branch,))
+        return returned_transactions, connected_tx_hashes
+
+    def _relabel_blocks(self, cursor, block_hashes, branch):
+        for i in range(0, len(block_hashes), self.REORG_CHUNK_SIZE):
+            chunk = block_hashes[i:i + self.REORG_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute('UPDATE blocks SET branch=? WHERE hash IN ({})'.format(placeholders), [branch] + chunk)
+            cursor.execute('UPDATE transactions SET branch=? WHERE blockHash IN ({})'.format(placeholders),
+                           [branch] + chunk)
+
+    def _get_balance_deltas(self, cursor, block_hashes):
+        # returns list of tuples of branch, address, asset, net change contributed by the transactions of the given
+        # blocks to their current branch
+        sql = 'SELECT branch, address, asset, SUM(delta) FROM (' \
+              ' SELECT branch, src AS address, asset, -(amount + fee) AS delta FROM transactions' \
+              ' WHERE blockHash IN ({0})' \
+              ' UNION ALL' \
+              ' SELECT branch, dest AS address, asset, amount AS delta FROM transactions WHERE blockHash IN ({0})' \
+              ' AND dest != src) GROUP BY branch, address, asset'
+        deltas = {}
+        for i in range(0, len(block_hashes), self.REORG_CHUNK_SIZE):
+            chunk = block_hashes[i:i + self.REORG_CHUNK_SIZE]
+            for branch, address, asset, delta in cursor.execute(sql.format(",".join("?" * len(chunk))),
+                                                                chunk + chunk):
+                key = (branch, address, asset)
+                deltas[key] = deltas.get(key, 0) + delta
+        return [(branch, address, asset, delta) for (branch, address, asset), delta in deltas.items()]
+
+    def _get_reorg_transactions(self, cursor, disconnect_hashes, connect_hashes):
+        # the transactions of disconnected blocks go back to the mempool unless a connected block confirms them or
+        # spends the same previous transaction.  Coinbase transactions are only valid in their own block
+        connected = set()
+        spent = set()
+        for i in range(0, len(connect_hashes), self.REORG_CHUNK_SIZE):
+            chunk = connect_hashes[i:i + self.REORG_CHUNK_SIZE]
+            for tx_hash, prev_hash in cursor.execute('SELECT hash, prevHash FROM transactions WHERE blockHash IN ({})'
+                                                     .format(",".join("?" * len(chunk))), chunk):
+                connected.add(tx_hash)
+                spent.add(prev_hash)
+        returned = []
+        for i in range(0, len(disconnect_hashes), self.REORG_CHUNK_SIZE):
+            chunk = disconnect_hashes[i:i + self.REORG_CHUNK_SIZE]
+            cursor.execute('SELECT * FROM transactions WHERE type != ? AND blockHash IN ({})'
+                           .format(",".join("?" * len(chunk))), [TransactionType.COINBASE.value] + chunk)
+            for transaction in cursor:
+                if transaction[0] in connected or transaction[12] in spent:
+                    continue
+                returned.append(Transaction(
+                    transaction[1], transaction[2], transaction[3], transaction[4], tx_type=transaction[7],
+                    timestamp=transaction[5], tx_hash=transaction[0], signature=transaction[6],
+                    asset=transaction[9], data=transaction[10], prev_hash=transaction[12]))
+        return returned, list(connected)
+
+    def _get_funded_transactions(self, cursor, transactions):
+        # the transactions returned by a reorg may spend funds the new primary branch does not hold, such as the
+        # reward of a disconnected coinbase.  Spends are summed per source and asset as when validating a batch, and
+        # each source keeps its oldest transactions that its primary branch balance covers
+        by_source = {}
+        for transaction in transactions:
+            by_source.setdefault((transaction.source, transaction.asset), []).append(transaction)
+        sources = list(by_source)
+        balances = {}
+        for i in range(0, len(sources), self.REORG_CHUNK_SIZE):
+            chunk = sources[i:i + self.REORG_CHUNK_SIZE]
+            cursor.execute('SELECT address, asset, amount FROM balances WHERE branch = 0 AND ({})'
+                           .format(" OR ".join(["(address = ? AND asset = ?)"] * len(chunk))),
+                           [value for source in chunk for value in source])
+            for address, asset, amount in cursor.fetchall():
+                balances[(address, asset)] = amount
+        unfunded = set()
+        for key, source_transactions in by_source.items():
+            available = balances.get(key, 0)
+            for transaction in sorted(source_transactions, key=lambda t: t.timestamp):
+                if transaction.amount + transaction.fee > available:
+                    logger.warn('Transaction not returned to the mempool.  Insufficient funds: {}'
+                                .format(transaction.tx_hash))
+                    unfunded.add(transaction.tx_hash)
+                else:
+                    available -= transaction.amount + transaction.fee
+        return [transaction for transaction in transactions if transaction.tx_hash not in unfunded]
+
+    @staticmethod
+    def _update_balances(cursor, deltas, branch):
+        # deltas is an iterable of tuples of address, asset, amount to add to the materialized balance
+        deltas = list(deltas)
+        cursor.executemany('INSERT OR IGNORE INTO balances (address, asset, branch, amount) VALUES (?, ?, ?, 0)',
+                           ((address, asset, branch) for address, asset, delta in deltas))
+        cursor.executemany('UPDATE balances SET amount = amount + ? WHERE address=? AND asset=? AND branch=?',
+                           ((delta, address, asset, branch) for address, asset, delta in deltas))
+
+    def rebuild_balances(self):
+        """
+        Recomputes the materialized balances table from the full transaction history
+        """
+        sql = 'INSERT INTO balances (address, asset, branch, amount) SELECT address, asset, branch, SUM(delta) FROM (' \
+              ' SELECT src AS address, asset, branch, -(amount + fee) AS delta FROM transactions' \
+              ' UNION ALL' \
+              ' SELECT dest AS address, asset, branch, amount AS delta FROM transactions WHERE dest != src' \
+              ') GROUP BY address, asset, branch'
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
-            cursor.execute(block_sql.format(0, ",".join(alt_branch_hashes)))
-            cursor.execute(tx_sql.format(0, ",".join(alt_branch_hashes)))
-            cursor.execute(block_sql.format(branch, ",".join(primary_branch_hashes)))
-            cursor.execute(tx_sql.format(branch, ",".join(primary_branch_hashes)))
+            cursor.execute('DELETE FROM balances')
+            cursor.execute(sql)
         return
 
     def get_transaction_history(self, address, branch=0):
         # TODO: convert this to return a generator
         transactions = []
         sql = "SELECT * FROM transactions WHERE (src='{}' OR dest='{}') AND branch={}".format(address, address, branch)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             for transaction in cursor:
@@ -143,7 +323,7 @@ class Blockchain(object):
     def get_transactions_by_block_hash(self, block_hash):
         transactions = []
         sql = "SELECT * FROM transactions WHERE blockHash='{}' ORDER BY hash ASC".format(block_hash)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             for transaction in cursor:
@@ -153,24 +333,45 @@ class Blockchain(object):
                                     prev_hash=transaction[12]))
         return transactions
 
+    def get_transactions_by_hashes(self, tx_hashes):
+        """
+        :param tx_hashes: transaction hashes
+        :type tx_hashes: list
+        :return: the transactions found on any branch, keyed by hash
+        :rtype: dict
+        """
+        transactions = {}
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(tx_hashes), self.TRANSACTION_QUERY_CHUNK):
+                chunk = tx_hashes[i:i + self.TRANSACTION_QUERY_CHUNK]
+                cursor.execute("SELECT * FROM transactions WHERE hash IN ({})".format(",".join("?" * len(chunk))),
+                               chunk)
+                for transaction in cursor:
+                    transactions[transaction[0]] = Transaction(
+                        transaction[1], transaction[2], transaction[3], transaction[4], tx_type=transaction[7],
+                        timestamp=transaction[5], tx_hash=transaction[0], signature=transaction[6],
+                        asset=transaction[9], data=transaction[10], prev_hash=transaction[12])
+        return transactions
+
     def get_transaction_hashes_by_block_hash(self, block_hash):
         sql = "SELECT hash FROM transactions WHERE blockHash='{}' ORDER BY type, hash ASC".format(block_hash)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
-            conn.row_factory = lambda cursor, row: row[0]
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = lambda cursor, row: row[0]
             hashes = cursor.execute(sql).fetchall()
         return hashes
 
     def get_coinbase_hash_by_block_hash(self, block_hash):
         sql = "SELECT hash FROM transactions WHERE blockHash='{}' AND type=2".format(block_hash)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             tx_hash = cursor.execute(sql).fetchone()
         return tx_hash[0]
 
     def get_transaction_by_hash(self, transaction_hash, branch=0):
         sql = "SELECT * FROM transactions WHERE hash='{}' AND branch={}".format(transaction_hash, branch)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             transaction = cursor.fetchone()
@@ -181,22 +382,16 @@ class Blockchain(object):
     def get_balance(self, address, asset=None, branch=0):
         if asset is None:
             asset = '29bb7eb4fa78fc709e1b8b88362b7f8cb61d9379667ad4aedc8ec9f664e16680'
-        balance = 0
-        sql = "SELECT src, dest, amount, fee FROM transactions WHERE (src='{}' OR dest='{}') AND asset='{}' AND \
-               branch={}".format(address, address, asset, branch)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        sql = "SELECT amount FROM balances WHERE address=? AND asset=? AND branch=?"
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
-            cursor.execute(sql)
-            for transaction in cursor:
-                if transaction[0] == address:
-                    balance -= transaction[2] + transaction[3]
-                else:
-                    balance += transaction[2]
-        return balance
+            cursor.execute(sql, (address, asset, branch))
+            balance = cursor.fetchone()
+        return 0 if balance is None else balance[0]
 
     def find_duplicate_transactions(self, transaction_hash):
         sql = "SELECT COUNT(*) FROM transactions WHERE hash='{}'".format(transaction_hash)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             count = cursor.fetchone()[0]
@@ -212,12 +407,14 @@ class Blockchain(object):
                 block_header, block_branch, block_height = tallest_block_header
         else:
             block_headers_at_height = self.get_block_headers_by_height(height)
-            if block_headers_at_height is not None:
-                block_header, block_branch, block_height = block_headers_at_height
+            if block_headers_at_height:
+                # the primary branch sorts first
+                block_header, block_branch, block_height = block_headers_at_height[0]
         height = block_height
 
         if height > self.DIFFICULTY_ADJUSTMENT_SPAN:
-            bd_header, bd_branch, bd_height = self.get_block_headers_by_height(height - self.DIFFICULTY_ADJUSTMENT_SPAN)
+            bd_header, bd_branch, bd_height = self.get_block_headers_by_height(
+                height - self.DIFFICULTY_ADJUSTMENT_SPAN)[0]
             timestamp_delta = block_header.timestamp - bd_header.timestamp
             # blocks were mined quicker than target
             if timestamp_delta < (self.TARGET_TIME_PER_BLOCK * self.DIFFICULTY_ADJUSTMENT_SPAN):
@@ -239,7 +436,7 @@ class Blockchain(object):
 
     def get_height(self):
         sql = 'SELECT MAX(height) FROM blocks'
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             height = cursor.fetchone()[0]
@@ -247,7 +444,7 @@ class Blockchain(object):
 
     def get_branch_by_hash(self, block_hash):
         sql = "SELECT branch FROM blocks WHERE hash='{}'".format(block_hash)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             branch = cursor.fetchone()
@@ -258,7 +455,7 @@ class Blockchain(object):
     def get_tallest_block_header(self, branch=0):
         # returns tuple of BlockHeader, branch, height
         sql = 'SELECT * FROM blocks WHERE height = (SELECT MAX(height) FROM blocks WHERE branch={})'.format(branch)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             block = cursor.fetchone()
@@ -270,17 +467,18 @@ class Blockchain(object):
         # returns tuples of BlockHeader, branch, height
         block_headers = []
         sql = 'SELECT * FROM blocks WHERE height={} ORDER BY branch'.format(height)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             for block in cursor:
-                block_headers.append(BlockHeader(block[1], block[2], block[5], block[4], block[6])), block[7], block[3]
+                block_headers.append((BlockHeader(block[1], block[2], block[5], block[4], block[6]), block[7],
+                                      block[3]))
         return block_headers
 
     def get_block_header_by_hash(self, block_hash):
         # returns tuple of BlockHeader, branch, height
         sql = "SELECT * FROM blocks WHERE hash='{}'".format(block_hash)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             block = cursor.fetchone()
@@ -291,9 +489,9 @@ class Blockchain(object):
     def get_branches_by_prevhash(self, prev_hash):
         # returns list of branches
         sql = "SELECT branch FROM blocks WHERE prevHash='{}' ORDER BY branch".format(prev_hash)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
-            conn.row_factory = lambda cursor, row: row[0]
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = lambda cursor, row: row[0]
             branches = cursor.execute(sql).fetchall()
         return branches
 
@@ -304,7 +502,7 @@ class Blockchain(object):
         #    WHERE height >= (SELECT MAX(height) FROM blocks) - {} GROUP BY branch ORDER BY branch'.format(tolerance)
         sql = 'SELECT * FROM branches WHERE currentHeight >= (SELECT MAX(height) FROM blocks) - {} ORDER BY id'\
             .format(tolerance)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             for branch in cursor:
@@ -314,7 +512,7 @@ class Blockchain(object):
     def get_all_block_headers_iter(self, branch=0):
         # yields tuples of BlockHeader, branch, height
         sql = 'SELECT * FROM blocks WHERE branch={}'.format(branch)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             for block in cursor:
@@ -324,18 +522,79 @@ class Blockchain(object):
         # yields tuples of BlockHeader, branch, height
         sql = 'SELECT * FROM blocks WHERE height >= {} AND height <= {} AND branch={} ORDER BY height ASC'\
             .format(start_height, stop_height, branch)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             for block in cursor:
                 yield BlockHeader(block[1], block[2], block[5], block[4], block[6]), block[7], block[3]
 
+    @classmethod
+    def get_locator_heights(cls, tip_height):
+        """
+        :param tip_height: height of the tallest block
+        :type tip_height: int
+        :return: exponentially spaced heights from the tip down to the genesis block
+        :rtype: list of int
+        """
+        heights = []
+        height = tip_height
+        step = 1
+        while height > 1:
+            heights.append(height)
+            if len(heights) >= cls.LOCATOR_DENSE_HASHES:
+                step *= 2
+            height -= step
+        heights.append(1)
+        return heights
+
+    def get_block_locator(self, branch=0):
+        """
+        Block hashes spaced exponentially back from the tip of a branch, so that a peer can find the last block we
+        share however deep the fork.  One query whatever the length of the chain
+
+        :param branch: branch
+        :type branch: int
+        :return: block hashes from the tip down to the genesis block
+        :rtype: list of str
+        """
+        tip = self.get_tallest_block_header(branch)
+        if tip is None:
+            return []
+        tip_header, tip_branch, tip_height = tip
+        heights = self.get_locator_heights(tip_height)
+        sql = "SELECT hash FROM blocks WHERE branch = ? AND height IN ({}) ORDER BY height DESC"\
+            .format(",".join("?" * len(heights)))
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = lambda cursor, row: row[0]
+            hashes = cursor.execute(sql, [branch] + heights).fetchall()
+        return hashes
+
+    def find_fork_point(self, locator, branch=0):
+        """
+        :param locator: block hashes of a peer, from its tip down
+        :type locator: list of str
+        :param branch: branch
+        :type branch: int
+        :return: hash and height of the tallest locator block on the branch, or None if there is none
+        :rtype: tuple(str, int)
+        """
+        if not locator:
+            return None
+        sql = "SELECT hash, height FROM blocks WHERE branch = ? AND hash IN ({}) ORDER BY height DESC LIMIT 1"\
+            .format(",".join("?" * len(locator)))
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, [branch] + list(locator))
+            fork_point = cursor.fetchone()
+        return None if fork_point is None else (fork_point[0], fork_point[1])
+
     def get_hashes_range(self, start_height, stop_height, branch=0):
         sql = 'SELECT hash FROM blocks WHERE height >= {} AND height <= {} AND branch={} ORDER BY height ASC'\
             .format(start_height, stop_height, branch)
-        with sqlite3.connect(self.CHAIN_DB) as conn:
-            conn.row_factory = lambda cursor, row: row[0]
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = lambda cursor, row: row[0]
             hashes = cursor.execute(sql).fetchall()
         return hashes
 
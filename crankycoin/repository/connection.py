@@ -0,0 +1,112 @@
+from contextlib import contextmanager
+import os
+import queue
+import sqlite3
+import threading
+
+from crankycoin import config
+
+
+class ConnectionPool(object):
+    """
+    Per-process pool of SQLite connections for a single database file.
+
+    Readers are recycled through a bounded idle pool.  Writes are serialized through a single writer
+    connection.  Every connection runs in WAL journal mode so readers never block the writer.
+    """
+
+    READER_POOL_SIZE = config['user']['db_reader_pool_size']
+    BUSY_TIMEOUT = config['user']['db_busy_timeout']
+    SYNCHRONOUS = config['user']['db_synchronous']
+    CACHE_SIZE = config['user']['db_cache_size']
+    MMAP_SIZE = config['user']['db_mmap_size']
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.pid = os.getpid()
+        self.initialized = False
+        self._readers = queue.LifoQueue(maxsize=self.READER_POOL_SIZE)
+        self._writer = None
+        self._writer_depth = 0
+        self._writer_lock = threading.RLock()
+
+    @classmethod
+    def instance(cls, db_path):
+        """
+        Returns the pool for db_path owned by the current process.  Pools inherited across a fork are discarded.
+
+        :param db_path: path to the sqlite database file
+        :type db_path: str
+        :return: connection pool
+        :rtype: ConnectionPool
+        """
+        pid = os.getpid()
+        with cls._pools_lock:
+            pool = cls._pools.get(db_path)
+            if pool is None or pool.pid != pid:
+                pool = cls(db_path)
+                cls._pools[db_path] = pool
+        return pool
+
+    def _connect(self, query_only=False):
+        conn = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous={}".format(self.SYNCHRONOUS))
+        # negative cache_size is expressed in KiB rather than pages
+        conn.execute("PRAGMA cache_size=-{}".format(self.CACHE_SIZE))
+        conn.execute("PRAGMA mmap_size={}".format(self.MMAP_SIZE))
+        if query_only:
+            conn.execute("PRAGMA query_only=1")
+        return conn
+
+    @contextmanager
+    def reader(self):
+        # never blocks: an exhausted pool opens an extra connection which is closed on release if the pool is full
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect(query_only=True)
+        try:
+            yield conn
+        finally:
+            try:
+                self._readers.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        # the outermost writer takes the database write lock up front with BEGIN IMMEDIATE.
+        # nested writers within the same thread join the outermost transaction
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            if self._writer_depth == 0:
+                conn.execute("BEGIN IMMEDIATE")
+            self._writer_depth += 1
+            try:
+                yield conn
+            except BaseException:
+                if self._writer_depth == 1:
+                    conn.rollback()
+                raise
+            else:
+                if self._writer_depth == 1:
+                    conn.commit()
+            finally:
+                self._writer_depth -= 1
+
+    def close(self):
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
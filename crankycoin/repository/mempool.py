@@ -1,31 +1,57 @@
+import json
+import time
 from multiprocessing import Lock
-import sqlite3
 
 from crankycoin import config
+from crankycoin.models.block import Block
 from crankycoin.models.transaction import Transaction
+from crankycoin.repository.connection import ConnectionPool
 
 
 class Mempool(object):
 
     POOL_DB = config['user']['pool_db']
+    VERIFIED_CACHE_SIZE = config['user']['verified_cache_size']
+    VERIFIED_CACHE_TTL = config['user']['verified_cache_ttl']
+    VERIFIED_CACHE_PRUNE_INTERVAL = config['user']['verified_cache_prune_interval']
+    VERIFIED_CACHE_TOUCH_INTERVAL = config['user']['verified_cache_touch_interval']
+    ORPHAN_POOL_SIZE = config['user']['orphan_pool_size']
+    ORPHAN_POOL_BYTES = config['user']['orphan_pool_bytes']
+    ORPHAN_POOL_TTL = config['user']['orphan_pool_ttl']
+    # stays below SQLite's bound parameter limit
+    QUERY_CHUNK = 500
+    # hashes added to the verified cache by this process since it was last pruned
+    _verified_inserts = 0
 
     def __init__(self):
+        self.pool = ConnectionPool.instance(self.POOL_DB)
         self.db_init()
 
     def db_init(self):
-        with sqlite3.connect(self.POOL_DB) as conn:
+        # the schema check only runs once per process
+        if self.pool.initialized:
+            return
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute("PRAGMA table_info(unconfirmed_transactions)")
-            if len(cursor.fetchall()) > 0:
-                return
-            sql = open('config/init_mempool.sql', 'r').read()
-            cursor = conn.cursor()
-            cursor.executescript(sql)
+            if len(cursor.fetchall()) == 0:
+                sql = open('config/init_mempool.sql', 'r').read()
+                cursor.executescript(sql)
+            cursor.execute("PRAGMA index_info(idx_verified_transactions_verified_at)")
+            if len(cursor.fetchall()) == 0:
+                # also adds the index to caches created before it existed
+                sql = open('config/init_verified_transactions.sql', 'r').read()
+                cursor.executescript(sql)
+            cursor.execute("PRAGMA table_info(orphan_blocks)")
+            if len(cursor.fetchall()) == 0:
+                sql = open('config/init_orphan_blocks.sql', 'r').read()
+                cursor.executescript(sql)
+        self.pool.initialized = True
         return
 
     def get_all_unconfirmed_transactions_iter(self):
         sql = 'SELECT * FROM unconfirmed_transactions'
-        with sqlite3.connect(self.POOL_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             for transaction in cursor:
@@ -35,7 +61,7 @@ class Mempool(object):
 
     def get_unconfirmed_transactions_count(self):
         sql = 'SELECT count(*) FROM unconfirmed_transactions'
-        with sqlite3.connect(self.POOL_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             count = cursor.fetchone()[0]
@@ -43,21 +69,49 @@ class Mempool(object):
 
     def get_unconfirmed_transaction(self, tx_hash):
         sql = "SELECT * FROM unconfirmed_transactions WHERE hash='{}'".format(tx_hash)
-        with sqlite3.connect(self.POOL_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             data = cursor.fetchone()
         if data is None:
             return None
-        transaction = data[0]
+        transaction = data
         return Transaction(transaction[1], transaction[2], transaction[3], transaction[4], transaction[10],
                            transaction[7], transaction[5], transaction[0], transaction[8], transaction[9],
                            transaction[6])
 
+    def get_unconfirmed_transaction_hashes(self):
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = lambda cursor, row: row[0]
+            hashes = cursor.execute("SELECT hash FROM unconfirmed_transactions").fetchall()
+        return hashes
+
+    def get_unconfirmed_transactions_by_hashes(self, tx_hashes):
+        """
+        :param tx_hashes: transaction hashes
+        :type tx_hashes: list
+        :return: the unconfirmed transactions found, keyed by hash
+        :rtype: dict
+        """
+        transactions = {}
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(tx_hashes), self.QUERY_CHUNK):
+                chunk = tx_hashes[i:i + self.QUERY_CHUNK]
+                cursor.execute("SELECT * FROM unconfirmed_transactions WHERE hash IN ({})"
+                               .format(",".join("?" * len(chunk))), chunk)
+                for transaction in cursor:
+                    transactions[transaction[0]] = Transaction(
+                        transaction[1], transaction[2], transaction[3], transaction[4], transaction[10],
+                        transaction[7], transaction[5], transaction[0], transaction[8], transaction[9],
+                        transaction[6])
+        return transactions
+
     def get_unconfirmed_transactions_chunk(self, chunk_size=None):
         sql = 'SELECT * FROM unconfirmed_transactions ORDER BY fee DESC LIMIT {}'.format(chunk_size)
         transactions = []
-        with sqlite3.connect(self.POOL_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             for transaction in cursor:
@@ -72,14 +126,14 @@ class Mempool(object):
                 .format(transaction.tx_hash, transaction.source, transaction.destination, transaction.amount,
                         transaction.fee, transaction.timestamp, transaction.signature, transaction.tx_type,
                         transaction.asset, transaction.data, transaction.prev_hash)
-        with sqlite3.connect(self.POOL_DB) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             return cursor.lastrowid
 
     def remove_unconfirmed_transaction(self, tx_hash):
         sql = "DELETE FROM unconfirmed_transactions WHERE hash='{}'".format(tx_hash)
-        with sqlite3.connect(self.POOL_DB) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             return cursor.rowcount
@@ -87,11 +141,217 @@ class Mempool(object):
     def remove_unconfirmed_transactions(self, transactions):
         sql = "DELETE FROM unconfirmed_transactions WHERE hash IN ({})"\
             .format(",".join(["'" + transaction.tx_hash + "'" for transaction in transactions]))
-        with sqlite3.connect(self.POOL_DB) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             return cursor.rowcount
 
+    # Verified transactions.  A bounded LRU set of transaction hashes whose signatures have been verified, shared by
+    # every process through the pool database.  Callers record hashes they computed from the transaction contents,
+    # never one a peer supplied.  The hash covers the signature, so a hit vouches for the exact transaction contents.
+
+    def get_verified_transactions(self, tx_hashes):
+        """
+        Looks up transaction hashes in the verified cache and marks the hits as recently used.  Hits already used
+        within VERIFIED_CACHE_TOUCH_INTERVAL are not marked again, so repeated lookups need no write
+
+        :param tx_hashes: transaction hashes
+        :type tx_hashes: list
+        :return: the hashes that were verified within VERIFIED_CACHE_TTL
+        :rtype: set
+        """
+        now = int(time.time())
+        verified = set()
+        stale = []
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(tx_hashes), self.QUERY_CHUNK):
+                chunk = tx_hashes[i:i + self.QUERY_CHUNK]
+                cursor.execute("SELECT hash, lastUsed FROM verified_transactions WHERE verifiedAt > ?"
+                               " AND hash IN ({})".format(",".join("?" * len(chunk))),
+                               [now - self.VERIFIED_CACHE_TTL] + chunk)
+                for tx_hash, last_used in cursor:
+                    verified.add(tx_hash)
+                    if last_used < now - self.VERIFIED_CACHE_TOUCH_INTERVAL:
+                        stale.append(tx_hash)
+        if stale:
+            with self.pool.writer() as conn:
+                conn.executemany("UPDATE verified_transactions SET lastUsed=? WHERE hash=?",
+                                 ((now, tx_hash) for tx_hash in stale))
+        return verified
+
+    def add_verified_transactions(self, tx_hashes):
+        """
+        Records verified transaction hashes.  Every VERIFIED_CACHE_PRUNE_INTERVAL hashes added by this process, drops
+        expired entries and evicts the least recently used ones beyond VERIFIED_CACHE_SIZE
+
+        :param tx_hashes: transaction hashes
+        :type tx_hashes: list
+        """
+        now = int(time.time())
+        Mempool._verified_inserts += len(tx_hashes)
+        prune = Mempool._verified_inserts >= self.VERIFIED_CACHE_PRUNE_INTERVAL
+        if prune:
+            Mempool._verified_inserts = 0
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("INSERT OR REPLACE INTO verified_transactions (hash, verifiedAt, lastUsed)"
+                               " VALUES (?, ?, ?)", ((tx_hash, now, now) for tx_hash in tx_hashes))
+            if not prune:
+                return
+            cursor.execute("DELETE FROM verified_transactions WHERE verifiedAt <= ?", (now - self.VERIFIED_CACHE_TTL,))
+            cursor.execute("SELECT COUNT(*) FROM verified_transactions")
+            excess = cursor.fetchone()[0] - self.VERIFIED_CACHE_SIZE
+            if excess > 0:
+                cursor.execute("DELETE FROM verified_transactions WHERE hash IN (SELECT hash FROM"
+                               " verified_transactions ORDER BY lastUsed LIMIT ?)", (excess,))
+
+    def clear_verified_transactions(self):
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM verified_transactions")
+            return cursor.rowcount
+
+    def apply_reorganization(self, transactions, confirmed_tx_hashes):
+        """
+        Brings the pool in line with a reorganized chain in one transaction: transactions of disconnected blocks are
+        returned to the pool, transactions confirmed by connected blocks are removed, and the verified cache is
+        cleared since verification results are not carried across a reorg
+
+        :param transactions: transactions of the disconnected blocks
+        :type transactions: list of Transaction
+        :param confirmed_tx_hashes: hashes of the transactions of the connected blocks
+        :type confirmed_tx_hashes: list of str
+        """
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("INSERT OR IGNORE INTO unconfirmed_transactions (hash, src, dest, amount, fee,"
+                               " timestamp, signature, type, asset, data, prevHash)"
+                               " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               ((transaction.tx_hash, transaction.source, transaction.destination,
+                                 transaction.amount, transaction.fee, transaction.timestamp, transaction.signature,
+                                 transaction.tx_type, transaction.asset, transaction.data, transaction.prev_hash)
+                                for transaction in transactions))
+            for i in range(0, len(confirmed_tx_hashes), self.QUERY_CHUNK):
+                chunk = confirmed_tx_hashes[i:i + self.QUERY_CHUNK]
+                cursor.execute("DELETE FROM unconfirmed_transactions WHERE hash IN ({})"
+                               .format(",".join("?" * len(chunk))), chunk)
+            cursor.execute("DELETE FROM verified_transactions")
+
+    # Orphan blocks.  Blocks whose parent is not known yet, keyed by previous hash and shared by every worker process
+    # through the pool database.  The pool is bounded by block count and by serialized size, oldest evicted first,
+    # and entries expire after ORPHAN_POOL_TTL.
+
+    def add_orphan_block(self, block, sender):
+        """
+        Holds a block until its parent arrives, then drops expired orphans and evicts the oldest ones beyond
+        ORPHAN_POOL_SIZE blocks or ORPHAN_POOL_BYTES
+
+        :param block: block whose parent is unknown
+        :type block: Block
+        :param sender: peer the block came from
+        :type sender: str
+        :return: True if the block is held in the pool
+        :rtype: boolean
+        """
+        block_header = block.block_header
+        data = json.dumps({
+            'height': block.height,
+            'block_header': block_header.to_dict(),
+            'transactions': [transaction.to_dict() for transaction in block.transactions]
+        })
+        now = int(time.time())
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT OR IGNORE INTO orphan_blocks (hash, prevHash, block, size, sender, receivedAt)"
+                           " VALUES (?, ?, ?, ?, ?, ?)",
+                           (block_header.hash, block_header.previous_hash, data, len(data), sender, now))
+            cursor.execute("DELETE FROM orphan_blocks WHERE receivedAt <= ?", (now - self.ORPHAN_POOL_TTL,))
+            cursor.execute("SELECT hash, size FROM orphan_blocks ORDER BY receivedAt DESC, hash")
+            evicted = []
+            count = 0
+            size = 0
+            for orphan_hash, orphan_size in cursor.fetchall():
+                count += 1
+                size += orphan_size
+                if count > self.ORPHAN_POOL_SIZE or size > self.ORPHAN_POOL_BYTES:
+                    evicted.append((orphan_hash,))
+            cursor.executemany("DELETE FROM orphan_blocks WHERE hash = ?", evicted)
+            return (block_header.hash,) not in evicted
+
+    def has_orphan_block(self, block_hash):
+        """
+        :param block_hash: block hash
+        :type block_hash: str
+        :return: True if the block is held in the pool and has not expired
+        :rtype: boolean
+        """
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM orphan_blocks WHERE hash = ? AND receivedAt > ?",
+                           (block_hash, int(time.time()) - self.ORPHAN_POOL_TTL))
+            return cursor.fetchone() is not None
+
+    def pop_orphan_blocks(self, previous_hash):
+        """
+        Removes and returns the unexpired orphans building on a block.  Taking them in one write transaction hands
+        each orphan to a single worker
+
+        :param previous_hash: hash of the parent block
+        :type previous_hash: str
+        :return: (block, sender) tuples
+        :rtype: list of tuple
+        """
+        with self.pool.reader() as conn:
+            # most blocks have no orphans waiting, which a reader can tell without taking the write lock
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM orphan_blocks WHERE prevHash = ? LIMIT 1", (previous_hash,))
+            if cursor.fetchone() is None:
+                return []
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT block, sender FROM orphan_blocks WHERE prevHash = ? AND receivedAt > ?",
+                           (previous_hash, int(time.time()) - self.ORPHAN_POOL_TTL))
+            orphans = cursor.fetchall()
+            cursor.execute("DELETE FROM orphan_blocks WHERE prevHash = ?", (previous_hash,))
+        return [(self._orphan_block_from_json(data), sender) for data, sender in orphans]
+
+    def get_orphan_chain(self, block_hash):
+        """
+        Follows an orphan back through the pool to the first block whose parent is missing
+
+        :param block_hash: hash of an orphan block
+        :type block_hash: str
+        :return: number of orphans in the chain ending at the block and the hash of the missing parent, or
+            (0, None) if the block is not in the pool
+        :rtype: tuple(int, str)
+        """
+        sql = "WITH RECURSIVE chain(hash, prevHash, depth) AS (" \
+              " SELECT hash, prevHash, 1 FROM orphan_blocks WHERE hash = ?" \
+              " UNION ALL" \
+              " SELECT orphan_blocks.hash, orphan_blocks.prevHash, chain.depth + 1" \
+              " FROM orphan_blocks JOIN chain ON orphan_blocks.hash = chain.prevHash" \
+              ") SELECT depth, prevHash FROM chain ORDER BY depth DESC LIMIT 1"
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, (block_hash,))
+            chain = cursor.fetchone()
+        return (0, None) if chain is None else (chain[0], chain[1])
+
+    @staticmethod
+    def _orphan_block_from_json(data):
+        block_dict = json.loads(data)
+        block_header = block_dict['block_header']
+        block = Block(
+            block_dict['height'],
+            # the hashes are recomputed, so a block no longer matching its header is caught when it is connected
+            [Transaction.from_dict(tx) for tx in block_dict['transactions']],
+            block_header['previous_hash'],
+            timestamp=block_header['timestamp'],
+            nonce=block_header['nonce'])
+        block.block_header.version = block_header['version']
+        return block
+
 
 class MempoolMemory(object):
 
@@ -109,6 +369,19 @@ class MempoolMemory(object):
     def get_unconfirmed_transaction(self, tx_hash):
         return self.unconfirmed_transactions_map.get(tx_hash)
 
+    def get_unconfirmed_transaction_hashes(self):
+        return list(self.unconfirmed_transactions_map)
+
+    def get_unconfirmed_transactions_by_hashes(self, tx_hashes):
+        """
+        :param tx_hashes: transaction hashes
+        :type tx_hashes: list
+        :return: the unconfirmed transactions found, keyed by hash
+        :rtype: dict
+        """
+        return {tx_hash: self.unconfirmed_transactions_map[tx_hash] for tx_hash in tx_hashes
+                if tx_hash in self.unconfirmed_transactions_map}
+
     def get_unconfirmed_transactions_chunk(self, chunk_size=None):
         self.unconfirmed_transactions_lock.acquire()
         try:
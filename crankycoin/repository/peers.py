@@ -1,7 +1,8 @@
 import os
-import sqlite3
+import time
 
 from crankycoin import config
+from crankycoin.repository.connection import ConnectionPool
 
 
 class Peers(object):
@@ -11,25 +12,32 @@ class Peers(object):
     DOWNTIME_THRESHOLD = config['network']['downtime_threshold']
 
     def __init__(self):
+        self.pool = ConnectionPool.instance(self.PEER_DB)
         self.db_init()
         # TODO: do a health check of each peer
 
     def db_init(self):
         if not os.path.exists('./data'):
             os.makedirs('./data')
-        with sqlite3.connect(self.PEER_DB) as conn:
+        # the schema check only runs once per process
+        if self.pool.initialized:
+            return
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute("PRAGMA table_info(peers)")
-            if len(cursor.fetchall()) > 0:
-                return
-            sql = open('config/init_peers.sql', 'r').read()
-            cursor = conn.cursor()
-            cursor.executescript(sql)
+            if len(cursor.fetchall()) == 0:
+                sql = open('config/init_peers.sql', 'r').read()
+                cursor.executescript(sql)
+            cursor.execute("PRAGMA table_info(peer_stats)")
+            if len(cursor.fetchall()) == 0:
+                sql = open('config/init_peer_stats.sql', 'r').read()
+                cursor.executescript(sql)
+        self.pool.initialized = True
         return
 
     def get_peers_count(self):
         sql = 'SELECT count(*) FROM peers WHERE downtime < {}'.format(self.DOWNTIME_THRESHOLD)
-        with sqlite3.connect(self.PEER_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             count = cursor.fetchone()[0]
@@ -37,7 +45,7 @@ class Peers(object):
 
     def get_peer(self, host):
         sql = "SELECT * FROM peers WHERE host='{}'".format(host)
-        with sqlite3.connect(self.PEER_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             peer = cursor.fetchone()
@@ -46,7 +54,7 @@ class Peers(object):
     def get_all_peers(self):
         peers = []
         sql = 'SELECT host FROM peers ORDER BY downtime ASC LIMIT {}'.format(self.MAX_PEERS)
-        with sqlite3.connect(self.PEER_DB) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             for peer in cursor:
@@ -55,32 +63,80 @@ class Peers(object):
 
     def remove_peer(self, host):
         sql = "'DELETE FROM peers WHERE host='{}'".format(host)
-        with sqlite3.connect(self.PEER_DB) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             return cursor.rowcount
 
     def record_downtime(self, host):
         sql = "UPDATE peers SET downtime = downtime + 1 WHERE host='{}'".format(host)
-        with sqlite3.connect(self.PEER_DB) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             return cursor.rowcount
 
     def reset_downtime(self, host):
         sql = "UPDATE peers SET downtime = 0 WHERE host='{}'".format(host)
-        with sqlite3.connect(self.PEER_DB) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             return cursor.rowcount
 
     def add_peer(self, host):
         sql = "INSERT OR IGNORE INTO peers (host, downtime) VALUES ('{}', 0)".format(host)
-        with sqlite3.connect(self.PEER_DB) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute(sql)
             return cursor.lastrowid
 
+    def update_peer_stats(self, pid, stats, expire_before):
+        """
+        Replaces the connection statistics published by a process and drops statistics not refreshed since
+        expire_before, such as those of processes that have exited
+
+        :param pid: id of the publishing process
+        :type pid: int
+        :param stats: statistics keyed by host, as returned by PeerConnections.stats
+        :type stats: dict
+        :param expire_before: unix time
+        :type expire_before: float
+        """
+        now = int(time.time())
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM peer_stats WHERE pid = ? OR updatedAt < ?", (pid, int(expire_before)))
+            cursor.executemany("INSERT INTO peer_stats (host, pid, requests, errors, retries, rejected, circuitOpen, "
+                               "latencyMean, latencyP50, latencyP95, updatedAt) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               ((host, pid, s['requests'], s['errors'], s['retries'], s['rejected'],
+                                 int(s['circuit_open']), s['latency_mean'], s['latency_p50'], s['latency_p95'], now)
+                                for host, s in stats.items()))
+
+    def get_peer_stats(self):
+        """
+        :return: connection statistics published by each process, keyed by host
+        :rtype: dict
+        """
+        peer_stats = {}
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT host, pid, requests, errors, retries, rejected, circuitOpen, latencyMean, "
+                           "latencyP50, latencyP95, updatedAt FROM peer_stats ORDER BY host, pid")
+            for row in cursor:
+                peer_stats.setdefault(row[0], []).append({
+                    'pid': row[1],
+                    'requests': row[2],
+                    'errors': row[3],
+                    'retries': row[4],
+                    'rejected': row[5],
+                    'circuit_open': bool(row[6]),
+                    'latency_mean': row[7],
+                    'latency_p50': row[8],
+                    'latency_p95': row[9],
+                    'updated_at': row[10]
+                })
+        return peer_stats
+
 
 if __name__ == "__main__":
     pass
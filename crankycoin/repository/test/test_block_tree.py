@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import patch
+
+from crankycoin.repository.block_tree import BlockTree
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.connection import ConnectionPool
+from crankycoin.repository.mempool import Mempool
+from crankycoin.repository.test.test_blockchain import make_block, make_transaction
+from crankycoin.models.enums import TransactionType
+
+
+def coinbase(block_hash):
+    return make_transaction("coinbase" + block_hash, "0", "miner", 50, tx_type=TransactionType.COINBASE.value)
+
+
+class TestBlockTree(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "chaindata.db")
+        self.pool_db_path = os.path.join(self.tmpdir, "pool.db")
+        mempool_patcher = patch.object(Mempool, "POOL_DB", self.pool_db_path)
+        mempool_patcher.start()
+        self.addCleanup(mempool_patcher.stop)
+        with patch.object(Blockchain, "CHAIN_DB", self.db_path):
+            self.subject = Blockchain()
+        with self.subject.pool.writer() as conn:
+            conn.execute("INSERT INTO branches (id, currentHash, currentHeight) VALUES (0, 'genesis', 1)")
+            conn.execute("INSERT INTO blocks (hash, prevHash, merkleRoot, height, nonce, timestamp, version, branch)"
+                         " VALUES ('genesis', '', 'merkle', 1, 0, 1524041935, 1, 0)")
+        self.other_pools = []
+
+    def tearDown(self):
+        for pool in [self.subject.pool] + self.other_pools:
+            pool.close()
+        ConnectionPool._pools.pop(self.db_path, None)
+        pool = ConnectionPool._pools.pop(self.pool_db_path, None)
+        if pool is not None:
+            pool.close()
+        shutil.rmtree(self.tmpdir)
+
+    def other_process(self):
+        # a Blockchain with its own pool and tree, as in another process
+        other = Blockchain.__new__(Blockchain)
+        other.pool = ConnectionPool(self.db_path)
+        other.block_tree = BlockTree(other.pool)
+        self.other_pools.append(other.pool)
+        return other
+
+    def add_chain(self, blockchain, previous_hash, start_height, length, prefix):
+        for height in range(start_height, start_height + length):
+            block_hash = "{}{}".format(prefix, height)
+            self.assertTrue(blockchain.add_block(make_block(height, previous_hash, block_hash,
+                                                            [coinbase(block_hash)])))
+            previous_hash = block_hash
+        return previous_hash
+
+    def test_add_block_Indexes_blocks_and_branch_tips(self):
+        self.add_chain(self.subject, "genesis", 2, 4, "a")
+        self.add_chain(self.subject, "a3", 4, 1, "b")
+        tree = self.subject.block_tree
+
+        alt_branch = tree.get_branch("b4")
+        self.assertNotEqual(alt_branch, 0)
+        self.assertEqual(tree.height, 5)
+        self.assertEqual(tree.tips[0], ("a5", 5))
+        self.assertEqual(tree.tips[alt_branch], ("b4", 4))
+        self.assertEqual(tree.get_ancestor("a5", 2), "a2")
+        self.assertEqual(tree.find_fork_point("a5", "b4"), "a3")
+        self.assertEqual(tree.get_branch_hashes(alt_branch), ["b4"])
+
+    def test_add_block_When_alternate_branch_overtakes_Relabels_tree(self):
+        self.add_chain(self.subject, "genesis", 2, 3, "a")
+        alt_tip = self.add_chain(self.subject, "a2", 3, 3, "b")
+        tree = self.subject.block_tree
+
+        self.assertEqual(tree.tips[0], (alt_tip, 5))
+        self.assertEqual([tree.get_branch(block_hash) for block_hash in ("b3", "b4", "b5")], [0, 0, 0])
+        self.assertEqual(tree.get_branch("a3"), tree.get_branch("a4"))
+        self.assertEqual(tree.tips[tree.get_branch("a4")], ("a4", 4))
+
+    def test_synchronize_Replays_blocks_added_by_another_process(self):
+        self.add_chain(self.subject, "genesis", 2, 1, "a")
+        other = self.other_process()
+        self.add_chain(other, "a2", 3, 2, "a")
+
+        with patch.object(BlockTree, "load") as patched_load:
+            self.add_chain(self.subject, "a4", 5, 1, "a")
+
+        patched_load.assert_not_called()
+        self.assertEqual(self.subject.block_tree.tips[0], ("a5", 5))
+        self.assertEqual(self.subject.get_branch_by_hash("a5"), 0)
+
+    def test_synchronize_When_log_trimmed_Reloads(self):
+        self.add_chain(self.subject, "genesis", 2, 1, "a")
+        other = self.other_process()
+        with patch.object(BlockTree, "LOG_SIZE", 2):
+            self.add_chain(other, "a2", 3, 4, "a")
+            self.add_chain(self.subject, "a6", 7, 1, "a")
+
+        self.assertEqual(sorted(self.subject.block_tree.blocks), ["a2", "a3", "a4", "a5", "a6", "a7", "genesis"])
+        self.assertEqual(self.subject.block_tree.tips[0], ("a7", 7))
+
+    def test_add_block_When_restructure_rolled_back_Reloads_tree(self):
+        self.add_chain(self.subject, "genesis", 2, 2, "a")
+        self.add_chain(self.subject, "a2", 3, 1, "b")
+        duplicate = make_transaction("dup", "alice", "bob", 10)
+
+        # the alternate branch overtakes, then the block fails to insert
+        self.assertFalse(self.subject.add_block(make_block(4, "b3", "b4", [duplicate, duplicate])))
+        with self.subject.pool.writer() as conn:
+            self.subject.block_tree.synchronize(conn.cursor())
+
+        tree = self.subject.block_tree
+        self.assertEqual(tree.get_branch("a3"), 0)
+        self.assertNotEqual(tree.get_branch("b3"), 0)
+        self.assertEqual(tree.tips[0], ("a3", 3))
+        self.assertNotIn("b4", tree.blocks)
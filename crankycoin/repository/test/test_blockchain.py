@@ -0,0 +1,272 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import Mock, patch
+
+from crankycoin.models.block import Block, BlockHeader
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
+from crankycoin.repository.connection import ConnectionPool
+
+ASSET = '29bb7eb4fa78fc709e1b8b88362b7f8cb61d9379667ad4aedc8ec9f664e16680'
+
+
+def make_block(height, previous_hash, block_hash, transactions):
+    mock_block_header = Mock(BlockHeader)
+    mock_block_header.hash = block_hash
+    mock_block_header.previous_hash = previous_hash
+    mock_block_header.merkle_root = "merkle" + block_hash
+    mock_block_header.nonce = 0
+    mock_block_header.timestamp = 1524041935 + height
+    mock_block_header.version = 1
+    mock_block = Mock(Block)
+    mock_block.height = height
+    mock_block.block_header = mock_block_header
+    mock_block.transactions = transactions
+    return mock_block
+
+
+def make_transaction(tx_hash, source, destination, amount, fee=0, tx_type=TransactionType.STANDARD.value):
+    return Transaction(source, destination, amount, fee, tx_type=tx_type, timestamp=1524041935, tx_hash=tx_hash,
+                       signature="sig" + tx_hash, prev_hash="prev" + tx_hash)
+
+
+class TestBlockchain(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "chaindata.db")
+        self.pool_db_path = os.path.join(self.tmpdir, "pool.db")
+        mempool_patcher = patch.object(Mempool, "POOL_DB", self.pool_db_path)
+        mempool_patcher.start()
+        self.addCleanup(mempool_patcher.stop)
+        with patch.object(Blockchain, "CHAIN_DB", self.db_path):
+            self.subject = Blockchain()
+        with self.subject.pool.writer() as conn:
+            conn.execute("INSERT INTO branches (id, currentHash, currentHeight) VALUES (0, 'genesis', 1)")
+            conn.execute("INSERT INTO blocks (hash, prevHash, merkleRoot, height, nonce, timestamp, version, branch)"
+                         " VALUES ('genesis', '', 'merkle', 1, 0, 1524041935, 1, 0)")
+            conn.execute("INSERT INTO transactions (hash, src, dest, amount, fee, timestamp, signature, type,"
+                         " blockHash, asset, data, branch, prevHash) VALUES ('genesis_tx', '0', 'alice', 100, 0,"
+                         " 1524041935, '', 1, 'genesis', ?, '', 0, '0')", (ASSET,))
+        self.subject.rebuild_balances()
+
+    def tearDown(self):
+        self.subject.pool.close()
+        ConnectionPool._pools.pop(self.db_path, None)
+        pool = ConnectionPool._pools.pop(self.pool_db_path, None)
+        if pool is not None:
+            pool.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_add_block_Inserts_block_and_transactions(self):
+        coinbase = make_transaction("coinbase2", "0", "miner", 50, tx_type=TransactionType.COINBASE.value)
+        transaction = make_transaction("tx2", "alice", "bob", 10, fee=1)
+        block = make_block(2, "genesis", "block2", [coinbase, transaction])
+
+        result = self.subject.add_block(block)
+
+        self.assertTrue(result)
+        self.assertEqual(self.subject.get_height(), 2)
+        self.assertEqual(self.subject.get_transaction_hashes_by_block_hash("block2"), ["coinbase2", "tx2"])
+        self.assertEqual(self.subject.get_open_branches(10), [(0, "block2", 2)])
+
+    def test_add_block_When_transaction_insert_fails_Rolls_back_block(self):
+        duplicate = make_transaction("dup", "alice", "bob", 10)
+        block = make_block(2, "genesis", "block2", [duplicate, duplicate])
+
+        result = self.subject.add_block(block)
+
+        self.assertFalse(result)
+        self.assertEqual(self.subject.get_height(), 1)
+        self.assertIsNone(self.subject.get_block_header_by_hash("block2"))
+
+    def test_get_transactions_by_hashes_Returns_known_transactions_by_hash(self):
+        coinbase = make_transaction("coinbase2", "0", "miner", 50, tx_type=TransactionType.COINBASE.value)
+        transaction = make_transaction("tx2", "alice", "bob", 10, fee=1)
+        self.subject.add_block(make_block(2, "genesis", "block2", [coinbase, transaction]))
+
+        transactions = self.subject.get_transactions_by_hashes(["tx2", "unknown", "coinbase2"])
+
+        self.assertEqual(transactions, {"tx2": transaction, "coinbase2": coinbase})
+
+    def test_get_balance_When_address_unknown_Returns_zero(self):
+        self.assertEqual(self.subject.get_balance("nobody"), 0)
+
+    def test_add_block_Updates_balances(self):
+        coinbase = make_transaction("coinbase2", "0", "miner", 51, tx_type=TransactionType.COINBASE.value)
+        transaction = make_transaction("tx2", "alice", "bob", 10, fee=1)
+        self_transaction = make_transaction("tx3", "alice", "alice", 5, fee=1)
+        block = make_block(2, "genesis", "block2", [coinbase, transaction, self_transaction])
+
+        self.subject.add_block(block)
+
+        self.assertEqual(self.subject.get_balance("alice"), 83)
+        self.assertEqual(self.subject.get_balance("bob"), 10)
+        self.assertEqual(self.subject.get_balance("miner"), 51)
+
+    def test_rebuild_balances_Matches_incremental_balances(self):
+        coinbase = make_transaction("coinbase2", "0", "miner", 51, tx_type=TransactionType.COINBASE.value)
+        transaction = make_transaction("tx2", "alice", "bob", 10, fee=1)
+        self.subject.add_block(make_block(2, "genesis", "block2", [coinbase, transaction]))
+        with self.subject.pool.writer() as conn:
+            conn.execute("UPDATE balances SET amount = 0")
+
+        self.subject.rebuild_balances()
+
+        self.assertEqual(self.subject.get_balance("alice"), 89)
+        self.assertEqual(self.subject.get_balance("bob"), 10)
+
+    def test_add_block_When_alternate_branch_becomes_tallest_Restructures_primary_branch(self):
+        primary_coinbase = make_transaction("coinbase2", "0", "miner", 50, tx_type=TransactionType.COINBASE.value)
+        primary_transaction = make_transaction("tx2", "alice", "bob", 10)
+        self.subject.add_block(make_block(2, "genesis", "block2", [primary_coinbase, primary_transaction]))
+        alt_coinbase = make_transaction("coinbase2b", "0", "rival", 50, tx_type=TransactionType.COINBASE.value)
+        alt_transaction = make_transaction("tx2b", "alice", "carol", 20)
+        self.subject.add_block(make_block(2, "genesis", "block2b", [alt_coinbase, alt_transaction]))
+        alt_branch = self.subject.get_branch_by_hash("block2b")
+        coinbase3 = make_transaction("coinbase3", "0", "rival", 50, tx_type=TransactionType.COINBASE.value)
+
+        result = self.subject.add_block(make_block(3, "block2b", "block3b", [coinbase3]))
+
+        self.assertTrue(result)
+        self.assertNotEqual(alt_branch, 0)
+        self.assertEqual(self.subject.get_branch_by_hash("block2b"), 0)
+        self.assertEqual(self.subject.get_branch_by_hash("block3b"), 0)
+        self.assertEqual(self.subject.get_branch_by_hash("block2"), alt_branch)
+        self.assertEqual(self.subject.get_balance("alice"), 80)
+        self.assertEqual(self.subject.get_balance("carol"), 20)
+        self.assertEqual(self.subject.get_balance("bob"), 0)
+        self.assertEqual(self.subject.get_balance("rival"), 100)
+        self.assertEqual(self.subject.get_balance("bob", branch=alt_branch), 10)
+
+    def test_add_block_When_restructured_Clears_verified_transactions(self):
+        mempool = Mempool()
+        self.subject.add_block(make_block(2, "genesis", "block2", [
+            make_transaction("coinbase2", "0", "miner", 50, tx_type=TransactionType.COINBASE.value)]))
+        self.subject.add_block(make_block(2, "genesis", "block2b", [
+            make_transaction("coinbase2b", "0", "rival", 50, tx_type=TransactionType.COINBASE.value)]))
+        mempool.add_verified_transactions(["tx2"])
+        self.assertEqual(mempool.get_verified_transactions(["tx2"]), {"tx2"})
+
+        self.subject.add_block(make_block(3, "block2b", "block3b", [
+            make_transaction("coinbase3", "0", "rival", 50, tx_type=TransactionType.COINBASE.value)]))
+
+        self.assertEqual(mempool.get_verified_transactions(["tx2"]), set())
+
+    def test_add_block_When_reorg_spans_several_chunks_Relabels_every_block(self):
+        previous_hash = "genesis"
+        for height in range(2, 7):
+            block_hash = "main{}".format(height)
+            self.subject.add_block(make_block(height, previous_hash, block_hash, [
+                make_transaction("coinbase" + block_hash, "0", "miner", 50, tx_type=TransactionType.COINBASE.value),
+                make_transaction("tx" + block_hash, "alice", "bob", 1)]))
+            previous_hash = block_hash
+        previous_hash = "genesis"
+        with patch.object(Blockchain, "REORG_CHUNK_SIZE", 2):
+            for height in range(2, 8):
+                block_hash = "alt{}".format(height)
+                self.assertTrue(self.subject.add_block(make_block(height, previous_hash, block_hash, [
+                    make_transaction("coinbase" + block_hash, "0", "rival", 50,
+                                     tx_type=TransactionType.COINBASE.value)])))
+                previous_hash = block_hash
+        alt_branch = self.subject.get_branch_by_hash("main2")
+
+        self.assertNotEqual(alt_branch, 0)
+        self.assertEqual([self.subject.get_branch_by_hash("alt{}".format(height)) for height in range(2, 8)], [0] * 6)
+        self.assertEqual([self.subject.get_branch_by_hash("main{}".format(height)) for height in range(2, 7)],
+                         [alt_branch] * 5)
+        self.assertEqual(self.subject.get_open_branches(10), [(0, "alt7", 7), (alt_branch, "main6", 6)])
+        self.assertEqual(self.subject.get_balance("alice"), 100)
+        self.assertEqual(self.subject.get_balance("rival"), 300)
+        self.assertEqual(self.subject.get_balance("miner"), 0)
+        self.assertEqual(self.subject.get_balance("bob", branch=alt_branch), 5)
+        self.assertEqual(self.subject.get_balance("rival", branch=alt_branch), 0)
+
+    def test_add_block_When_alternate_branch_forked_off_another_Connects_both_runs(self):
+        self.add_chain("genesis", 2, 3, "a")
+        self.add_chain("a2", 3, 2, "b")
+        # c4 forks off b3, which already has a successor on its branch
+        self.add_chain("b3", 4, 1, "c")
+        b_branch = self.subject.get_branch_by_hash("b4")
+
+        self.add_chain("c4", 5, 1, "c")
+
+        self.assertEqual([self.subject.get_branch_by_hash(block_hash) for block_hash in ("a2", "b3", "c4", "c5")],
+                         [0, 0, 0, 0])
+        self.assertEqual(self.subject.get_branch_by_hash("b4"), b_branch)
+        self.assertEqual(self.subject.get_branch_by_hash("a3"), self.subject.get_branch_by_hash("a4"))
+        self.assertNotIn(self.subject.get_branch_by_hash("a4"), (0, b_branch))
+        self.assertEqual(self.subject.get_balance("miner"), 4 * 50)
+        self.assertEqual(self.subject.get_balance("miner", branch=b_branch), 50)
+        self.assertEqual(self.subject.block_tree.tips[b_branch], ("b4", 4))
+
+    def test_add_block_When_restructured_Updates_mempool(self):
+        mempool = Mempool()
+        shared = make_transaction("shared", "alice", "bob", 1)
+        disconnected = make_transaction("disconnected", "alice", "carol", 2)
+        confirmed = make_transaction("confirmed", "alice", "dave", 3)
+        mempool.push_unconfirmed_transaction(confirmed)
+        self.subject.add_block(make_block(2, "genesis", "block2", [
+            make_transaction("coinbase2", "0", "miner", 50, tx_type=TransactionType.COINBASE.value),
+            shared, disconnected]))
+        self.subject.add_block(make_block(2, "genesis", "block2b", [
+            make_transaction("coinbase2b", "0", "rival", 50, tx_type=TransactionType.COINBASE.value),
+            shared, confirmed]))
+
+        self.subject.add_block(make_block(3, "block2b", "block3b", [
+            make_transaction("coinbase3", "0", "rival", 50, tx_type=TransactionType.COINBASE.value)]))
+
+        self.assertEqual(mempool.get_unconfirmed_transaction_hashes(), ["disconnected"])
+        self.assertEqual(mempool.get_unconfirmed_transaction("disconnected").destination, "carol")
+
+    def test_add_block_When_restructured_Drops_returned_transactions_funded_by_disconnected_blocks(self):
+        mempool = Mempool()
+        self.subject.add_block(make_block(2, "genesis", "a2", [
+            make_transaction("coinbasea2", "0", "solo", 50, tx_type=TransactionType.COINBASE.value)]))
+        unfunded = make_transaction("unfunded", "solo", "bob", 40)
+        funded = make_transaction("funded", "alice", "carol", 5)
+        self.subject.add_block(make_block(3, "a2", "a3", [
+            make_transaction("coinbasea3", "0", "other", 50, tx_type=TransactionType.COINBASE.value),
+            unfunded, funded]))
+
+        self.add_chain("genesis", 2, 3, "b")
+
+        self.assertEqual(self.subject.get_branch_by_hash("b4"), 0)
+        self.assertEqual(self.subject.get_balance("solo"), 0)
+        self.assertEqual(self.subject.get_balance("bob"), 0)
+        self.assertEqual(mempool.get_unconfirmed_transaction_hashes(), ["funded"])
+
+    def add_chain(self, previous_hash, start_height, length, prefix):
+        for height in range(start_height, start_height + length):
+            block_hash = "{}{}".format(prefix, height)
+            self.assertTrue(self.subject.add_block(make_block(height, previous_hash, block_hash, [
+                make_transaction("coinbase" + block_hash, "0", "miner", 50, tx_type=TransactionType.COINBASE.value)])))
+            previous_hash = block_hash
+        return previous_hash
+
+    def test_get_locator_heights_Spaces_heights_exponentially_back_to_genesis(self):
+        self.assertEqual(Blockchain.get_locator_heights(1), [1])
+        self.assertEqual(Blockchain.get_locator_heights(100),
+                         [100, 99, 98, 97, 96, 95, 94, 93, 92, 91, 89, 85, 77, 61, 29, 1])
+        self.assertLess(len(Blockchain.get_locator_heights(1000000)), 40)
+
+    def test_get_block_locator_Returns_main_branch_hashes_from_tip(self):
+        self.add_chain("genesis", 2, 29, "main")
+
+        locator = self.subject.get_block_locator()
+
+        self.assertEqual(locator, ["main{}".format(height) if height > 1 else "genesis"
+                                   for height in Blockchain.get_locator_heights(30)])
+
+    def test_find_fork_point_When_fork_is_deep_Returns_last_common_block(self):
+        self.add_chain("genesis", 2, 9, "common")
+        self.add_chain("common10", 11, 150, "main")
+        # the peer's chain forked off after block 10 and grew longer on its own
+        peer_locator = ["peer{}".format(height) for height in range(300, 10, -30)] + ["common10", "common9", "genesis"]
+
+        self.assertEqual(self.subject.find_fork_point(peer_locator), ("common10", 10))
+        self.assertIsNone(self.subject.find_fork_point(["unknown"]))
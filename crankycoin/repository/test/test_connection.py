@@ -0,0 +1,79 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+from crankycoin.repository.connection import ConnectionPool
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "test.db")
+        self.subject = ConnectionPool.instance(self.db_path)
+        with self.subject.writer() as conn:
+            conn.execute("CREATE TABLE kv (k TEXT PRIMARY KEY, v INTEGER)")
+
+    def tearDown(self):
+        self.subject.close()
+        ConnectionPool._pools.pop(self.db_path, None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_instance_When_same_path_Returns_same_pool(self):
+        self.assertIs(ConnectionPool.instance(self.db_path), self.subject)
+
+    def test_instance_When_pid_changed_Returns_new_pool(self):
+        self.subject.pid = -1
+
+        result = ConnectionPool.instance(self.db_path)
+
+        self.assertIsNot(result, self.subject)
+        result.close()
+
+    def test_writer_Uses_wal_journal_mode(self):
+        with self.subject.writer() as conn:
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+
+        self.assertEqual(journal_mode, "wal")
+
+    def test_reader_Reuses_released_connection(self):
+        with self.subject.reader() as first:
+            pass
+        with self.subject.reader() as second:
+            pass
+
+        self.assertIs(first, second)
+
+    def test_reader_When_nested_Returns_distinct_connections(self):
+        with self.subject.reader() as outer:
+            with self.subject.reader() as inner:
+                self.assertIsNot(outer, inner)
+
+    def test_reader_When_writing_Raises_operational_error(self):
+        with self.subject.reader() as conn:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("INSERT INTO kv (k, v) VALUES ('a', 1)")
+
+    def test_writer_When_exception_raised_Rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with self.subject.writer() as conn:
+                conn.execute("INSERT INTO kv (k, v) VALUES ('a', 1)")
+                raise RuntimeError()
+
+        with self.subject.reader() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        self.assertEqual(count, 0)
+
+    def test_writer_When_nested_Commits_once_with_outer_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with self.subject.writer() as outer:
+                with self.subject.writer() as inner:
+                    inner.execute("INSERT INTO kv (k, v) VALUES ('a', 1)")
+                outer.execute("INSERT INTO kv (k, v) VALUES ('b', 2)")
+                raise RuntimeError()
+
+        with self.subject.reader() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        self.assertEqual(count, 0)
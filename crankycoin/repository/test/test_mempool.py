@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import patch
+
+from crankycoin.models.block import Block
+from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
+from crankycoin.repository.connection import ConnectionPool
+from crankycoin.repository.mempool import Mempool, MempoolMemory
+
+
+class TestMempoolVerifiedTransactions(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "pool.db")
+        with patch.object(Mempool, "POOL_DB", self.db_path):
+            self.subject = Mempool()
+        self.subject.VERIFIED_CACHE_SIZE = 3
+        self.subject.VERIFIED_CACHE_TTL = 100
+        self.subject.VERIFIED_CACHE_PRUNE_INTERVAL = 1
+        self.subject.VERIFIED_CACHE_TOUCH_INTERVAL = 0
+
+    def tearDown(self):
+        self.subject.pool.close()
+        ConnectionPool._pools.pop(self.db_path, None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_verified_transactions_Returns_only_cached_hashes(self):
+        self.subject.add_verified_transactions(["tx1", "tx2"])
+
+        verified = self.subject.get_verified_transactions(["tx1", "tx2", "tx3"])
+
+        self.assertEqual(verified, {"tx1", "tx2"})
+
+    def test_add_verified_transactions_When_full_Evicts_least_recently_used(self):
+        with patch('time.time', return_value=1000):
+            self.subject.add_verified_transactions(["tx1", "tx2", "tx3"])
+        with patch('time.time', return_value=1001):
+            self.subject.get_verified_transactions(["tx1"])
+        with patch('time.time', return_value=1002):
+            self.subject.add_verified_transactions(["tx4"])
+            verified = self.subject.get_verified_transactions(["tx1", "tx2", "tx3", "tx4"])
+
+        self.assertEqual(len(verified), 3)
+        self.assertIn("tx1", verified)
+        self.assertIn("tx4", verified)
+
+    def test_add_verified_transactions_Prunes_once_per_interval(self):
+        self.subject.VERIFIED_CACHE_PRUNE_INTERVAL = 3
+        Mempool._verified_inserts = 0
+        with patch('time.time', return_value=1000):
+            self.subject.add_verified_transactions(["tx1", "tx2"])
+            self.subject.add_verified_transactions(["tx3", "tx4"])
+            verified = self.subject.get_verified_transactions(["tx1", "tx2", "tx3", "tx4"])
+            self.assertEqual(len(verified), 3)
+            self.subject.add_verified_transactions(["tx5"])
+            verified = self.subject.get_verified_transactions(["tx1", "tx2", "tx3", "tx4", "tx5"])
+
+        self.assertEqual(len(verified), 4)
+
+    def test_get_verified_transactions_When_recently_used_Does_not_write(self):
+        self.subject.VERIFIED_CACHE_TOUCH_INTERVAL = 60
+        with patch('time.time', return_value=1000):
+            self.subject.add_verified_transactions(["tx1"])
+        with patch('time.time', return_value=1030), patch.object(self.subject.pool, "writer") as patched_writer:
+            verified = self.subject.get_verified_transactions(["tx1"])
+
+        self.assertEqual(verified, {"tx1"})
+        patched_writer.assert_not_called()
+
+    def test_get_verified_transactions_When_expired_Returns_empty(self):
+        with patch('time.time', return_value=1000):
+            self.subject.add_verified_transactions(["tx1"])
+        with patch('time.time', return_value=1100):
+            verified = self.subject.get_verified_transactions(["tx1"])
+
+        self.assertEqual(verified, set())
+
+    def test_get_verified_transactions_When_many_hashes_Queries_in_chunks(self):
+        self.subject.VERIFIED_CACHE_SIZE = 2000
+        tx_hashes = ["tx{}".format(i) for i in range(1200)]
+        self.subject.add_verified_transactions(tx_hashes[::2])
+
+        verified = self.subject.get_verified_transactions(tx_hashes)
+
+        self.assertEqual(verified, set(tx_hashes[::2]))
+
+    def test_get_unconfirmed_transactions_by_hashes_Returns_known_transactions_by_hash(self):
+        transactions = [Transaction("src{}".format(i), "dest", 1, 0.1, prev_hash="prev{}".format(i),
+                                    timestamp=1524041935, signature="sig") for i in range(600)]
+        for transaction in transactions:
+            self.subject.push_unconfirmed_transaction(transaction)
+        tx_hashes = [transaction.tx_hash for transaction in transactions]
+
+        found = self.subject.get_unconfirmed_transactions_by_hashes(tx_hashes[::2] + ["unknown"])
+
+        self.assertEqual(sorted(found), sorted(tx_hashes[::2]))
+        self.assertEqual(found[tx_hashes[4]].source, "src4")
+
+    def test_clear_verified_transactions_Empties_cache(self):
+        self.subject.add_verified_transactions(["tx1", "tx2"])
+
+        self.subject.clear_verified_transactions()
+
+        self.assertEqual(self.subject.get_verified_transactions(["tx1", "tx2"]), set())
+
+    def test_apply_reorganization_Returns_disconnected_and_removes_confirmed_transactions(self):
+        transactions = [Transaction("src{}".format(i), "dest", 1, 0.1, prev_hash="prev{}".format(i),
+                                    timestamp=1524041935, signature="sig") for i in range(4)]
+        self.subject.push_unconfirmed_transaction(transactions[0])
+        self.subject.push_unconfirmed_transaction(transactions[1])
+        self.subject.add_verified_transactions(["tx1"])
+
+        self.subject.apply_reorganization(transactions[1:3], [transactions[0].tx_hash])
+
+        self.assertEqual(sorted(self.subject.get_unconfirmed_transaction_hashes()),
+                         sorted([transactions[1].tx_hash, transactions[2].tx_hash]))
+        self.assertEqual(self.subject.get_unconfirmed_transaction(transactions[2].tx_hash).source, "src2")
+        self.assertEqual(self.subject.get_verified_transactions(["tx1"]), set())
+
+
+class TestMempoolOrphanBlocks(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "pool.db")
+        with patch.object(Mempool, "POOL_DB", self.db_path):
+            self.subject = Mempool()
+        self.subject.ORPHAN_POOL_SIZE = 3
+        self.subject.ORPHAN_POOL_BYTES = 100000
+        self.subject.ORPHAN_POOL_TTL = 100
+        self.blocks = []
+        previous_hash = "1" * 64
+        for height in range(2, 7):
+            coinbase = Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value,
+                                   timestamp=1524041935 + height, signature="")
+            transaction = Transaction("src", "dest", 1, 0, prev_hash="prev{}".format(height),
+                                      timestamp=1524041935, signature="sig")
+            block = Block(height, [coinbase, transaction], previous_hash, timestamp=1524041935, nonce=height)
+            self.blocks.append(block)
+            previous_hash = block.block_header.hash
+
+    def tearDown(self):
+        self.subject.pool.close()
+        ConnectionPool._pools.pop(self.db_path, None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_pop_orphan_blocks_Returns_blocks_building_on_parent_once(self):
+        self.subject.add_orphan_block(self.blocks[1], "peer")
+
+        orphans = self.subject.pop_orphan_blocks(self.blocks[0].block_header.hash)
+
+        self.assertEqual(len(orphans), 1)
+        block, sender = orphans[0]
+        self.assertEqual(sender, "peer")
+        self.assertEqual(block.height, 3)
+        self.assertEqual(block.block_header.hash, self.blocks[1].block_header.hash)
+        self.assertEqual([t.tx_hash for t in block.transactions], [t.tx_hash for t in self.blocks[1].transactions])
+        self.assertEqual(self.subject.pop_orphan_blocks(self.blocks[0].block_header.hash), [])
+
+    def test_pop_orphan_blocks_When_stored_transaction_tampered_Recomputes_its_hash(self):
+        self.subject.add_orphan_block(self.blocks[1], "peer")
+        block_hash = self.blocks[1].block_header.hash
+        with self.subject.pool.writer() as conn:
+            block_dict = json.loads(conn.execute("SELECT block FROM orphan_blocks WHERE hash = ?",
+                                                 (block_hash,)).fetchone()[0])
+            block_dict['transactions'][1]['destination'] = "thief"
+            conn.execute("UPDATE orphan_blocks SET block = ? WHERE hash = ?", (json.dumps(block_dict), block_hash))
+
+        block, sender = self.subject.pop_orphan_blocks(self.blocks[0].block_header.hash)[0]
+
+        self.assertEqual(block.transactions[1].destination, "thief")
+        self.assertNotEqual(block.transactions[1].tx_hash, self.blocks[1].transactions[1].tx_hash)
+        self.assertNotEqual(block.block_header.hash, block_hash)
+
+    def test_has_orphan_block_Returns_true_only_for_unexpired_pooled_blocks(self):
+        with patch('time.time', return_value=1000):
+            self.subject.add_orphan_block(self.blocks[1], "peer")
+            self.assertTrue(self.subject.has_orphan_block(self.blocks[1].block_header.hash))
+            self.assertFalse(self.subject.has_orphan_block(self.blocks[2].block_header.hash))
+        with patch('time.time', return_value=1100):
+            self.assertFalse(self.subject.has_orphan_block(self.blocks[1].block_header.hash))
+
+    def test_get_orphan_chain_Follows_orphans_back_to_missing_parent(self):
+        for block in self.blocks[1:4]:
+            self.subject.add_orphan_block(block, "peer")
+
+        self.assertEqual(self.subject.get_orphan_chain(self.blocks[3].block_header.hash),
+                         (3, self.blocks[0].block_header.hash))
+        self.assertEqual(self.subject.get_orphan_chain(self.blocks[0].block_header.hash), (0, None))
+
+    def test_add_orphan_block_When_full_Evicts_oldest(self):
+        for timestamp, block in enumerate(self.blocks[1:], 1000):
+            with patch('time.time', return_value=timestamp):
+                self.subject.add_orphan_block(block, "peer")
+        with patch('time.time', return_value=1004):
+            evicted = self.subject.pop_orphan_blocks(self.blocks[0].block_header.hash)
+            kept = self.subject.pop_orphan_blocks(self.blocks[2].block_header.hash)
+
+        self.assertEqual(evicted, [])
+        self.assertEqual(len(kept), 1)
+
+    def test_add_orphan_block_When_over_byte_cap_Evicts_oldest(self):
+        with patch('time.time', return_value=1000):
+            self.subject.add_orphan_block(self.blocks[1], "peer")
+        self.subject.ORPHAN_POOL_BYTES = 1500
+        with patch('time.time', return_value=1001):
+            self.assertTrue(self.subject.add_orphan_block(self.blocks[2], "peer"))
+
+        self.assertEqual(self.subject.get_orphan_chain(self.blocks[1].block_header.hash), (0, None))
+        self.assertEqual(self.subject.get_orphan_chain(self.blocks[2].block_header.hash),
+                         (1, self.blocks[1].block_header.hash))
+
+    def test_pop_orphan_blocks_When_expired_Returns_empty(self):
+        with patch('time.time', return_value=1000):
+            self.subject.add_orphan_block(self.blocks[1], "peer")
+        with patch('time.time', return_value=1100):
+            orphans = self.subject.pop_orphan_blocks(self.blocks[0].block_header.hash)
+
+        self.assertEqual(orphans, [])
+
+
+class TestMempoolMemory(TestCase):
+
+    def setUp(self):
+        self.subject = MempoolMemory()
+        self.transactions = [Transaction("src{}".format(i), "dest", 1, 0.1, prev_hash="prev{}".format(i),
+                                         timestamp=1524041935, signature="sig") for i in range(3)]
+        for transaction in self.transactions:
+            self.subject.push_unconfirmed_transaction(transaction)
+
+    def test_get_unconfirmed_transaction_hashes_Returns_hashes_in_pool(self):
+        self.assertEqual(sorted(self.subject.get_unconfirmed_transaction_hashes()),
+                         sorted(transaction.tx_hash for transaction in self.transactions))
+
+    def test_get_unconfirmed_transactions_by_hashes_Returns_known_transactions_by_hash(self):
+        tx_hashes = [self.transactions[0].tx_hash, "unknown", self.transactions[2].tx_hash]
+
+        found = self.subject.get_unconfirmed_transactions_by_hashes(tx_hashes)
+
+        self.assertEqual(found, {self.transactions[0].tx_hash: self.transactions[0],
+                                 self.transactions[2].tx_hash: self.transactions[2]})
@@ -0,0 +1,54 @@
+import json
+from bottle import Bottle, response, request, abort
+
+from crankycoin import config
+from crankycoin.miner import Miner
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
+from crankycoin.services.work import WorkManager
+
+mining_app = Bottle()
+GETWORK_WHITELIST = config['user']['getwork_whitelist']
+work_manager = None
+
+
+def get_work_manager():
+    # templates are held in memory by the serving process
+    global work_manager
+    if work_manager is None:
+        work_manager = WorkManager(Miner(Blockchain(), Mempool()))
+    return work_manager
+
+
+def valid_hasher():
+    host = request.environ.get('HTTP_X_FORWARDED_FOR') or request.environ.get('REMOTE_ADDR')
+    return host in GETWORK_WHITELIST
+
+
+def requires_hasher_whitelist(func):
+    def wrapper(*a, **ka):
+        if not valid_hasher():
+            abort(401, {'code': 'unauthorized', 'description': 'host may not request work'})
+        return func(*a, **ka)
+    return wrapper
+
+
+@mining_app.route('/getwork/')
+@requires_hasher_whitelist
+def get_work():
+    return json.dumps(get_work_manager().get_work())
+
+
+@mining_app.route('/submitwork/', method='POST')
+@requires_hasher_whitelist
+def submit_work():
+    body = request.json or {}
+    work_id = body.get('work_id')
+    nonce = body.get('nonce')
+    if not isinstance(work_id, str) or not isinstance(nonce, int):
+        response.status = 400
+        return json.dumps({'accepted': False, 'reason': 'Bad request'})
+    result = get_work_manager().submit_work(work_id, nonce)
+    if not result['accepted']:
+        response.status = 406
+    return json.dumps(result)
@@ -1,12 +1,25 @@
 import json
 from bottle import Bottle, response, request, abort
 
+from crankycoin import config
+from crankycoin.models.block import CompactBlock
+from crankycoin.services.bloom_filter import RollingBloomFilter
 from crankycoin.services.queue import Queue
 from crankycoin.models.enums import MessageType
 from crankycoin.repository.peers import Peers
 from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
 
 permissioned_app = Bottle()
+MAX_TRANSACTIONS_BATCH = config['network']['max_transactions_batch']
+MAX_BLOCKS_BATCH = config['network']['max_blocks_batch']
+MAX_HEADERS_BATCH = config['network']['max_headers_batch']
+MAX_LOCATOR_HASHES = config['network']['max_locator_hashes']
+INVENTORY_TYPES = (MessageType.BLOCK_INV.value, MessageType.UNCONFIRMED_TRANSACTION_INV.value)
+# hashes this node processed recently.  Created before the node forks, so the inbox checks the hashes the
+# workers add
+seen_inventory = RollingBloomFilter(config['user']['seen_inventory_capacity'], config['user']['seen_inventory_ttl'],
+                                    config['user']['seen_inventory_fp_rate'])
 
 
 def valid_ip():
@@ -24,22 +37,71 @@ def requires_whitelist(func):
     return wrapper
 
 
+def filter_seen_inventory(msgs):
+    """
+    Strips hashes this node already processed from inventory messages and drops inventory messages left empty, so
+    duplicate announcements never reach the queue or the workers' database lookups.  Hashes are only marked seen
+    once a worker has them, so a peer that announces a hash and fails to serve it does not hide it from others
+
+    :param msgs: inbox messages
+    :type msgs: list of dict
+    :return: messages still worth queueing
+    :rtype: list of dict
+    """
+    fresh_msgs = []
+    for msg in msgs:
+        if msg['type'] in INVENTORY_TYPES and isinstance(msg['data'], list):
+            msg['data'] = [inv for inv in msg['data'] if not seen_inventory.check(str(inv))]
+            if not msg['data']:
+                continue
+        fresh_msgs.append(msg)
+    return fresh_msgs
+
+
 @permissioned_app.route('/inbox/', method='POST')
 @requires_whitelist
 def post_to_inbox():
     body = request.json
     # TODO: validate sender really is who they say they are using signature
     host = request.environ.get('HTTP_X_FORWARDED_FOR') or request.environ.get('REMOTE_ADDR')
+    if isinstance(body, list):
+        # a batch of messages is queued as a single multipart message
+        try:
+            msgs = [{'host': host, 'type': MessageType(message.get('type')).value, 'data': message.get('data')}
+                    for message in body]
+        except ValueError:
+            response.status = 400
+            return json.dumps({'success': False})
+        if not Queue.enqueue_batch(filter_seen_inventory(msgs)):
+            response.status = 503
+            return json.dumps({'success': False})
+        response.status = 200
+        return json.dumps({'success': True})
     msg_type = body.get('type')
     if MessageType(msg_type) in MessageType:
-        msg = {'host': host, 'type': msg_type, 'data': body.get('data')}
-        Queue.enqueue(msg)
+        msgs = filter_seen_inventory([{'host': host, 'type': msg_type, 'data': body.get('data')}])
+        if msgs and not Queue.enqueue(msgs[0]):
+            # the message's queue lane is full
+            response.status = 503
+            return json.dumps({'success': False})
         response.status = 200
         return json.dumps({'success': True})
     response.status = 400
     return json.dumps({'success': False})
 
 
+@permissioned_app.route('/inbox/stats/')
+def get_inbox_stats():
+    # read-only counters of the seen-inventory filter.  Not whitelisted so operators can check the drop rate
+    return json.dumps(seen_inventory.stats())
+
+
+@permissioned_app.route('/peers/stats/')
+def get_peer_stats():
+    # read-only connection and latency statistics published by each node process.  Not whitelisted, like /inbox/stats/
+    return json.dumps(Peers().get_peer_stats())
+
+
 @permissioned_app.route('/blocks/start/<start_block_height:int>/end/<end_block_height:int>')
 @requires_whitelist
 def get_blocks_inv(start_block_height, end_block_height):
@@ -55,6 +117,41 @@ def get_blocks_inv(start_block_height, end_block_height):
     return json.dumps({'success': False, 'reason': 'Blocks not found'})
 
 
+@permissioned_app.route('/blocks/locator/', method='POST')
+@requires_whitelist
+def get_fork_point():
+    # the tallest block of a peer's block locator that is on our main branch
+    body = request.json
+    locator = body.get('locator') if isinstance(body, dict) else None
+    if not isinstance(locator, list) or len(locator) < 1 or len(locator) > MAX_LOCATOR_HASHES:
+        response.status = 400
+        return json.dumps({'success': False, 'reason': 'Bad request'})
+    fork_point = Blockchain().find_fork_point(locator)
+    if fork_point is None:
+        response.status = 404
+        return json.dumps({'success': False, 'reason': 'Blocks not found'})
+    block_hash, height = fork_point
+    return json.dumps({'hash': block_hash, 'height': height})
+
+
+@permissioned_app.route('/headers/start/<start_block_height:int>/end/<end_block_height:int>')
+@requires_whitelist
+def get_block_headers(start_block_height, end_block_height):
+    # up to MAX_HEADERS_BATCH consecutive block headers of the main branch, both ends included.  Used for headers-first
+    # sync
+    blockchain = Blockchain()
+    blocks_range = end_block_height - start_block_height + 1
+    if blocks_range < 1 or blocks_range > MAX_HEADERS_BATCH:
+        response.status = 400
+        return json.dumps({'success': False, 'reason': 'Bad request'})
+    headers = [block_header.to_dict() for block_header, branch, height in
+               blockchain.get_block_headers_range_iter(start_block_height, end_block_height)]
+    if headers:
+        return json.dumps({'headers': headers})
+    response.status = 404
+    return json.dumps({'success': False, 'reason': 'Blocks not found'})
+
+
 @permissioned_app.route('/transactions/block_hash/<block_hash>')
 @requires_whitelist
 def get_transactions_index(block_hash):
@@ -66,26 +163,120 @@ def get_transactions_index(block_hash):
     return json.dumps({'success': False, 'reason': 'Transactions Not Found'})
 
 
+@permissioned_app.route('/transactions/batch/', method='POST')
+@requires_whitelist
+def get_transactions_batch():
+    # confirmed and unconfirmed transactions for a list of hashes, in request order.  Unknown hashes are left out
+    body = request.json
+    tx_hashes = body.get('tx_hashes') if isinstance(body, dict) else None
+    if not isinstance(tx_hashes, list) or len(tx_hashes) < 1 or len(tx_hashes) > MAX_TRANSACTIONS_BATCH:
+        response.status = 400
+        return json.dumps({'success': False, 'reason': 'Bad request'})
+    transactions = Blockchain().get_transactions_by_hashes(tx_hashes)
+    unconfirmed_hashes = [tx_hash for tx_hash in tx_hashes if tx_hash not in transactions]
+    if unconfirmed_hashes:
+        transactions.update(Mempool().get_unconfirmed_transactions_by_hashes(unconfirmed_hashes))
+    return json.dumps({'transactions': [transactions[tx_hash].to_dict() for tx_hash in tx_hashes
+                                        if tx_hash in transactions]})
+
+
 @permissioned_app.route('/blocks/hash/<block_hash>')
 @requires_whitelist
 def get_block_header_by_hash(block_hash):
     blockchain = Blockchain()
-    block_header = blockchain.get_block_header_by_hash(block_hash)
-    if block_header is None:
+    block = blockchain.get_block_header_by_hash(block_hash)
+    if block is None:
         response.status = 404
         return json.dumps({'success': False, 'reason': 'Block Not Found'})
+    block_header, branch, height = block
     return json.dumps(block_header.to_dict())
 
 
+@permissioned_app.route('/blocks/hash/<block_hash>/transactions/', method='POST')
+@requires_whitelist
+def get_block_transactions(block_hash):
+    # transactions of a block by index in block order, the coinbase being 0.  Completes compact blocks
+    body = request.json
+    indexes = body.get('indexes') if isinstance(body, dict) else None
+    if not isinstance(indexes, list) or len(indexes) < 1 or len(indexes) > MAX_TRANSACTIONS_BATCH:
+        response.status = 400
+        return json.dumps({'success': False, 'reason': 'Bad request'})
+    transactions = CompactBlock.block_order(Blockchain().get_transactions_by_block_hash(block_hash))
+    if not transactions:
+        response.status = 404
+        return json.dumps({'success': False, 'reason': 'Block Not Found'})
+    if not all(isinstance(index, int) and 0 <= index < len(transactions) for index in indexes):
+        response.status = 400
+        return json.dumps({'success': False, 'reason': 'Bad request'})
+    return json.dumps({'transactions': [transactions[index].to_dict() for index in indexes]})
+
+
+def full_block_dict(blockchain, block_header, height):
+    transactions = CompactBlock.block_order(blockchain.get_transactions_by_block_hash(block_header.hash))
+    return {
+        'height': height,
+        'block_header': block_header.to_dict(),
+        'transactions': [transaction.to_dict() for transaction in transactions]
+    }
+
+
+def stream_full_blocks(blockchain, blocks):
+    """
+    Serializes blocks one at a time so a range response is streamed rather than built in memory
+
+    :param blockchain: blockchain repository
+    :type blockchain: Blockchain
+    :param blocks: (BlockHeader, branch, height) tuples
+    :type blocks: list of tuple
+    :return: chunks of the JSON response
+    :rtype: generator of str
+    """
+    yield '{"blocks": ['
+    for index, (block_header, branch, height) in enumerate(blocks):
+        yield (', ' if index else '') + json.dumps(full_block_dict(blockchain, block_header, height))
+    yield ']}'
+
+
+@permissioned_app.route('/blocks/hash/<block_hash>/full/')
+@requires_whitelist
+def get_full_block(block_hash):
+    # header and transactions of a block in one response, the transactions in block order
+    blockchain = Blockchain()
+    block = blockchain.get_block_header_by_hash(block_hash)
+    if block is None:
+        response.status = 404
+        return json.dumps({'success': False, 'reason': 'Block Not Found'})
+    block_header, branch, height = block
+    return json.dumps(full_block_dict(blockchain, block_header, height))
+
+
+@permissioned_app.route('/blocks/full/start/<start_block_height:int>/end/<end_block_height:int>')
+@requires_whitelist
+def get_full_blocks(start_block_height, end_block_height):
+    # up to MAX_BLOCKS_BATCH consecutive blocks of the main branch, both ends included.  Used for catch-up sync
+    blockchain = Blockchain()
+    blocks_range = end_block_height - start_block_height + 1
+    if blocks_range < 1 or blocks_range > MAX_BLOCKS_BATCH:
+        response.status = 400
+        return json.dumps({'success': False, 'reason': 'Bad request'})
+    blocks = list(blockchain.get_block_headers_range_iter(start_block_height, end_block_height))
+    if not blocks:
+        response.status = 404
+        return json.dumps({'success': False, 'reason': 'Blocks not found'})
+    return stream_full_blocks(blockchain, blocks)
+
+
 @permissioned_app.route('/blocks/height/<height:int>')
 @requires_whitelist
 def get_block_header_by_height(height):
     blockchain = Blockchain()
     if height == "latest":
-        block_header = blockchain.get_tallest_block_header()
+        block = blockchain.get_tallest_block_header()
     else:
-        block_header = blockchain.get_block_headers_by_height(height)
-    if block_header is None:
+        blocks = blockchain.get_block_headers_by_height(height)
+        block = blocks[0] if blocks else None
+    if block is None:
         response.status = 404
         return json.dumps({'success': False, 'reason': 'Block Not Found'})
+    block_header, branch, height = block
     return json.dumps(block_header.to_dict())
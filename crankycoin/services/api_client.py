@@ -1,10 +1,14 @@
 import json
+import os
 import requests
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from crankycoin import config, logger
 from crankycoin.models.enums import MessageType
 from crankycoin.models.transaction import Transaction
-from crankycoin.models.block import BlockHeader
+from crankycoin.models.block import Block, BlockHeader
+from crankycoin.services.peer_connections import CircuitOpenError, PeerConnections
 
 
 class ApiClient(object):
@@ -14,8 +18,17 @@ class ApiClient(object):
     INBOX_URL = config['network']['inbox_url']
     TRANSACTIONS_URL = config['network']['transactions_url']
     TRANSACTIONS_INV_URL = config['network']['transactions_inv_url']
+    TRANSACTIONS_BATCH_URL = config['network']['transactions_batch_url']
+    MAX_TRANSACTIONS_BATCH = config['network']['max_transactions_batch']
     BLOCKS_INV_URL = config['network']['blocks_inv_url']
     BLOCKS_URL = config['network']['blocks_url']
+    BLOCK_TRANSACTIONS_URL = config['network']['block_transactions_url']
+    FULL_BLOCK_URL = config['network']['full_block_url']
+    FULL_BLOCKS_URL = config['network']['full_blocks_url']
+    MAX_BLOCKS_BATCH = config['network']['max_blocks_batch']
+    HEADERS_URL = config['network']['headers_url']
+    MAX_HEADERS_BATCH = config['network']['max_headers_batch']
+    BLOCK_LOCATOR_URL = config['network']['block_locator_url']
     HEIGHT_URL = config['network']['height_url']
     TRANSACTION_HISTORY_URL = config['network']['transaction_history_url']
     BALANCE_URL = config['network']['balance_url']
@@ -24,19 +37,136 @@ class ApiClient(object):
     CONNECT_URL = config['network']['connect_url']
     MIN_PEERS = config['user']['min_peers']
     MAX_PEERS = config['user']['max_peers']
+    # cap on concurrent broadcast requests and the per-request timeout in seconds
+    BROADCAST_WORKERS = config['user']['broadcast_workers']
+    BROADCAST_TIMEOUT = config['user']['broadcast_timeout']
+    CONNECT_TIMEOUT = config['user']['http_connect_timeout']
+    READ_TIMEOUT = config['user']['http_read_timeout']
+    PEER_STATS_INTERVAL = config['user']['peer_stats_interval']
+    # the broadcast thread pool is created on first use and reused for the life of the process
+    _executor = None
+    _executor_pid = None
+    _stats_published = 0
 
     def __init__(self, peers):
         self.peers = peers
 
+    @classmethod
+    def _get_executor(cls):
+        if cls._executor is None or cls._executor_pid != os.getpid():
+            # threads do not survive a fork.  Each process starts its own pool
+            cls._executor = ThreadPoolExecutor(max_workers=cls.BROADCAST_WORKERS)
+            cls._executor_pid = os.getpid()
+        return cls._executor
+
+    def _post_to_inbox(self, node, data):
+        url = self.INBOX_URL.format(node, self.FULL_NODE_PORT)
+        try:
+            response = self._post(node, url, json=data, timeout=(self.CONNECT_TIMEOUT, self.BROADCAST_TIMEOUT))
+            return response.status_code == 200
+        except CircuitOpenError:
+            pass
+        except requests.exceptions.RequestException as re:
+            logger.warn("Request Exception with host: {}".format(node))
+            self.peers.record_downtime(node)
+        return False
+
+    def broadcast(self, data):
+        """
+        Posts a message to the inbox of every peer concurrently.  At most BROADCAST_WORKERS requests are in flight
+        and each times out after BROADCAST_TIMEOUT seconds, so a slow peer holds up neither the other peers nor the
+        caller for longer than the timeout.
+
+        :param data: inbox message
+        :type data: dict
+        :return: peers that accepted the message
+        :rtype: list of str
+        """
+        nodes = self.peers.get_all_peers()
+        if not nodes:
+            return []
+        executor = self._get_executor()
+        futures = [(node, executor.submit(self._post_to_inbox, node, data)) for node in nodes]
+        # requests' timeout applies to each socket operation.  The deadline also bounds peers that trickle responses
+        rounds = -(-len(nodes) // self.BROADCAST_WORKERS)
+        wait([future for _, future in futures], timeout=(self.CONNECT_TIMEOUT + 2 * self.BROADCAST_TIMEOUT) * rounds)
+        accepted = []
+        for node, future in futures:
+            if not future.done():
+                logger.warn("Broadcast to host {} timed out".format(node))
+            elif future.result():
+                accepted.append(node)
+        return accepted
+
+    def _request(self, method, node, url, **kwargs):
+        """
+        Sends a request over the keep-alive session of the peer.  Requests time out after CONNECT_TIMEOUT seconds
+        connecting and READ_TIMEOUT seconds waiting for data unless a timeout is given.  GET requests that fail to
+        connect or time out are retried while the peer's retry budget lasts.  Peers whose circuit is open fail fast
+        with CircuitOpenError.  A peer that recovers has its downtime reset.
+
+        :param method: "get" or "post"
+        :type method: str
+        :param node: peer host
+        :type node: str
+        :param url: request url
+        :type url: str
+        :return: response
+        :rtype: requests.Response
+        :raises requests.exceptions.RequestException: if the peer could not be reached
+        """
+        connection = PeerConnections.get(node)
+        if not connection.allow_request():
+            raise CircuitOpenError("circuit open for host {}".format(node))
+        kwargs.setdefault('timeout', (self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+        try:
+            while True:
+                start = time.time()
+                try:
+                    response = connection.session.request(method, url, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    if method == "get" and connection.take_retry():
+                        continue
+                    if connection.record_failure():
+                        logger.warn("Circuit opened for host {}".format(node))
+                    raise
+                except requests.exceptions.RequestException:
+                    connection.record_failure()
+                    raise
+                if connection.record_success(time.time() - start):
+                    self.peers.reset_downtime(node)
+                return response
+        finally:
+            self._publish_stats()
+
+    def _get(self, node, url, **kwargs):
+        return self._request("get", node, url, **kwargs)
+
+    def _post(self, node, url, **kwargs):
+        return self._request("post", node, url, **kwargs)
+
+    def _publish_stats(self):
+        # at most every PEER_STATS_INTERVAL seconds, so that every process's statistics can be read from the peer db
+        now = time.time()
+        if now - ApiClient._stats_published < self.PEER_STATS_INTERVAL:
+            return
+        ApiClient._stats_published = now
+        try:
+            self.peers.update_peer_stats(os.getpid(), PeerConnections.stats(), now - 3 * self.PEER_STATS_INTERVAL)
+        except Exception as e:
+            logger.warn("could not publish peer statistics: %s", e)
+
     # Common
 
     def request_nodes(self, node, port):
         url = self.NODES_URL.format(node, port)
         try:
-            response = requests.get(url)
+            response = self._get(node, url)
             if response.status_code == 200:
                 all_nodes = response.json()
                 return all_nodes
+        except CircuitOpenError:
+            pass
         except requests.exceptions.RequestException as re:
             self.peers.record_downtime(node)
             logger.debug('Downtime recorded for host {}'.format(node))
@@ -45,7 +175,7 @@ class ApiClient(object):
     def ping_status(self, host):
         url = self.STATUS_URL.format(host, self.FULL_NODE_PORT)
         try:
-            response = requests.get(url)
+            response = self._get(host, url)
             if response.status_code == 200:
                 status_dict = response.json()
                 return status_dict == config['network']
@@ -56,7 +186,7 @@ class ApiClient(object):
     def request_height(self, node):
         url = self.HEIGHT_URL.format(node, self.FULL_NODE_PORT)
         try:
-            response = requests.get(url)
+            response = self._get(node, url)
             if response.status_code == 200:
                 height_dict = response.json()
                 return height_dict.get('height')
@@ -73,8 +203,10 @@ class ApiClient(object):
         for node in self.peers.get_all_peers():
             url = self.TRANSACTIONS_URL.format(node, self.FULL_NODE_PORT, "")
             try:
-                response = requests.post(url, json=data)
+                response = self._post(node, url, json=data)
                 return response
+            except CircuitOpenError:
+                pass
             except requests.exceptions.RequestException as re:
                 self.peers.record_downtime(node)
         return None
@@ -89,7 +221,7 @@ class ApiClient(object):
 
                 status_url = self.STATUS_URL.format(peer, self.FULL_NODE_PORT)
                 try:
-                    response = requests.get(status_url)
+                    response = self._get(peer, status_url)
                     if response.status_code == 200 and response.json() == config['network']:
                         self.peers.add_peer(peer)
                 except requests.exceptions.RequestException as re:
@@ -112,7 +244,7 @@ class ApiClient(object):
                 status_url = self.STATUS_URL.format(peer, self.FULL_NODE_PORT)
                 connect_url = self.CONNECT_URL.format(peer, self.FULL_NODE_PORT)
                 try:
-                    response = requests.get(status_url)
+                    response = self._get(peer, status_url)
                     if response.status_code != 200:  # Downtime or error
                         if self.peers.get_peer(peer):
                             self.peers.record_downtime(peer)
@@ -124,9 +256,11 @@ class ApiClient(object):
                         logger.warn("Incompatible network with node %s", peer)
                         continue
                     if self.peers.get_peer(peer) is None:
-                        response = requests.post(connect_url, json=host_data)
+                        response = self._post(peer, connect_url, json=host_data)
                         if response.status_code == 202 and response.json().get("success") is True:
                             self.peers.add_peer(peer)
+                except CircuitOpenError:
+                    pass
                 except requests.exceptions.RequestException as re:
                     logger.warn("Request exception while attempting to reach %s", peer)
                     if self.peers.get_peer(peer):
@@ -138,7 +272,7 @@ class ApiClient(object):
     def get_balance(self, address=None, node=None):
         url = self.BALANCE_URL.format(node, self.FULL_NODE_PORT, address)
         try:
-            response = requests.get(url)
+            response = self._get(node, url)
             return response.json()
         except requests.exceptions.RequestException as re:
             pass
@@ -147,7 +281,7 @@ class ApiClient(object):
     def get_transaction_history(self, address=None, node=None):
         url = self.TRANSACTION_HISTORY_URL.format(node, self.FULL_NODE_PORT, address)
         try:
-            response = requests.get(url)
+            response = self._get(node, url)
             return response.json()
         except requests.exceptions.RequestException as re:
             pass
@@ -163,7 +297,7 @@ class ApiClient(object):
         else:
             url = self.BLOCKS_URL.format(node, port, "height", "latest")
         try:
-            response = requests.get(url)
+            response = self._get(node, url)
             if response.status_code == 200:
                 block_dict = response.json()
                 block_header = BlockHeader(
@@ -173,6 +307,8 @@ class ApiClient(object):
                     block_dict['nonce'],
                     block_dict['version'])
                 return block_header
+        except CircuitOpenError:
+            pass
         except requests.exceptions.RequestException as re:
             logger.warn("Request Exception with host: {}".format(node))
             self.peers.record_downtime(node)
@@ -181,27 +317,242 @@ class ApiClient(object):
     def request_transaction(self, node, port, tx_hash):
         url = self.TRANSACTIONS_URL.format(node, port, tx_hash)
         try:
-            response = requests.get(url)
+            response = self._get(node, url)
             if response.status_code == 200:
                 tx_dict = response.json()
-                transaction = Transaction(
-                    tx_dict['source'],
-                    tx_dict['destination'],
-                    tx_dict['amount'],
-                    tx_dict['fee'],
-                    tx_dict['prev_hash'],
-                    tx_dict['tx_type'],
-                    tx_dict['timestamp'],
-                    tx_dict['tx_hash'],
-                    tx_dict['asset'],
-                    tx_dict['data'],
-                    tx_dict['signature']
-                )
-                if transaction.tx_hash != tx_dict['tx_hash']:
+                # the hash is recomputed from the contents
+                transaction = Transaction.from_dict(tx_dict)
+                if transaction.tx_hash != tx_hash:
                     logger.warn("Invalid transaction hash: {} should be {}.  Transaction ignored."
-                                .format(tx_dict['tx_hash'], transaction.tx_hash))
+                                .format(tx_hash, transaction.tx_hash))
                     return None
                 return transaction
+        except CircuitOpenError:
+            pass
+        except requests.exceptions.RequestException as re:
+            logger.warn("Request Exception with host: {}".format(node))
+            self.peers.record_downtime(node)
+        return None
+
+    def request_transactions(self, node, port, tx_hashes):
+        """
+        Batched request_transaction.  The hashes are requested in chunks of MAX_TRANSACTIONS_BATCH, one round trip
+        per chunk
+
+        :param node: peer host
+        :type node: str
+        :param port: peer port
+        :type port: int
+        :param tx_hashes: transaction hashes
+        :type tx_hashes: list
+        :return: the transactions the peer knows, in request order, or None if the peer could not be reached
+        :rtype: list of Transaction
+        """
+        url = self.TRANSACTIONS_BATCH_URL.format(node, port)
+        requested = set(tx_hashes)
+        transactions = {}
+        try:
+            for i in range(0, len(tx_hashes), self.MAX_TRANSACTIONS_BATCH):
+                response = self._post(node, url, json={'tx_hashes': tx_hashes[i:i + self.MAX_TRANSACTIONS_BATCH]})
+                if response.status_code != 200:
+                    return None
+                for tx_dict in response.json()['transactions']:
+                    # the hash is recomputed from the contents, never taken from the peer.  Contents altered under
+                    # a requested hash hash to something that was not requested
+                    transaction = Transaction.from_dict(tx_dict)
+                    if transaction.tx_hash not in requested:
+                        logger.warn("Unrequested transaction {} from host {}.  Transaction ignored."
+                                    .format(transaction.tx_hash, node))
+                        continue
+                    transactions[transaction.tx_hash] = transaction
+        except CircuitOpenError:
+            return None
+        except requests.exceptions.RequestException as re:
+            logger.warn("Request Exception with host: {}".format(node))
+            self.peers.record_downtime(node)
+            return None
+        return [transactions[tx_hash] for tx_hash in tx_hashes if tx_hash in transactions]
+
+    def request_block_transactions(self, node, port, block_hash, indexes):
+        """
+        Requests the transactions of a block that a compact block could not be completed with, in one round trip
+
+        :param node: peer host
+        :type node: str
+        :param port: peer port
+        :type port: int
+        :param block_hash: block hash
+        :type block_hash: str
+        :param indexes: indexes of the transactions in block order, the coinbase being 0
+        :type indexes: list of int
+        :return: the transactions in the order of indexes, or None if the peer could not provide them
+        :rtype: list of Transaction
+        """
+        url = self.BLOCK_TRANSACTIONS_URL.format(node, port, block_hash)
+        try:
+            response = self._post(node, url, json={'indexes': indexes})
+            if response.status_code == 200:
+                # hashes are recomputed from the contents for the merkle root check
+                return [Transaction.from_dict(tx_dict) for tx_dict in response.json()['transactions']]
+        except CircuitOpenError:
+            pass
+        except requests.exceptions.RequestException as re:
+            logger.warn("Request Exception with host: {}".format(node))
+            self.peers.record_downtime(node)
+        return None
+
+    @staticmethod
+    def _full_block_from_dict(block_dict):
+        """
+        Rebuilds a block from the full block endpoints.  The block header is recomputed from the transactions
+
+        :param block_dict: height, block header and transactions in block order
+        :type block_dict: dict
+        :return: the block, or None if the transactions do not hash to the announced header
+        :rtype: Block
+        """
+        block_header = BlockHeader.from_dict(block_dict['block_header'])
+        # transaction hashes are recomputed, so altered contents change the merkle root
+        block = Block(
+            block_dict['height'],
+            [Transaction.from_dict(tx_dict) for tx_dict in block_dict['transactions']],
+            block_header.previous_hash,
+            timestamp=block_header.timestamp,
+            nonce=block_header.nonce)
+        # equal header fields hash alike, without paying for a second scrypt hash
+        if block.block_header != block_header:
+            logger.warn("Block at height {} does not match its transactions.  Block ignored."
+                        .format(block_dict['height']))
+            return None
+        return block
+
+    def request_block(self, node, port, block_hash):
+        """
+        Requests a block with all of its transactions in one round trip
+
+        :param node: peer host
+        :type node: str
+        :param port: peer port
+        :type port: int
+        :param block_hash: block hash
+        :type block_hash: str
+        :return: the block, or None if the peer could not provide it
+        :rtype: Block
+        """
+        url = self.FULL_BLOCK_URL.format(node, port, block_hash)
+        try:
+            response = self._get(node, url)
+            if response.status_code == 200:
+                return self._full_block_from_dict(response.json())
+        except CircuitOpenError:
+            pass
+        except requests.exceptions.RequestException as re:
+            logger.warn("Request Exception with host: {}".format(node))
+            self.peers.record_downtime(node)
+        return None
+
+    def request_blocks(self, node, port, start_height, end_height):
+        """
+        Requests consecutive blocks of the peer's main branch with all of their transactions, both ends included.
+        The range is requested in chunks of MAX_BLOCKS_BATCH, one round trip per chunk, and stops early at the
+        peer's tallest block
+
+        :param node: peer host
+        :type node: str
+        :param port: peer port
+        :type port: int
+        :param start_height: height of the first block
+        :type start_height: int
+        :param end_height: height of the last block
+        :type end_height: int
+        :return: the blocks in height order, or None if the peer could not be reached or sent an invalid block
+        :rtype: list of Block
+        """
+        blocks = []
+        try:
+            for chunk_start in range(start_height, end_height + 1, self.MAX_BLOCKS_BATCH):
+                chunk_end = min(chunk_start + self.MAX_BLOCKS_BATCH - 1, end_height)
+                response = self._get(node, self.FULL_BLOCKS_URL.format(node, port, chunk_start, chunk_end))
+                if response.status_code == 404:
+                    break
+                if response.status_code != 200:
+                    return None
+                for block_dict in response.json()['blocks']:
+                    block = self._full_block_from_dict(block_dict)
+                    if block is None:
+                        return None
+                    blocks.append(block)
+                if blocks and blocks[-1].height < chunk_end:
+                    break
+        except CircuitOpenError:
+            return None
+        except requests.exceptions.RequestException as re:
+            logger.warn("Request Exception with host: {}".format(node))
+            self.peers.record_downtime(node)
+            return None
+        return blocks
+
+    def request_headers(self, node, port, start_height, end_height):
+        """
+        Requests consecutive block headers of the peer's main branch, both ends included.  The range is requested in
+        chunks of MAX_HEADERS_BATCH, one round trip per chunk, and stops early at the peer's tallest block
+
+        :param node: peer host
+        :type node: str
+        :param port: peer port
+        :type port: int
+        :param start_height: height of the first header
+        :type start_height: int
+        :param end_height: height of the last header
+        :type end_height: int
+        :return: the headers in height order, or None if the peer could not be reached
+        :rtype: list of BlockHeader
+        """
+        headers = []
+        try:
+            for chunk_start in range(start_height, end_height + 1, self.MAX_HEADERS_BATCH):
+                chunk_end = min(chunk_start + self.MAX_HEADERS_BATCH - 1, end_height)
+                response = self._get(node, self.HEADERS_URL.format(node, port, chunk_start, chunk_end))
+                if response.status_code == 404:
+                    break
+                if response.status_code != 200:
+                    return None
+                chunk = [BlockHeader.from_dict(header_dict) for header_dict in response.json()['headers']]
+                headers.extend(chunk)
+                if len(chunk) < chunk_end - chunk_start + 1:
+                    break
+        except CircuitOpenError:
+            return None
+        except requests.exceptions.RequestException as re:
+            logger.warn("Request Exception with host: {}".format(node))
+            self.peers.record_downtime(node)
+            return None
+        return headers
+
+    def request_fork_point(self, node, port, locator):
+        """
+        Sends our block locator to find the last block we share with the peer in a single round trip
+
+        :param node: peer host
+        :type node: str
+        :param port: peer port
+        :type port: int
+        :param locator: block hashes from our tip down to the genesis block
+        :type locator: list of str
+        :return: hash and height of the last common block, or None if there is none or the peer could not be reached
+        :rtype: tuple(str, int)
+        """
+        url = self.BLOCK_LOCATOR_URL.format(node, port)
+        try:
+            response = self._post(node, url, json={'locator': locator})
+            if response.status_code == 200:
+                fork_point = response.json()
+                if fork_point['hash'] in locator:
+                    return fork_point['hash'], fork_point['height']
+                logger.warn("Fork point {} from host {} is not in our locator.  Ignored."
+                            .format(fork_point['hash'], node))
+        except CircuitOpenError:
+            pass
         except requests.exceptions.RequestException as re:
             logger.warn("Request Exception with host: {}".format(node))
             self.peers.record_downtime(node)
@@ -212,10 +563,12 @@ class ApiClient(object):
         # block header
         url = self.TRANSACTIONS_INV_URL.format(node, port, block_hash)
         try:
-            response = requests.get(url)
+            response = self._get(node, url)
             if response.status_code == 200:
                 tx_dict = response.json()
                 return tx_dict['tx_hashes']
+        except CircuitOpenError:
+            pass
         except requests.exceptions.RequestException as re:
             logger.warn("Request Exception with host: {}".format(node))
             self.peers.record_downtime(node)
@@ -225,10 +578,12 @@ class ApiClient(object):
         # Used when a synchronization between peers is needed
         url = self.BLOCKS_INV_URL.format(node, port, start_height, stop_height)
         try:
-            response = requests.get(url)
+            response = self._get(node, url)
             if response.status_code == 200:
                 block_dict = response.json()
                 return block_dict['block_hashes']
+        except CircuitOpenError:
+            pass
         except requests.exceptions.RequestException as re:
             logger.warn("Request Exception with host: {}".format(node))
             self.peers.record_downtime(node)
@@ -242,14 +597,7 @@ class ApiClient(object):
             "data": block_hashes
         }
         logger.debug("broadcasting block inv: {}".format(data))
-        for node in self.peers.get_all_peers():
-            url = self.INBOX_URL.format(node, self.FULL_NODE_PORT)
-            try:
-                response = requests.post(url, json=data)
-            except requests.exceptions.RequestException as re:
-                logger.warn("Request Exception with host: {}".format(node))
-                self.peers.record_downtime(node)
-        return
+        return self.broadcast(data)
 
     def broadcast_unconfirmed_transaction_inv(self, tx_hashes, host):
         # Used for (re)broadcasting a new transaction that was received and added
@@ -259,14 +607,7 @@ class ApiClient(object):
             "data": tx_hashes
         }
         logger.debug("broadcasting transaction inv: {}".format(data))
-        for node in self.peers.get_all_peers():
-            url = self.INBOX_URL.format(node, self.FULL_NODE_PORT)
-            try:
-                response = requests.post(url, json=data)
-            except requests.exceptions.RequestException as re:
-                logger.warn("Request Exception with host: {}".format(node))
-                self.peers.record_downtime(node)
-        return
+        return self.broadcast(data)
 
     def broadcast_block_header(self, block_header, host):
         # Used only when broadcasting a block header that originated (mined) locally
@@ -276,14 +617,17 @@ class ApiClient(object):
             "data": block_header.to_json()
         }
         logger.debug("broadcasting block header: {}".format(data))
-        for node in self.peers.get_all_peers():
-            url = self.INBOX_URL.format(node, self.FULL_NODE_PORT)
-            try:
-                response = requests.post(url, json=data)
-            except requests.exceptions.RequestException as re:
-                logger.warn("Request Exception with host: {}".format(node))
-                self.peers.record_downtime(node)
-        return
+        return self.broadcast(data)
+
+    def broadcast_compact_block(self, compact_block, host):
+        # Used for (re)broadcasting a block that was mined locally or received and added
+        data = {
+            "host": host,
+            "type": MessageType.COMPACT_BLOCK.value,
+            "data": compact_block.to_dict()
+        }
+        logger.debug("broadcasting compact block: {}".format(compact_block))
+        return self.broadcast(data)
 
     def push_synchronize(self, node, blocks_inv, current_height, host):
         # Push local blocks_inv to remote node to initiate a sync
@@ -295,7 +639,9 @@ class ApiClient(object):
         logger.debug("sending sync request to peer at: {}".format(node))
         url = self.INBOX_URL.format(node, self.FULL_NODE_PORT)
         try:
-            response = requests.post(url, json=data)
+            response = self._post(node, url, json=data)
+        except CircuitOpenError:
+            pass
         except requests.exceptions.RequestException as re:
             logger.warn("Request Exception with host: {}".format(node))
             self.peers.record_downtime(node)
@@ -305,10 +651,12 @@ class ApiClient(object):
         # Audit node's blocks_inv and sync if necessary
         url = self.BLOCKS_INV_URL.format(node, self.FULL_NODE_PORT, start_height, end_height)
         try:
-            response = requests.get(url)
+            response = self._get(node, url)
             if response.status_code == 200:
                 tx_dict = response.json()
                 return tx_dict.get('blocks_inv')
+        except CircuitOpenError:
+            pass
         except requests.exceptions.RequestException as re:
             logger.warn("Request Exception with host: {}".format(node))
             self.peers.record_downtime(node)
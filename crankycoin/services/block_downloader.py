@@ -0,0 +1,129 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from crankycoin import config, logger
+
+
+class BlockDownloader(object):
+    """
+    Downloads the bodies of a validated header chain from several peers at once and hands the blocks back in
+    height order.
+
+    The chain is split into chunks of CHUNK_SIZE blocks which are requested in parallel by a pool of
+    REQUESTS_PER_PEER workers per peer, each chunk going to the least busy peer.  Chunks are only requested up to
+    DOWNLOAD_WINDOW blocks ahead of the next block to be handed back, which bounds the blocks held in memory while a
+    slow chunk holds up the window.  A chunk that a peer cannot provide, or that does not match the header chain, is
+    requested from the next peer in turn; a peer that sends blocks off the header chain is not asked again.
+    """
+
+    CHUNK_SIZE = config['user']['sync_chunk_size']
+    DOWNLOAD_WINDOW = config['user']['sync_download_window']
+    REQUESTS_PER_PEER = config['user']['sync_requests_per_peer']
+
+    def __init__(self, api_client, nodes, port, block_headers, start_height):
+        """
+        :param api_client: api client
+        :type api_client: ApiClient
+        :param nodes: peers to download from
+        :type nodes: list of str
+        :param port: peer port
+        :type port: int
+        :param block_headers: validated block headers in height order
+        :type block_headers: list of BlockHeader
+        :param start_height: height of the first header
+        :type start_height: int
+        """
+        self.api_client = api_client
+        self.nodes = list(nodes)
+        self.port = port
+        self.block_headers = block_headers
+        self.start_height = start_height
+        self.lock = threading.Lock()
+        self.in_flight = {node: 0 for node in self.nodes}
+        self.off_chain = set()
+
+    def _next_node(self, offset, tried):
+        # the least busy peer that has not been tried for this chunk.  Ties go round robin by chunk
+        with self.lock:
+            first = offset // self.CHUNK_SIZE
+            candidates = [self.nodes[(first + i) % len(self.nodes)] for i in range(len(self.nodes))]
+            candidates = [node for node in candidates if node not in tried and node not in self.off_chain]
+            if not candidates:
+                return None
+            node = min(candidates, key=lambda candidate: self.in_flight[candidate])
+            self.in_flight[node] += 1
+            return node
+
+    def _fetch_chunk(self, offset):
+        """
+        Runs in the download pool
+
+        :param offset: index of the chunk's first block within the header chain
+        :type offset: int
+        :return: the blocks of the chunk, or None if no peer could provide them
+        :rtype: list of Block
+        """
+        block_headers = self.block_headers[offset:offset + self.CHUNK_SIZE]
+        start_height = self.start_height + offset
+        tried = set()
+        while True:
+            node = self._next_node(offset, tried)
+            if node is None:
+                return None
+            tried.add(node)
+            try:
+                blocks = self.api_client.request_blocks(node, self.port, start_height,
+                                                        start_height + len(block_headers) - 1)
+            finally:
+                with self.lock:
+                    self.in_flight[node] -= 1
+            if blocks is None or len(blocks) < len(block_headers):
+                continue
+            if [block.block_header for block in blocks] != block_headers:
+                logger.warn("Peer at {} is not on the header chain.  Blocks ignored.".format(node))
+                with self.lock:
+                    self.off_chain.add(node)
+                continue
+            for block, block_header in zip(blocks, block_headers):
+                # carry over the hash memoized while validating the header chain
+                block.block_header = block_header
+            return blocks
+
+    def __iter__(self):
+        """
+        :return: the blocks of the header chain in height order.  Stops early if a chunk cannot be downloaded
+        :rtype: generator of Block
+        """
+        if not self.nodes:
+            return
+        workers = len(self.nodes) * self.REQUESTS_PER_PEER
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = {}
+        downloaded = {}
+        next_request = 0
+        next_block = 0
+        try:
+            while next_block < len(self.block_headers):
+                # slide the window forward
+                while next_request < len(self.block_headers) and \
+                        next_request - next_block < self.DOWNLOAD_WINDOW and \
+                        len(pending) < workers:
+                    pending[executor.submit(self._fetch_chunk, next_request)] = next_request
+                    next_request += self.CHUNK_SIZE
+                if next_block not in downloaded:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        downloaded[pending.pop(future)] = future.result()
+                    continue
+                blocks = downloaded.pop(next_block)
+                if blocks is None:
+                    logger.warn("Could not download blocks {} to {} from any peer".format(
+                        self.start_height + next_block, self.start_height + next_block + self.CHUNK_SIZE - 1))
+                    return
+                for block in blocks:
+                    yield block
+                next_block += self.CHUNK_SIZE
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
@@ -0,0 +1,148 @@
+import ctypes
+import hashlib
+import math
+import multiprocessing as mp
+import os
+import time
+
+
+class RollingBloomFilter(object):
+    """
+    Approximate set of recently seen keys with bounded memory.  Keys are inserted into the current of two
+    generations, and the older generation is discarded once the current one has taken capacity / 2 keys or is
+    ttl / 2 seconds old.  A key is therefore remembered for at least ttl / 2 seconds and capacity / 2 insertions.
+    False positives occur at roughly fp_rate; there are no false negatives within that window.
+
+    The generations live in shared memory, so processes forked after the filter is created add to and check the
+    same set.  Hit counters are kept per process.
+    """
+
+    def __init__(self, capacity, ttl, fp_rate):
+        """
+        :param capacity: keys remembered across both generations
+        :type capacity: int
+        :param ttl: seconds after which a key is forgotten
+        :type ttl: int
+        :param fp_rate: target false positive rate
+        :type fp_rate: float
+        """
+        self.generation_capacity = max(1, capacity // 2)
+        self.generation_ttl = ttl / 2.0
+        # each of the two generations gets half the error budget
+        generation_fp_rate = fp_rate / 2
+        self.bits = int(math.ceil(-self.generation_capacity * math.log(generation_fp_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, int(round(self.bits / float(self.generation_capacity) * math.log(2))))
+        # keyed hashing so that announcements cannot be crafted to collide
+        self.salt = os.urandom(16)
+        self.generations = (mp.RawArray('B', (self.bits + 7) // 8), mp.RawArray('B', (self.bits + 7) // 8))
+        # index of the current generation, keys it holds and when it was started
+        self._current_index = mp.RawValue('i', 0)
+        self._current_count = mp.RawValue('i', 0)
+        self._current_started = mp.RawValue('d', time.time())
+        self.lock = mp.Lock()
+        self.checked = 0
+        self.seen = 0
+
+    @property
+    def current(self):
+        return self.generations[self._current_index.value]
+
+    @property
+    def previous(self):
+        return self.generations[1 - self._current_index.value]
+
+    @property
+    def current_count(self):
+        return self._current_count.value
+
+    @property
+    def current_started(self):
+        return self._current_started.value
+
+    def _indexes(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16, key=self.salt).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hash_count)]
+
+    @staticmethod
+    def _contains(bits, indexes):
+        for index in indexes:
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def _rotate(self):
+        # called with the lock held.  The previous generation is cleared in place to become the current one
+        now = time.time()
+        if self.current_count >= self.generation_capacity or now - self.current_started >= self.generation_ttl:
+            ctypes.memset(self.previous, 0, len(self.previous))
+            self._current_index.value = 1 - self._current_index.value
+            self._current_count.value = 0
+            self._current_started.value = now
+
+    def _add(self, indexes):
+        # called with the lock held.  Returns True if the key was (probably) seen before
+        if self._contains(self.current, indexes):
+            return True
+        current = self.current
+        for index in indexes:
+            current[index >> 3] |= 1 << (index & 7)
+        self._current_count.value += 1
+        # a key of the previous generation is carried into the current one so it survives the next rotation
+        return self._contains(self.previous, indexes)
+
+    def check_and_add(self, key):
+        """
+        :param key: key such as a block or transaction hash
+        :type key: str
+        :return: True if the key was (probably) seen before
+        :rtype: bool
+        """
+        indexes = self._indexes(key)
+        with self.lock:
+            self._rotate()
+            seen = self._add(indexes)
+        self.checked += 1
+        if seen:
+            self.seen += 1
+        return seen
+
+    def check(self, key):
+        """
+        Like `key in filter`, and counted in the stats
+
+        :param key: key such as a block or transaction hash
+        :type key: str
+        :return: True if the key was (probably) seen before
+        :rtype: bool
+        """
+        seen = key in self
+        self.checked += 1
+        if seen:
+            self.seen += 1
+        return seen
+
+    def add(self, key):
+        """
+        :param key: key such as a block or transaction hash
+        :type key: str
+        """
+        indexes = self._indexes(key)
+        with self.lock:
+            self._rotate()
+            self._add(indexes)
+
+    def __contains__(self, key):
+        indexes = self._indexes(key)
+        with self.lock:
+            self._rotate()
+            return self._contains(self.current, indexes) or self._contains(self.previous, indexes)
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'seen': self.seen,
+            'seen_rate': float(self.seen) / self.checked if self.checked else 0.0,
+            'bytes': len(self.current) + len(self.previous)
+        }
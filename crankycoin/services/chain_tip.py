@@ -0,0 +1,74 @@
+import json
+import os
+import zmq
+
+from crankycoin import config, logger
+
+
+class ChainTip(object):
+    """
+    Broadcasts changes of the primary chain tip between local processes.  Publishers and subscribers connect to a
+    forwarding proxy so that any process may publish.
+    """
+
+    TIP_BIND_IN = config['user']['tip_bind_in']
+    TIP_BIND_OUT = config['user']['tip_bind_out']
+    TOPIC = b'tip'
+    _publisher = None
+    _publisher_pid = None
+
+    @classmethod
+    def start_proxy(cls):
+        try:
+            context = zmq.Context(1)
+            # Socket facing publishers
+            frontend = context.socket(zmq.XSUB)
+            frontend.bind(cls.TIP_BIND_IN)
+            # Socket facing subscribers
+            backend = context.socket(zmq.XPUB)
+            backend.bind(cls.TIP_BIND_OUT)
+
+            zmq.proxy(frontend, backend)
+
+        except Exception as e:
+            logger.error("could not start chain tip proxy: %s", e)
+            raise
+
+    @classmethod
+    def publish(cls, block_hash, height):
+        try:
+            if cls._publisher is None or cls._publisher_pid != os.getpid():
+                # one publisher per process.  Notifications are dropped rather than blocking when nobody listens
+                socket = zmq.Context.instance().socket(zmq.PUB)
+                socket.setsockopt(zmq.LINGER, 0)
+                socket.connect(cls.TIP_BIND_IN)
+                cls._publisher, cls._publisher_pid = socket, os.getpid()
+            cls._publisher.send_multipart([cls.TOPIC, json.dumps({'hash': block_hash, 'height': height})
+                                          .encode('utf-8')], zmq.NOBLOCK)
+        except zmq.ZMQError as e:
+            logger.warn("could not publish chain tip %s: %s", block_hash, e)
+
+    @classmethod
+    def subscribe(cls):
+        socket = zmq.Context.instance().socket(zmq.SUB)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.setsockopt(zmq.SUBSCRIBE, cls.TOPIC)
+        socket.connect(cls.TIP_BIND_OUT)
+        return socket
+
+    @classmethod
+    def poll(cls, socket):
+        """
+        Drains pending notifications without blocking
+
+        :param socket: socket returned by subscribe()
+        :return: latest announced tip as a dict with hash and height, or None if nothing arrived
+        :rtype: dict
+        """
+        tip = None
+        while True:
+            try:
+                topic, data = socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return tip
+            tip = json.loads(data.decode('utf-8'))
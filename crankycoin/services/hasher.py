@@ -0,0 +1,63 @@
+import requests
+import time
+
+from crankycoin.models.block import HeaderTemplate
+from crankycoin import config, logger
+
+
+class Hasher(object):
+    """
+    Stateless getwork client.  Everything it needs to hash arrives with each unit of work, so any number of
+    hashers may point at the same full node.
+    """
+
+    GETWORK_URL = config['network']['getwork_url']
+    SUBMITWORK_URL = config['network']['submitwork_url']
+    FULL_NODE_PORT = config['network']['full_node_port']
+    RETRY_INTERVAL = 5
+
+    def __init__(self, node, port=None):
+        self.node = node
+        self.port = self.FULL_NODE_PORT if port is None else port
+
+    def request_work(self):
+        url = self.GETWORK_URL.format(self.node, self.port)
+        try:
+            response = requests.get(url)
+            if response.status_code == 200:
+                return response.json()
+        except requests.exceptions.RequestException as re:
+            logger.warn("could not request work from {}: {}".format(self.node, re))
+        return None
+
+    def submit_work(self, work_id, nonce):
+        url = self.SUBMITWORK_URL.format(self.node, self.port)
+        try:
+            response = requests.post(url, json={'work_id': work_id, 'nonce': nonce})
+            return response.json()
+        except requests.exceptions.RequestException as re:
+            logger.warn("could not submit work to {}: {}".format(self.node, re))
+        return None
+
+    def search(self, work):
+        """
+        Hashes the nonce range of a unit of work
+
+        :param work: unit of work returned by getwork
+        :type work: dict
+        :return: winning nonce or None, number of nonces hashed
+        :rtype: tuple(int, int)
+        """
+        template = HeaderTemplate.from_prefix(work['header_prefix'])
+        return template.search(range(work['nonce_start'], work['nonce_end']), work['target_difficulty'])
+
+    def run(self):
+        while True:
+            work = self.request_work()
+            if work is None:
+                time.sleep(self.RETRY_INTERVAL)
+                continue
+            nonce, hashes = self.search(work)
+            if nonce is not None:
+                result = self.submit_work(work['work_id'], nonce)
+                logger.info("Submitted nonce {} at height {}: {}".format(nonce, work['height'], result))
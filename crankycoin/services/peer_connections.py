@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crankycoin import config
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    # raised instead of contacting a peer whose circuit is open.  Callers give up on the peer without recording
+    # downtime again, so that an outage is counted by the failures that opened the circuit rather than per call
+    pass
+
+
+class PeerConnection(object):
+    """
+    Keep-alive HTTP session of a single peer, with its circuit breaker, retry budget and latency samples.
+
+    The circuit opens after CIRCUIT_FAILURE_THRESHOLD consecutive failures and requests fail fast until
+    CIRCUIT_COOLDOWN seconds have passed.  A single probe is then let through, which closes the circuit if it
+    succeeds and re-opens it if it fails.  Retries spend from a budget of RETRY_BUDGET tokens that refills by
+    RETRY_RATIO per successful request, so retries stay a small fraction of the traffic to a struggling peer.
+    """
+
+    POOL_SIZE = config['user']['http_pool_size']
+    RETRY_BUDGET = config['user']['http_retry_budget']
+    RETRY_RATIO = config['user']['http_retry_ratio']
+    CIRCUIT_FAILURE_THRESHOLD = config['user']['circuit_failure_threshold']
+    CIRCUIT_COOLDOWN = config['user']['circuit_cooldown']
+    STATS_WINDOW = config['user']['peer_stats_window']
+
+    def __init__(self, host):
+        self.host = host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0
+        self.probing = False
+        self.retry_tokens = float(self.RETRY_BUDGET)
+        self.latencies = deque(maxlen=self.STATS_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def allow_request(self):
+        """
+        :return: False if the circuit is open and the request should fail fast
+        :rtype: bool
+        """
+        with self.lock:
+            if self.failures < self.CIRCUIT_FAILURE_THRESHOLD:
+                return True
+            if time.time() >= self.open_until and not self.probing:
+                self.probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def take_retry(self):
+        with self.lock:
+            if self.retry_tokens < 1 or self.failures >= self.CIRCUIT_FAILURE_THRESHOLD:
+                return False
+            self.retry_tokens -= 1
+            self.retries += 1
+            return True
+
+    def record_success(self, seconds):
+        """
+        :return: True if this success closed an open circuit
+        :rtype: bool
+        """
+        with self.lock:
+            recovered = self.failures >= self.CIRCUIT_FAILURE_THRESHOLD
+            self.failures = 0
+            self.probing = False
+            self.requests += 1
+            self.latencies.append(seconds)
+            self.retry_tokens = min(self.RETRY_BUDGET, self.retry_tokens + self.RETRY_RATIO)
+            return recovered
+
+    def record_failure(self):
+        """
+        :return: True if this failure opened the circuit
+        :rtype: bool
+        """
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            self.requests += 1
+            self.errors += 1
+            if self.failures >= self.CIRCUIT_FAILURE_THRESHOLD:
+                opened = time.time() >= self.open_until
+                self.open_until = time.time() + self.CIRCUIT_COOLDOWN
+                return opened
+            return False
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'circuit_open': self.failures >= self.CIRCUIT_FAILURE_THRESHOLD,
+                'latency_mean': sum(latencies) / len(latencies) if latencies else None,
+                'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+                'latency_p95': latencies[int(len(latencies) * 0.95)] if latencies else None
+            }
+
+
+class PeerConnections(object):
+    # per-process registry of peer connections.  Sessions inherited across a fork are discarded
+
+    _connections = {}
+    _pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, host):
+        """
+        :param host: peer host
+        :type host: str
+        :return: connection of the peer, created on first use
+        :rtype: PeerConnection
+        """
+        with cls._lock:
+            if cls._pid != os.getpid():
+                cls._connections, cls._pid = {}, os.getpid()
+            connection = cls._connections.get(host)
+            if connection is None:
+                connection = PeerConnection(host)
+                cls._connections[host] = connection
+        return connection
+
+    @classmethod
+    def stats(cls):
+        """
+        :return: statistics of every peer contacted by this process, keyed by host
+        :rtype: dict
+        """
+        with cls._lock:
+            connections = list(cls._connections.values()) if cls._pid == os.getpid() else []
+        return {connection.host: connection.stats() for connection in connections}
@@ -1,41 +1,181 @@
-import sys
+import json
+import os
+import threading
 import zmq
+from collections import deque, OrderedDict
 
 from crankycoin import config, logger
+from crankycoin.models.enums import MessageType
 
 
 class Queue(object):
-    QUEUE_BIND_IN = config['user']['queue_bind_in']
-    QUEUE_BIND_OUT = config['user']['queue_bind_out']
+    """
+    Node message queue.  Messages travel in priority lanes chosen by message type so that block propagation is not
+    held up behind transaction traffic.  Each lane has its own proxy and high-water mark, and consumers take from
+    the lanes in weighted round-robin order.
+    """
+
+    # lanes in priority order.  Each has a name, bind_in, bind_out, weight, hwm and its message types
+    LANES = OrderedDict((lane['name'], lane) for lane in config['user']['queue_lanes'])
     QUEUE_PROCESSING_WORKERS = config['user']['queue_processing_workers']
+    # milliseconds a producer that asks to wait gives a full lane to drain before its message is dropped
+    SEND_TIMEOUT = config['user']['queue_send_timeout']
+    # producer and consumer sockets are created on first use and reused for the life of the process
+    _producers = None
+    _producers_pid = None
+    _consumers = None
+    _consumers_pid = None
+    _poller = None
+    _pending = None
+    _credits = None
+    dropped = None
+
+    @classmethod
+    def get_lane(cls, msg_type):
+        """
+        :param msg_type: message type value
+        :type msg_type: int
+        :return: name of the lane carrying msg_type.  Unlisted types travel in the lowest priority lane
+        :rtype: str
+        """
+        msg_type = MessageType(msg_type).value
+        for name, lane in cls.LANES.items():
+            if msg_type in lane['types']:
+                return name
+        return next(reversed(cls.LANES))
 
     @classmethod
     def start_queue(cls):
         try:
             context = zmq.Context(1)
-            # Socket facing producers
-            frontend = context.socket(zmq.PULL)
-            frontend.bind(cls.QUEUE_BIND_IN)
-            # Socket facing consumers
-            backend = context.socket(zmq.PUSH)
-            backend.bind(cls.QUEUE_BIND_OUT)
+            threads = []
+            for lane in cls.LANES.values():
+                # Socket facing producers
+                frontend = context.socket(zmq.PULL)
+                frontend.setsockopt(zmq.RCVHWM, lane['hwm'])
+                frontend.bind(lane['bind_in'])
+                # Socket facing consumers
+                backend = context.socket(zmq.PUSH)
+                backend.setsockopt(zmq.SNDHWM, lane['hwm'])
+                backend.bind(lane['bind_out'])
 
-            zmq.proxy(frontend, backend)
+                thread = threading.Thread(target=zmq.proxy, args=(frontend, backend))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
 
         except Exception as e:
             logger.error("could not start queue: %s", e)
             raise
 
     @classmethod
-    def enqueue(cls, msg):
-        context = zmq.Context()
-        socket = context.socket(zmq.PUSH)
-        socket.connect(cls.QUEUE_BIND_IN)
-        socket.send_json(msg)
+    def _get_producers(cls):
+        if cls._producers is None or cls._producers_pid != os.getpid():
+            # a forked child must not share its parent's sockets
+            context = zmq.Context.instance()
+            producers = OrderedDict()
+            for name, lane in cls.LANES.items():
+                socket = context.socket(zmq.PUSH)
+                socket.setsockopt(zmq.SNDHWM, lane['hwm'])
+                socket.connect(lane['bind_in'])
+                producers[name] = socket
+            cls._producers, cls._producers_pid = producers, os.getpid()
+            cls.dropped = {name: 0 for name in cls.LANES}
+        return cls._producers
+
+    @classmethod
+    def _get_consumers(cls):
+        if cls._consumers is None or cls._consumers_pid != os.getpid():
+            context = zmq.Context.instance()
+            consumers = OrderedDict()
+            cls._poller = zmq.Poller()
+            for name, lane in cls.LANES.items():
+                socket = context.socket(zmq.PULL)
+                socket.setsockopt(zmq.RCVHWM, lane['hwm'])
+                socket.connect(lane['bind_out'])
+                consumers[name] = socket
+                cls._poller.register(socket, zmq.POLLIN)
+            cls._consumers, cls._consumers_pid = consumers, os.getpid()
+            cls._pending = {name: deque() for name in cls.LANES}
+            cls._credits = {name: lane['weight'] for name, lane in cls.LANES.items()}
+        return cls._consumers
+
+    @classmethod
+    def _send(cls, lane, frames, timeout=0):
+        socket = cls._get_producers()[lane]
+        try:
+            if timeout:
+                socket.poll(timeout, zmq.POLLOUT)
+            socket.send_multipart(frames, zmq.NOBLOCK)
+            return True
+        except zmq.Again:
+            # the lane is at its high-water mark.  Shed load rather than block the producer
+            cls.dropped[lane] += len(frames)
+            logger.warn("%s queue lane full, dropped %s message(s)", lane, len(frames))
+            return False
+
+    @classmethod
+    def enqueue(cls, msg, wait=False):
+        """
+        :param msg: message with host, type and data
+        :type msg: dict
+        :param wait: wait up to SEND_TIMEOUT for room in a full lane.  For the node's own messages, which must not be
+            shed like peer traffic
+        :type wait: bool
+        :return: False if the message was dropped because its lane is full
+        :rtype: bool
+        """
+        return cls._send(cls.get_lane(msg['type']), [json.dumps(msg).encode('utf-8')],
+                         cls.SEND_TIMEOUT if wait else 0)
+
+    @classmethod
+    def enqueue_batch(cls, msgs):
+        """
+        Sends the messages of each lane as the frames of one multipart message.  A batch travels through its lane as
+        a unit and is delivered to a single consumer.
+
+        :param msgs: messages
+        :type msgs: list of dict
+        :return: False if any message was dropped because its lane is full
+        :rtype: bool
+        """
+        lanes = OrderedDict()
+        for msg in msgs:
+            lanes.setdefault(cls.get_lane(msg['type']), []).append(json.dumps(msg).encode('utf-8'))
+        status = True
+        for lane, frames in lanes.items():
+            status = cls._send(lane, frames) and status
+        return status
 
     @classmethod
     def dequeue(cls):
-        context = zmq.Context()
-        socket = context.socket(zmq.PULL)
-        socket.connect(cls.QUEUE_BIND_OUT)
-        return socket.recv_json()
+        """
+        Weighted round-robin over the lanes: each lane may deliver up to its weight in messages per round while
+        others are waiting.  Blocks until a message arrives.
+
+        :return: message
+        :rtype: dict
+        """
+        consumers = cls._get_consumers()
+        while True:
+            for _ in range(2):
+                for name in consumers:
+                    if cls._credits[name] > 0 and cls._receive(name):
+                        cls._credits[name] -= 1
+                        return cls._pending[name].popleft()
+                # no lane with credit left has a message.  Start a new round
+                cls._credits = {name: lane['weight'] for name, lane in cls.LANES.items()}
+            cls._poller.poll()
+
+    @classmethod
+    def _receive(cls, name):
+        pending = cls._pending[name]
+        if not pending:
+            try:
+                frames = cls._consumers[name].recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return False
+            pending.extend(json.loads(frame.decode('utf-8')) for frame in frames)
+        return True
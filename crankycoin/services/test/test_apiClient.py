@@ -1,14 +1,22 @@
+import threading
 from unittest import TestCase, skip
 from mock import Mock, patch
 
 from crankycoin import config
+from crankycoin.models.block import Block, BlockHeader
+from crankycoin.models.transaction import Transaction
 from crankycoin.repository.peers import Peers
 from crankycoin.services.api_client import ApiClient, requests
+from crankycoin.services.peer_connections import CircuitOpenError, PeerConnection, PeerConnections
 
 
 class TestApiClient(TestCase):
 
     def setUp(self):
+        # every test starts with fresh sessions, circuits and retry budgets
+        patcher = patch.object(PeerConnections, '_connections', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.mock_peers = Mock(Peers)
         self.subject = ApiClient(self.mock_peers)
         self.node = "1.2.3.4"
@@ -18,7 +26,7 @@ class TestApiClient(TestCase):
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.json.return_value = self.mock_peers
-        with patch.object(requests, 'get', return_value=mock_response) as patched_requests:
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_requests:
             response = self.subject.request_nodes(self.node, self.port)
         self.assertEqual(response, self.mock_peers)
 
@@ -26,7 +34,7 @@ class TestApiClient(TestCase):
         mock_response = Mock()
         mock_response.status_code = 400
         mock_response.json.return_value = self.mock_peers
-        with patch.object(requests, 'get', return_value=mock_response) as patched_requests:
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_requests:
             response = self.subject.request_nodes(self.node, self.port)
         self.assertIsNone(response)
 
@@ -34,7 +42,7 @@ class TestApiClient(TestCase):
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.json.return_value = config['network']
-        with patch.object(requests, 'get', return_value=mock_response) as patched_requests:
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_requests:
             response = self.subject.ping_status(self.node)
         self.assertTrue(response)
 
@@ -42,7 +50,7 @@ class TestApiClient(TestCase):
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.json.return_value = dict()
-        with patch.object(requests, 'get', return_value=mock_response) as patched_requests:
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_requests:
             response = self.subject.ping_status(self.node)
         self.assertFalse(response)
 
@@ -50,7 +58,7 @@ class TestApiClient(TestCase):
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.json.return_value = {'height': 125}
-        with patch.object(requests, 'get', return_value=mock_response) as patched_requests:
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_requests:
             response = self.subject.request_height(self.node)
         self.assertEqual(response, 125)
 
@@ -58,10 +66,228 @@ class TestApiClient(TestCase):
         mock_response = Mock()
         mock_response.status_code = 400
         mock_response.json.return_value = {'height': 125}
-        with patch.object(requests, 'get', return_value=mock_response) as patched_requests:
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_requests:
             response = self.subject.request_height(self.node)
         self.assertIsNone(response)
 
+    def test_broadcast_Posts_to_every_peer_concurrently(self):
+        self.mock_peers.get_all_peers.return_value = ["1.1.1.1", "2.2.2.2", "3.3.3.3"]
+        barrier = threading.Barrier(3, timeout=5)
+        mock_response = Mock()
+        mock_response.status_code = 200
+
+        def post(method, url, json, timeout):
+            # only returns once all three requests are in flight
+            barrier.wait()
+            return mock_response
+
+        with patch.object(requests.Session, 'request', side_effect=post) as patched_post:
+            accepted = self.subject.broadcast({"type": 1, "data": []})
+
+        self.assertEqual(accepted, ["1.1.1.1", "2.2.2.2", "3.3.3.3"])
+        self.assertEqual(patched_post.call_count, 3)
+        self.assertEqual(patched_post.call_args[1]['timeout'],
+                         (self.subject.CONNECT_TIMEOUT, self.subject.BROADCAST_TIMEOUT))
+
+    def test_broadcast_When_peer_unreachable_Records_downtime(self):
+        self.mock_peers.get_all_peers.return_value = ["1.1.1.1", "2.2.2.2"]
+        mock_response = Mock()
+        mock_response.status_code = 200
+
+        def post(method, url, json, timeout):
+            if "2.2.2.2" in url:
+                raise requests.exceptions.Timeout()
+            return mock_response
+
+        with patch.object(requests.Session, 'request', side_effect=post):
+            accepted = self.subject.broadcast_block_inv(["blockhash"], "127.0.0.1")
+
+        self.assertEqual(accepted, ["1.1.1.1"])
+        self.mock_peers.record_downtime.assert_called_once_with("2.2.2.2")
+
+    def test_request_When_connection_fails_Retries_within_budget(self):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'height': 125}
+        with patch.object(requests.Session, 'request',
+                          side_effect=[requests.exceptions.ConnectionError(), mock_response]) as patched_request:
+            response = self.subject.request_height(self.node)
+
+        self.assertEqual(response, 125)
+        self.assertEqual(patched_request.call_count, 2)
+        self.assertEqual(patched_request.call_args[1]['timeout'],
+                         (self.subject.CONNECT_TIMEOUT, self.subject.READ_TIMEOUT))
+        self.assertEqual(PeerConnections.stats()[self.node]['retries'], 1)
+
+    def test_request_When_retry_budget_spent_Fails_without_retrying(self):
+        with patch.object(PeerConnection, 'RETRY_BUDGET', 1), \
+                patch.object(requests.Session, 'request',
+                             side_effect=requests.exceptions.ConnectionError()) as patched_request:
+            self.assertIsNone(self.subject.request_height(self.node))
+            self.assertIsNone(self.subject.request_height(self.node))
+
+        # one retry for the first call, none left for the second
+        self.assertEqual(patched_request.call_count, 3)
+
+    def test_request_When_failures_reach_threshold_Opens_circuit_until_probe_succeeds(self):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'height': 125}
+        with patch.object(PeerConnection, 'RETRY_BUDGET', 0), \
+                patch.object(PeerConnection, 'CIRCUIT_FAILURE_THRESHOLD', 2), \
+                patch('crankycoin.services.peer_connections.time.time') as mock_time:
+            mock_time.return_value = 1000
+            with patch.object(requests.Session, 'request',
+                              side_effect=requests.exceptions.ConnectionError()) as patched_request:
+                self.subject.request_block_header(self.node, self.port, block_hash="blockhash")
+                self.subject.request_block_header(self.node, self.port, block_hash="blockhash")
+                with self.assertRaises(CircuitOpenError):
+                    self.subject._get(self.node, "http://1.2.3.4:30013/height/")
+                # rejected calls fail fast without recording downtime again
+                self.assertIsNone(self.subject.request_block_header(self.node, self.port, block_hash="blockhash"))
+            self.assertEqual(patched_request.call_count, 2)
+            self.assertEqual(self.mock_peers.record_downtime.call_count, 2)
+            self.assertTrue(PeerConnections.stats()[self.node]['circuit_open'])
+
+            mock_time.return_value += PeerConnection.CIRCUIT_COOLDOWN
+            with patch.object(requests.Session, 'request', return_value=mock_response):
+                response = self.subject.request_height(self.node)
+
+        self.assertEqual(response, 125)
+        self.mock_peers.reset_downtime.assert_called_once_with(self.node)
+        self.assertFalse(PeerConnections.stats()[self.node]['circuit_open'])
+
+    def test_request_transactions_Requests_chunks_and_returns_transactions_in_order(self):
+        transactions = [Transaction("src", "dest", 1, 0.1, prev_hash="prev{}".format(i), timestamp=1524041935,
+                                    signature="sig") for i in range(4)]
+        tx_dicts = {transaction.tx_hash: transaction.to_dict() for transaction in transactions}
+        tx_hashes = [transaction.tx_hash for transaction in transactions[:3]]
+
+        def post(method, url, json, timeout):
+            mock_response = Mock()
+            mock_response.status_code = 200
+            # the peer answers in its own order, with an unrequested extra
+            mock_response.json.return_value = {'transactions': [tx_dicts[tx_hash] for tx_hash in
+                                                                reversed(json['tx_hashes'])] +
+                                                               [transactions[3].to_dict()]}
+            return mock_response
+
+        self.subject.MAX_TRANSACTIONS_BATCH = 2
+        with patch.object(requests.Session, 'request', side_effect=post) as patched_request:
+            result = self.subject.request_transactions(self.node, self.port, tx_hashes)
+
+        self.assertEqual([transaction.tx_hash for transaction in result], tx_hashes)
+        self.assertEqual(patched_request.call_count, 2)
+        self.assertEqual(patched_request.call_args_list[0][1]['json'], {'tx_hashes': tx_hashes[:2]})
+
+    def test_request_transactions_When_contents_tampered_under_requested_hash_Drops_them(self):
+        transaction = Transaction("src", "dest", 1, 0.1, prev_hash="prev", timestamp=1524041935, signature="sig")
+        tampered = transaction.to_dict()
+        tampered['destination'] = "thief"
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'transactions': [tampered]}
+        with patch.object(requests.Session, 'request', return_value=mock_response):
+            result = self.subject.request_transactions(self.node, self.port, [transaction.tx_hash])
+
+        self.assertEqual(result, [])
+
+    def test_request_transactions_When_status_code_not_200_Returns_none(self):
+        mock_response = Mock()
+        mock_response.status_code = 400
+        with patch.object(requests.Session, 'request', return_value=mock_response):
+            transactions = self.subject.request_transactions(self.node, self.port, ["tx1"])
+
+        self.assertIsNone(transactions)
+
+    def test_request_block_transactions_When_contents_tampered_Recomputes_hashes(self):
+        transaction = Transaction("src", "dest", 1, 0.1, prev_hash="prev", timestamp=1524041935, signature="sig")
+        tampered = transaction.to_dict()
+        tampered['destination'] = "thief"
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'transactions': [transaction.to_dict(), tampered]}
+        with patch.object(requests.Session, 'request', return_value=mock_response):
+            result = self.subject.request_block_transactions(self.node, self.port, "block_hash", [1, 2])
+
+        self.assertEqual(result[0].tx_hash, transaction.tx_hash)
+        self.assertNotEqual(result[1].tx_hash, transaction.tx_hash)
+        self.assertEqual(result[1].destination, "thief")
+
+    def test_request_fork_point_Returns_hash_and_height(self):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'hash': 'hash10', 'height': 10}
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_request:
+            result = self.subject.request_fork_point(self.node, self.port, ['hash20', 'hash10', 'genesis'])
+
+        self.assertEqual(result, ('hash10', 10))
+        self.assertEqual(patched_request.call_args[1]['json'], {'locator': ['hash20', 'hash10', 'genesis']})
+
+    def test_request_fork_point_When_hash_not_in_locator_Returns_none(self):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'hash': 'other', 'height': 10}
+        with patch.object(requests.Session, 'request', return_value=mock_response):
+            result = self.subject.request_fork_point(self.node, self.port, ['hash20', 'hash10', 'genesis'])
+
+        self.assertIsNone(result)
+
+    def test_request_headers_Requests_chunks_until_peer_tip(self):
+        header_dicts = [BlockHeader("hash{}".format(height), "merkle", 1524041935).to_dict() for height in range(3)]
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.side_effect = [{'headers': header_dicts[:2]}, {'headers': header_dicts[2:]}]
+
+        self.subject.MAX_HEADERS_BATCH = 2
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_request:
+            result = self.subject.request_headers(self.node, self.port, 5, 10)
+
+        self.assertEqual([block_header.previous_hash for block_header in result], ["hash0", "hash1", "hash2"])
+        self.assertEqual(patched_request.call_count, 2)
+        self.assertEqual(patched_request.call_args_list[0][0][1],
+                         self.subject.HEADERS_URL.format(self.node, self.port, 5, 6))
+
+    def test_request_blocks_Requests_chunks_until_peer_tip(self):
+        blocks = [Block(1, [Transaction("0", "miner", 50, 0, tx_type=1, timestamp=1524041935, signature="")],
+                        "0" * 64, timestamp=1524041935)]
+        for height in range(2, 4):
+            blocks.append(Block(height, [Transaction("0", "miner", 50, 0, tx_type=1, timestamp=1524041935 + height,
+                                                     signature="")],
+                                blocks[-1].block_header.hash, timestamp=1524041935))
+        block_dicts = [{'height': block.height, 'block_header': block.block_header.to_dict(),
+                        'transactions': [transaction.to_dict() for transaction in block.transactions]}
+                       for block in blocks]
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.side_effect = [{'blocks': block_dicts[:2]}, {'blocks': block_dicts[2:]}]
+
+        self.subject.MAX_BLOCKS_BATCH = 2
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_request:
+            result = self.subject.request_blocks(self.node, self.port, 1, 10)
+
+        self.assertEqual([block.block_header.hash for block in result],
+                         [block.block_header.hash for block in blocks])
+        # the second chunk ends short of its range, so the peer has nothing beyond it
+        self.assertEqual(patched_request.call_count, 2)
+        self.assertEqual(patched_request.call_args_list[1][0][1],
+                         self.subject.FULL_BLOCKS_URL.format(self.node, self.port, 3, 4))
+
+    def test_request_blocks_When_transactions_do_not_match_header_Returns_none(self):
+        block = Block(1, [Transaction("0", "miner", 50, 0, tx_type=1, timestamp=1524041935, signature="")],
+                      "0" * 64, timestamp=1524041935)
+        forged = block.transactions[0].to_dict()
+        # the original hash is kept while the contents are altered
+        forged['destination'] = "thief"
+        block_dict = {'height': 1, 'block_header': block.block_header.to_dict(), 'transactions': [forged]}
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'blocks': [block_dict]}
+        with patch.object(requests.Session, 'request', return_value=mock_response):
+            result = self.subject.request_blocks(self.node, self.port, 1, 1)
+
+        self.assertIsNone(result)
+
     @skip
     def test_broadcast_transaction(self):
         # TODO: Not testing this until implementation of a better broadcast pattern
@@ -81,7 +307,7 @@ class TestApiClient(TestCase):
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.json.return_value = 12500
-        with patch.object(requests, 'get', return_value=mock_response) as patched_requests:
+        with patch.object(requests.Session, 'request', return_value=mock_response) as patched_requests:
             response = self.subject.get_balance(self.node)
         self.assertEqual(response, 12500)
 
@@ -0,0 +1,60 @@
+import threading
+from unittest import TestCase
+from mock import Mock, patch
+
+from crankycoin.services.api_client import ApiClient
+from crankycoin.services.block_downloader import BlockDownloader
+
+
+class TestBlockDownloader(TestCase):
+
+    def setUp(self):
+        self.mock_api_client = Mock(ApiClient)
+        self.block_headers = [Mock(hash="hash{}".format(height)) for height in range(10, 30)]
+        self.blocks = [Mock(height=height, block_header=block_header)
+                       for height, block_header in zip(range(10, 30), self.block_headers)]
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def serve(self, node, port, start_height, end_height):
+        with self.lock:
+            self.requests.append((node, start_height, end_height))
+        return self.blocks[start_height - 10:end_height - 9]
+
+    def test_iter_Downloads_chunks_from_every_peer_and_yields_blocks_in_order(self):
+        self.mock_api_client.request_blocks.side_effect = self.serve
+
+        with patch.object(BlockDownloader, 'CHUNK_SIZE', 3), patch.object(BlockDownloader, 'DOWNLOAD_WINDOW', 6):
+            blocks = list(BlockDownloader(self.mock_api_client, ["peer1", "peer2"], 30013, self.block_headers, 10))
+
+        self.assertEqual(blocks, self.blocks)
+        self.assertEqual(sorted((start, end) for node, start, end in self.requests),
+                         [(start, min(start + 2, 29)) for start in range(10, 30, 3)])
+        self.assertEqual({node for node, start, end in self.requests}, {"peer1", "peer2"})
+
+    def test_iter_When_peer_off_header_chain_Downloads_from_other_peers(self):
+        def serve(node, port, start_height, end_height):
+            blocks = self.serve(node, port, start_height, end_height)
+            return [Mock(block_header=Mock(hash="fork"))] * len(blocks) if node == "forked" else blocks
+
+        self.mock_api_client.request_blocks.side_effect = serve
+
+        with patch.object(BlockDownloader, 'CHUNK_SIZE', 5), patch.object(BlockDownloader, 'REQUESTS_PER_PEER', 1):
+            subject = BlockDownloader(self.mock_api_client, ["forked", "peer"], 30013, self.block_headers, 10)
+            blocks = list(subject)
+
+        self.assertEqual(blocks, self.blocks)
+        self.assertEqual(subject.off_chain, {"forked"})
+        # only requests already under way when the fork was detected went to the forked peer
+        self.assertLessEqual(len([request for request in self.requests if request[0] == "forked"]), 2)
+
+    def test_iter_When_no_peer_has_a_chunk_Stops_before_it(self):
+        def serve(node, port, start_height, end_height):
+            return None if start_height == 15 else self.serve(node, port, start_height, end_height)
+
+        self.mock_api_client.request_blocks.side_effect = serve
+
+        with patch.object(BlockDownloader, 'CHUNK_SIZE', 5):
+            blocks = list(BlockDownloader(self.mock_api_client, ["peer1", "peer2"], 30013, self.block_headers, 10))
+
+        self.assertEqual(blocks, self.blocks[:5])
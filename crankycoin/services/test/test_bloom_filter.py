@@ -0,0 +1,111 @@
+import os
+from unittest import TestCase
+from mock import patch
+
+from crankycoin.models.enums import MessageType
+from crankycoin.routes import permissioned
+from crankycoin.services.bloom_filter import RollingBloomFilter
+
+
+class TestRollingBloomFilter(TestCase):
+
+    def test_check_and_add_When_new_key_Returns_false_and_remembers_key(self):
+        subject = RollingBloomFilter(1000, 600, 0.000001)
+
+        self.assertFalse(subject.check_and_add("hash1"))
+        self.assertTrue("hash1" in subject)
+        self.assertTrue(subject.check_and_add("hash1"))
+        self.assertFalse("hash2" in subject)
+        self.assertEqual(subject.stats()['checked'], 2)
+        self.assertEqual(subject.stats()['seen'], 1)
+        self.assertEqual(subject.stats()['seen_rate'], 0.5)
+
+    def test_check_and_add_When_capacity_exceeded_Forgets_oldest_keys(self):
+        subject = RollingBloomFilter(20, 600, 0.000001)
+
+        subject.check_and_add("old")
+        for i in range(20):
+            subject.check_and_add("key{}".format(i))
+
+        self.assertFalse("old" in subject)
+        self.assertTrue("key19" in subject)
+
+    def test_check_and_add_When_key_seen_in_previous_generation_Carries_it_forward(self):
+        subject = RollingBloomFilter(20, 600, 0.000001)
+
+        subject.check_and_add("kept")
+        for i in range(10):
+            subject.check_and_add("key{}".format(i))
+        # rotated once.  Seeing "kept" again carries it into the current generation
+        self.assertTrue(subject.check_and_add("kept"))
+        for i in range(10, 19):
+            subject.check_and_add("key{}".format(i))
+
+        self.assertTrue("kept" in subject)
+
+    def test_check_and_add_When_ttl_expires_Forgets_keys(self):
+        subject = RollingBloomFilter(1000, 600, 0.000001)
+
+        with patch('crankycoin.services.bloom_filter.time.time') as mock_time:
+            mock_time.return_value = subject.current_started
+            subject.check_and_add("hash1")
+            mock_time.return_value += 300
+            self.assertTrue("hash1" in subject)
+            mock_time.return_value += 300
+            self.assertFalse("hash1" in subject)
+
+    def test_check_and_add_When_full_Returns_false_positives_near_target_rate(self):
+        subject = RollingBloomFilter(2000, 600, 0.01)
+        for i in range(999):
+            subject.check_and_add("member{}".format(i))
+
+        false_positives = sum(1 for i in range(10000) if "other{}".format(i) in subject)
+
+        self.assertLess(false_positives, 200)
+
+
+class TestFilterSeenInventory(TestCase):
+
+    def setUp(self):
+        patcher = patch.object(permissioned, 'seen_inventory', RollingBloomFilter(1000, 600, 0.000001))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_filter_seen_inventory_When_hashes_processed_Strips_them_and_drops_empty_messages(self):
+        block_inv = MessageType.BLOCK_INV.value
+        tx_inv = MessageType.UNCONFIRMED_TRANSACTION_INV.value
+        permissioned.seen_inventory.add("tx1")
+        permissioned.seen_inventory.add("tx2")
+
+        msgs = permissioned.filter_seen_inventory([
+            {'host': 'peer2', 'type': tx_inv, 'data': ["tx1", "tx2"]},
+            {'host': 'peer2', 'type': tx_inv, 'data': ["tx2", "tx3"]},
+            {'host': 'peer2', 'type': block_inv, 'data': ["block1"]},
+            {'host': 'peer2', 'type': MessageType.BLOCK_HEADER.value, 'data': "{}"},
+            {'host': 'peer3', 'type': MessageType.BLOCK_HEADER.value, 'data': "{}"}
+        ])
+
+        self.assertEqual(msgs, [
+            {'host': 'peer2', 'type': tx_inv, 'data': ["tx3"]},
+            {'host': 'peer2', 'type': block_inv, 'data': ["block1"]},
+            {'host': 'peer2', 'type': MessageType.BLOCK_HEADER.value, 'data': "{}"},
+            {'host': 'peer3', 'type': MessageType.BLOCK_HEADER.value, 'data': "{}"}
+        ])
+        self.assertEqual(permissioned.seen_inventory.stats()['seen'], 3)
+
+    def test_filter_seen_inventory_When_hashes_only_announced_Returns_them_again(self):
+        tx_inv = MessageType.UNCONFIRMED_TRANSACTION_INV.value
+        permissioned.filter_seen_inventory([{'host': 'peer1', 'type': tx_inv, 'data': ["tx1"]}])
+
+        msgs = permissioned.filter_seen_inventory([{'host': 'peer2', 'type': tx_inv, 'data': ["tx1"]}])
+
+        self.assertEqual(msgs, [{'host': 'peer2', 'type': tx_inv, 'data': ["tx1"]}])
+
+    def test_add_When_added_in_forked_process_Is_seen_by_parent(self):
+        pid = os.fork()
+        if pid == 0:
+            permissioned.seen_inventory.add("tx1")
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertIn("tx1", permissioned.seen_inventory)
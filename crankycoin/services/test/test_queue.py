@@ -0,0 +1,144 @@
+import json
+import os
+import zmq
+from collections import OrderedDict
+from unittest import TestCase
+from mock import Mock, patch
+
+from crankycoin.models.enums import MessageType
+from crankycoin.services.queue import Queue
+
+
+def make_lanes(prefix):
+    return OrderedDict((
+        ('block', {'name': 'block', 'bind_in': prefix + "-block-in", 'bind_out': prefix + "-block-out",
+                   'weight': 2, 'hwm': 100, 'types': [MessageType.BLOCK_HEADER.value, MessageType.BLOCK_INV.value]}),
+        ('transaction', {'name': 'transaction', 'bind_in': prefix + "-tx-in", 'bind_out': prefix + "-tx-out",
+                         'weight': 1, 'hwm': 100, 'types': [MessageType.UNCONFIRMED_TRANSACTION_INV.value]})))
+
+
+def block_msg(data):
+    return {'host': 'peer', 'type': MessageType.BLOCK_INV.value, 'data': data}
+
+
+def tx_msg(data):
+    return {'host': 'peer', 'type': MessageType.UNCONFIRMED_TRANSACTION_INV.value, 'data': data}
+
+
+class TestQueue(TestCase):
+
+    def setUp(self):
+        # inproc endpoints are released asynchronously, so every test binds its own
+        self.lanes = make_lanes("inproc://{}".format(self.id()))
+        patchers = [patch.object(Queue, "LANES", self.lanes),
+                    patch.object(Queue, "_producers", None),
+                    patch.object(Queue, "_consumers", None)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # stands in for the proxy process: producers connect to frontends, consumers to backends
+        context = zmq.Context.instance()
+        self.frontends, self.backends = {}, {}
+        for name, lane in self.lanes.items():
+            self.frontends[name] = context.socket(zmq.PULL)
+            self.frontends[name].bind(lane['bind_in'])
+            self.backends[name] = context.socket(zmq.PUSH)
+            self.backends[name].bind(lane['bind_out'])
+        # connect the consumers up front so forwarded messages have somewhere to go
+        Queue._get_consumers()
+
+    def tearDown(self):
+        for sockets in (Queue._producers, Queue._consumers, self.frontends, self.backends):
+            for socket in (sockets or {}).values():
+                if isinstance(socket, zmq.Socket):
+                    socket.close(linger=0)
+
+    def forward(self, lane):
+        frames = self.frontends[lane].recv_multipart()
+        self.backends[lane].send_multipart(frames)
+        return frames
+
+    def test_get_lane_Returns_lane_by_message_type(self):
+        self.assertEqual(Queue.get_lane(MessageType.BLOCK_HEADER.value), 'block')
+        self.assertEqual(Queue.get_lane(MessageType.UNCONFIRMED_TRANSACTION_INV.value), 'transaction')
+        # unlisted types travel in the lowest priority lane
+        self.assertEqual(Queue.get_lane(MessageType.SYNCHRONIZE.value), 'transaction')
+
+    def test_enqueue_When_called_repeatedly_Reuses_sockets(self):
+        Queue.enqueue(block_msg('one'))
+        producers = Queue._producers
+        Queue.enqueue(block_msg('two'))
+        self.forward('block')
+        self.forward('block')
+
+        self.assertIs(Queue._producers, producers)
+        self.assertEqual(Queue.dequeue(), block_msg('one'))
+        self.assertEqual(Queue.dequeue(), block_msg('two'))
+
+    def test_enqueue_When_process_forked_Creates_new_sockets(self):
+        Queue.enqueue(block_msg('one'))
+        producers = Queue._producers
+
+        with patch('os.getpid', return_value=-1):
+            Queue.enqueue(block_msg('two'))
+
+        self.assertIsNot(Queue._producers, producers)
+        for socket in producers.values():
+            socket.close(linger=0)
+
+    def test_enqueue_When_lane_full_Drops_message(self):
+        mock_socket = Mock()
+        mock_socket.send_multipart.side_effect = zmq.Again()
+        Queue._producers, Queue._producers_pid = {'transaction': mock_socket}, os.getpid()
+        Queue.dropped = {'block': 0, 'transaction': 0}
+
+        result = Queue.enqueue(tx_msg('one'))
+
+        self.assertFalse(result)
+        self.assertEqual(Queue.dropped['transaction'], 1)
+
+    def test_enqueue_When_waiting_Polls_lane_before_sending(self):
+        mock_socket = Mock()
+        Queue._producers, Queue._producers_pid = {'block': mock_socket}, os.getpid()
+
+        result = Queue.enqueue(block_msg('one'), wait=True)
+
+        self.assertTrue(result)
+        mock_socket.poll.assert_called_once_with(Queue.SEND_TIMEOUT, zmq.POLLOUT)
+        mock_socket.send_multipart.assert_called_once_with([json.dumps(block_msg('one')).encode('utf-8')],
+                                                           zmq.NOBLOCK)
+
+    def test_enqueue_batch_Sends_one_multipart_message_per_lane(self):
+        msgs = [block_msg(0), tx_msg(1), block_msg(2)]
+
+        result = Queue.enqueue_batch(msgs)
+
+        self.assertTrue(result)
+        self.assertEqual([json.loads(frame.decode('utf-8')) for frame in self.forward('block')],
+                         [block_msg(0), block_msg(2)])
+        self.assertEqual([json.loads(frame.decode('utf-8')) for frame in self.forward('transaction')], [tx_msg(1)])
+
+    def test_enqueue_batch_When_empty_Sends_nothing(self):
+        Queue.enqueue_batch([])
+
+        self.assertIsNone(Queue._producers)
+
+    def test_dequeue_When_both_lanes_busy_Serves_lanes_by_weight(self):
+        queued = {'block': [[json.dumps(block_msg(i)).encode('utf-8')] for i in range(5)],
+                  'transaction': [[json.dumps(tx_msg(i)).encode('utf-8')] for i in range(3)]}
+
+        def receiver(lane):
+            def recv_multipart(flags=0):
+                if not queued[lane]:
+                    raise zmq.Again()
+                return queued[lane].pop(0)
+            return recv_multipart
+
+        for name, socket in Queue._consumers.items():
+            socket.close(linger=0)
+            Queue._consumers[name] = Mock(recv_multipart=receiver(name))
+
+        lanes = [Queue.get_lane(Queue.dequeue()['type']) for _ in range(8)]
+
+        self.assertEqual(lanes, ['block', 'block', 'transaction', 'block', 'block', 'transaction', 'block',
+                                 'transaction'])
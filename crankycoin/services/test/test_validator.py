@@ -1,3 +1,4 @@
+import coincurve
 from unittest import TestCase, skip
 from mock import patch, Mock, MagicMock
 
@@ -15,6 +16,7 @@ class TestValidator(TestCase):
     def setUp(self):
         self.mock_blockchain = Mock(Blockchain)
         self.mock_mempool = Mock(Mempool)
+        self.mock_mempool.get_verified_transactions.return_value = set()
         with patch.object(Blockchain, "__init__", return_value=None) as patched_blockchain, \
             patch.object(Mempool, "__init__", return_value=None) as patched_mempool:
             self.subject = Validator()
@@ -71,6 +73,19 @@ class TestValidator(TestCase):
 
         self.assertTrue(response)
 
+    def test_validate_headers_When_chain_links_Returns_true(self):
+        header_2 = BlockHeader("hash1", "merkle2", 1524041935)
+        header_3 = BlockHeader(header_2.hash, "merkle3", 1524041936)
+
+        with patch.object(Blockchain, "MINIMUM_HASH_DIFFICULTY", 0):
+            self.assertTrue(self.subject.validate_headers("hash1", [header_2, header_3]))
+
+    def test_validate_headers_When_chain_broken_Returns_false(self):
+        header_2 = BlockHeader("hash1", "merkle2", 1524041935)
+        header_3 = BlockHeader("hash1", "merkle3", 1524041936)
+
+        self.assertFalse(self.subject.validate_headers("hash1", [header_2, header_3]))
+
     def test_validate_block(self):
         mock_block_header = Mock(BlockHeader)
         mock_block_header.merkle_root = "0123456789ABCDEF"
@@ -106,6 +121,121 @@ class TestValidator(TestCase):
 
         self.assertTrue(response)
 
+    def _signed_transactions(self, count):
+        private_key = coincurve.PrivateKey()
+        public_key = private_key.public_key.format(compressed=True).hex()
+        transactions = []
+        for i in range(count):
+            transaction = Transaction(public_key, "destination", 1, 0.1, prev_hash=str(i), timestamp=1524041935)
+            transaction.sign(private_key.to_hex())
+            transactions.append(transaction)
+        return transactions
+
+    def _use_signature_pool(self):
+        self.subject.SIGNATURE_WORKERS = 2
+        self.subject.SIGNATURE_MIN_BATCH = 1
+        self.subject.SIGNATURE_CHUNK_SIZE = 2
+        self.addCleanup(self._close_signature_pool)
+
+    def _close_signature_pool(self):
+        if Validator._signature_pool is not None:
+            Validator._signature_pool.terminate()
+            Validator._signature_pool.join()
+        Validator._signature_pool = None
+
+    def test_verify_signatures_When_small_batch_Verifies_serially(self):
+        transactions = self._signed_transactions(3)
+
+        with patch.object(Validator, '_get_signature_pool') as patched_pool:
+            response = self.subject.verify_signatures(transactions)
+
+        self.assertTrue(response)
+        patched_pool.assert_not_called()
+
+    def test_verify_signatures_When_large_batch_valid_Returns_true(self):
+        self._use_signature_pool()
+        transactions = self._signed_transactions(7)
+
+        response = self.subject.verify_signatures(transactions)
+
+        self.assertTrue(response)
+        self.assertIsNotNone(Validator._signature_pool)
+
+    def test_verify_signatures_When_large_batch_has_invalid_signature_Returns_false(self):
+        self._use_signature_pool()
+        transactions = self._signed_transactions(7)
+        forged = self._signed_transactions(1)[0]
+        transactions[4] = Transaction(transactions[4].source, "attacker", 1, 0.1, prev_hash="4",
+                                      timestamp=1524041935, signature=forged.signature)
+
+        response = self.subject.verify_signatures(transactions)
+
+        self.assertFalse(response)
+        self.assertEqual(Validator._signature_abort.value, Validator._signature_batch_id)
+
+    def test_verify_signatures_When_cached_Skips_verification(self):
+        transactions = self._signed_transactions(3)
+        self.mock_mempool.get_verified_transactions.return_value = {transactions[0].tx_hash, transactions[2].tx_hash}
+
+        with patch.object(Transaction, 'verify', autospec=True, return_value=True) as patched_verify:
+            response = self.subject.verify_signatures(transactions)
+
+        self.assertTrue(response)
+        patched_verify.assert_called_once_with(transactions[1])
+        self.mock_mempool.add_verified_transactions.assert_called_once_with([transactions[1].tx_hash])
+
+    def test_verify_signatures_When_hash_claimed_for_other_contents_Verifies(self):
+        transactions = self._signed_transactions(1)
+        forged = Transaction(transactions[0].source, "attacker", 1, 0.1, prev_hash="0", timestamp=1524041935,
+                             tx_hash=transactions[0].tx_hash, signature="00")
+        self.mock_mempool.get_verified_transactions.side_effect = lambda tx_hashes: \
+            {tx_hash for tx_hash in tx_hashes if tx_hash == transactions[0].tx_hash}
+
+        response = self.subject.verify_signatures([forged])
+
+        self.assertFalse(response)
+        self.mock_mempool.add_verified_transactions.assert_not_called()
+
+    def test_validate_transaction_When_insufficient_funds_Does_not_cache(self):
+        self.mock_blockchain.find_duplicate_transactions.return_value = False
+        self.mock_blockchain.get_balance.return_value = 0
+        transaction = self._signed_transactions(1)[0]
+
+        response = self.subject.validate_transaction(transaction)
+
+        self.assertFalse(response)
+        self.mock_mempool.add_verified_transactions.assert_not_called()
+
+    def test_verify_signatures_When_invalid_Does_not_cache(self):
+        transactions = self._signed_transactions(2)
+
+        with patch.object(Transaction, 'verify', return_value=False):
+            response = self.subject.verify_signatures(transactions)
+
+        self.assertFalse(response)
+        self.mock_mempool.add_verified_transactions.assert_not_called()
+
+    def test_validate_transactions_When_batch_overspends_Returns_false(self):
+        self.mock_blockchain.find_duplicate_transactions.return_value = False
+        self.mock_blockchain.get_balance.return_value = 2
+        transactions = self._signed_transactions(2)
+
+        with patch.object(Validator, 'verify_signatures') as patched_verify:
+            response = self.subject.validate_transactions(transactions)
+
+        self.assertFalse(response)
+        patched_verify.assert_not_called()
+
+    def test_validate_transactions_When_valid_Returns_true(self):
+        self.mock_blockchain.find_duplicate_transactions.return_value = False
+        self.mock_blockchain.get_balance.return_value = 2.2
+        transactions = self._signed_transactions(2)
+
+        response = self.subject.validate_transactions(transactions)
+
+        self.assertTrue(response)
+        self.mock_blockchain.get_balance.assert_called_once_with(transactions[0].source, transactions[0].asset)
+
     @skip
     def test_calculate_merkle_root(self):
         raise NotImplementedError
@@ -0,0 +1,104 @@
+from unittest import TestCase
+from mock import Mock, patch
+
+from crankycoin.miner import Miner
+from crankycoin.models.block import BlockHeader
+from crankycoin.repository.blockchain import Blockchain
+from crankycoin.repository.mempool import Mempool
+from crankycoin.services.hasher import Hasher
+from crankycoin.services.work import WorkManager
+
+
+class LocalHasher(Hasher):
+    # stands in for a remote hasher by calling the work manager instead of the getwork endpoints
+
+    def __init__(self, work_manager):
+        super(LocalHasher, self).__init__("127.0.0.1")
+        self.work_manager = work_manager
+
+    def request_work(self):
+        return self.work_manager.get_work()
+
+    def submit_work(self, work_id, nonce):
+        return self.work_manager.submit_work(work_id, nonce)
+
+
+class TestWorkManager(TestCase):
+
+    def setUp(self):
+        self.mock_blockchain = Mock(Blockchain)
+        self.mock_mempool = Mock(Mempool)
+        self.tip = BlockHeader("", "merkle_root", timestamp=1524041935, nonce=0, version=1)
+        self.mock_blockchain.get_tallest_block_header.side_effect = lambda: (self.tip, 0, 125)
+        self.mock_blockchain.get_coinbase_hash_by_block_hash.return_value = "prevcoinbasehash"
+        self.mock_blockchain.get_reward.return_value = 50
+        self.mock_blockchain.calculate_hash_difficulty.return_value = 1
+        self.mock_blockchain.add_block.return_value = True
+        self.mock_mempool.get_unconfirmed_transactions_chunk.side_effect = lambda count: []
+        self.miner = Miner(self.mock_blockchain, self.mock_mempool)
+        self.subject = WorkManager(self.miner)
+        self.subject.NONCE_RANGE = 100
+        self.hasher = LocalHasher(self.subject)
+
+    def test_get_work_When_called_repeatedly_Hands_out_consecutive_nonce_ranges(self):
+        first = self.subject.get_work()
+        second = self.subject.get_work()
+
+        self.assertEqual(first['work_id'], second['work_id'])
+        self.assertEqual((first['nonce_start'], first['nonce_end']), (0, 100))
+        self.assertEqual((second['nonce_start'], second['nonce_end']), (100, 200))
+        self.assertEqual(first['target_difficulty'], 1)
+        self.assertEqual(first['height'], 126)
+        self.assertEqual(self.mock_mempool.get_unconfirmed_transactions_chunk.call_count, 1)
+
+    def test_get_work_When_tip_changes_Builds_new_template(self):
+        first = self.subject.get_work()
+        self.tip = BlockHeader("", "other_root", timestamp=1524041935, nonce=0, version=1)
+
+        second = self.subject.get_work()
+
+        self.assertNotEqual(first['work_id'], second['work_id'])
+        self.assertEqual(second['nonce_start'], 0)
+        self.assertEqual(self.subject.submit_work(first['work_id'], 0), {'accepted': False, 'reason': 'stale'})
+
+    def test_get_work_When_nonce_space_exhausted_Advances_timestamp(self):
+        self.miner.MAX_NONCE = 149
+        with patch('time.time', return_value=1524041935):
+            first = self.subject.get_work()
+            second = self.subject.get_work()
+            third = self.subject.get_work()
+
+        self.assertEqual(second['nonce_end'], 150)
+        self.assertNotEqual(first['work_id'], third['work_id'])
+        self.assertEqual(third['nonce_start'], 0)
+        self.assertNotEqual(first['header_prefix'], third['header_prefix'])
+
+    def test_submit_work_When_hasher_solves_Connects_block(self):
+        with patch('crankycoin.miner.Queue.enqueue') as patched_enqueue:
+            work = self.hasher.request_work()
+            nonce, hashes = self.hasher.search(work)
+            result = self.hasher.submit_work(work['work_id'], nonce)
+
+        self.assertTrue(result['accepted'])
+        block = self.mock_blockchain.add_block.call_args[0][0]
+        self.assertEqual(block.block_header.nonce, nonce)
+        self.assertEqual(result['hash'], block.block_header.hash)
+        self.assertGreaterEqual(block.block_header.hash_difficulty, 1)
+        patched_enqueue.assert_called_once()
+        self.assertEqual(self.subject.submit_work(work['work_id'], nonce), {'accepted': False, 'reason': 'stale'})
+
+    def test_submit_work_When_difficulty_not_met_Rejects(self):
+        self.mock_blockchain.calculate_hash_difficulty.return_value = 64
+        work = self.subject.get_work()
+
+        result = self.subject.submit_work(work['work_id'], 0)
+
+        self.assertEqual(result, {'accepted': False, 'reason': 'difficulty'})
+        self.mock_blockchain.add_block.assert_not_called()
+
+    def test_submit_work_When_nonce_out_of_range_Rejects(self):
+        work = self.subject.get_work()
+
+        result = self.subject.submit_work(work['work_id'], self.miner.MAX_NONCE + 1)
+
+        self.assertEqual(result, {'accepted': False, 'reason': 'invalid nonce'})
@@ -1,14 +1,52 @@
 import hashlib
+import multiprocessing as mp
+import os
 
 from crankycoin import logger, config
 from crankycoin.models.enums import TransactionType
+from crankycoin.models.transaction import Transaction
 from crankycoin.repository.blockchain import Blockchain
 from crankycoin.repository.mempool import Mempool
 from crankycoin.models.errors import InvalidHash, ChainContinuityError, InvalidTransactions, BlockchainException
 
 
+_abort = None
+
+
+def _init_signature_worker(abort):
+    global _abort
+    _abort = abort
+
+
+def _verify_signatures_chunk(args):
+    """
+    Runs in a signature pool process
+
+    :param args: batch id, offset of the chunk within the batch, (source, signature, signable) tuples
+    :type args: tuple(int, int, list)
+    :return: batch index of the first invalid signature, or None
+    :rtype: int
+    """
+    batch_id, offset, signatures = args
+    for index, (source, signature, signable) in enumerate(signatures):
+        if _abort.value == batch_id:
+            # another chunk of this batch already failed
+            return None
+        if not Transaction.verify_signature(source, signature, signable):
+            return offset + index
+    return None
+
+
 class Validator(object):
 
+    SIGNATURE_WORKERS = config['user']['signature_workers'] or mp.cpu_count()
+    SIGNATURE_MIN_BATCH = config['user']['signature_min_batch']
+    SIGNATURE_CHUNK_SIZE = config['user']['signature_chunk_size']
+    _signature_pool = None
+    _signature_pool_pid = None
+    _signature_abort = None
+    _signature_batch_id = 0
+
     def __init__(self):
         self.blockchain = Blockchain()
         self.mempool = Mempool()
@@ -69,6 +107,31 @@ class Validator(object):
             return False
         return previous_block_height + 1
 
+    def validate_headers(self, previous_hash, headers):
+        """
+        Checks a chain of block headers ahead of their bodies: each header must link to the one before it, carry
+        the network version and meet the minimum hash difficulty.  Blocks are validated in full once connected
+
+        :param previous_hash: hash of the block the first header builds on
+        :type previous_hash: str
+        :param headers: block headers in height order
+        :type headers: list of BlockHeader
+        :return: True if the header chain is well formed
+        :rtype: boolean
+        """
+        for block_header in headers:
+            if block_header.previous_hash != previous_hash:
+                logger.warn('Header chain broken at {}'.format(block_header.hash))
+                return False
+            if block_header.version != config['network']['version']:
+                logger.warn('Incompatible version')
+                return False
+            if block_header.hash_difficulty < Blockchain.MINIMUM_HASH_DIFFICULTY:
+                logger.warn('Invalid hash difficulty')
+                return False
+            previous_hash = block_header.hash
+        return True
+
     def validate_block(self, block, merkle_root):
         if block.block_header.merkle_root != merkle_root:
             logger.warn("invalid merkle root")
@@ -118,8 +181,88 @@ class Validator(object):
         if transaction.amount + transaction.fee > balance:
             logger.warn('Transaction not valid.  Insufficient funds: {}'.format(transaction.tx_hash))
             return False
+        # cached under the hash of the contents whose signature was checked, never the hash a peer claimed
+        self.mempool.add_verified_transactions([transaction.calculate_tx_hash()])
         return True
 
+    def validate_transactions(self, transactions):
+        """
+        Validate a batch of transactions, such as those of a block.  Check for double-spends, insufficient funds
+        across the batch, and invalid signatures.  Stops at the first invalid transaction
+
+        :param transactions:
+        :return: boolean
+        :rtype: boolean
+        """
+        spends = {}
+        for transaction in transactions:
+            if self.blockchain.find_duplicate_transactions(transaction.tx_hash):
+                logger.warn('Transaction not valid.  Double-spend prevented: {}'.format(transaction.tx_hash))
+                return False
+            key = (transaction.source, transaction.asset)
+            spends[key] = spends.get(key, 0) + transaction.amount + transaction.fee
+        for (source, asset), amount in spends.items():
+            if amount > self.blockchain.get_balance(source, asset):
+                logger.warn('Transactions not valid.  Insufficient funds: {}'.format(source))
+                return False
+        return self.verify_signatures(transactions)
+
+    def verify_signatures(self, transactions):
+        """
+        Verify the signatures of a batch of transactions.  Transactions found in the verified cache are skipped;
+        newly verified ones are added to it.  The cache is keyed by hashes computed here from the transaction
+        contents, so a transaction claiming the hash of another one is still verified
+
+        :param transactions:
+        :return: True if every signature is valid
+        :rtype: boolean
+        """
+        tx_hashes = [transaction.calculate_tx_hash() for transaction in transactions]
+        verified = self.mempool.get_verified_transactions(tx_hashes)
+        unverified = [transaction for transaction, tx_hash in zip(transactions, tx_hashes) if tx_hash not in verified]
+        if not self._verify_signatures(unverified):
+            return False
+        if unverified:
+            self.mempool.add_verified_transactions([tx_hash for tx_hash in tx_hashes if tx_hash not in verified])
+        return True
+
+    def _verify_signatures(self, transactions):
+        """
+        Large batches are split into chunks and verified across a process pool; small batches are verified serially
+        to avoid the dispatch overhead
+        """
+        if len(transactions) < self.SIGNATURE_MIN_BATCH or self.SIGNATURE_WORKERS < 2:
+            for transaction in transactions:
+                if not transaction.verify():
+                    logger.warn('Transaction not valid.  Invalid transaction signature: {}'
+                                .format(transaction.tx_hash))
+                    return False
+            return True
+        pool, abort = self._get_signature_pool()
+        Validator._signature_batch_id += 1
+        batch_id = Validator._signature_batch_id
+        chunks = [(batch_id, offset, [(t.source, t.signature, t.to_signable())
+                                      for t in transactions[offset:offset + self.SIGNATURE_CHUNK_SIZE]])
+                  for offset in range(0, len(transactions), self.SIGNATURE_CHUNK_SIZE)]
+        for invalid_index in pool.imap_unordered(_verify_signatures_chunk, chunks):
+            if invalid_index is not None:
+                # tell the pool to skip the rest of this batch
+                abort.value = batch_id
+                logger.warn('Transaction not valid.  Invalid transaction signature: {}'
+                            .format(transactions[invalid_index].tx_hash))
+                return False
+        return True
+
+    @classmethod
+    def _get_signature_pool(cls):
+        if cls._signature_pool is None or cls._signature_pool_pid != os.getpid():
+            # one pool per process, created on first use
+            cls._signature_abort = mp.Value('L', 0)
+            cls._signature_pool = mp.Pool(cls.SIGNATURE_WORKERS, initializer=_init_signature_worker,
+                                          initargs=(cls._signature_abort,))
+            cls._signature_pool_pid = os.getpid()
+        return cls._signature_pool, cls._signature_abort
+
     @staticmethod
     def calculate_merkle_root(tx_hashes):
         coinbase_hash = tx_hashes[0]
@@ -130,11 +273,11 @@ class Validator(object):
             for i in range(0, len(merkle_base), 2):
                 if i == len(merkle_base) - 1:
                     temp_merkle_base.append(
-                        hashlib.sha256(merkle_base[i]).hexdigest()
+                        hashlib.sha256(merkle_base[i].encode('utf-8')).hexdigest()
                     )
                 else:
                     temp_merkle_base.append(
-                        hashlib.sha256(merkle_base[i] + merkle_base[i+1]).hexdigest()
+                        hashlib.sha256((merkle_base[i] + merkle_base[i+1]).encode('utf-8')).hexdigest()
                     )
             merkle_base = temp_merkle_base
         return merkle_base[0]
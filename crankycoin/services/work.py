@@ -0,0 +1,111 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from crankycoin.models.block import HeaderTemplate
+from crankycoin import config, logger
+
+
+class WorkManager(object):
+    """
+    Hands out block templates to external hashers and connects the blocks they solve.  Each getwork call reserves
+    the next slice of the current template's nonce space, so hashers never repeat each other's work.
+    """
+
+    NONCE_RANGE = config['user']['getwork_nonce_range']
+    TEMPLATE_TTL = config['user']['getwork_template_ttl']
+    MAX_TEMPLATES = config['user']['getwork_max_templates']
+
+    def __init__(self, miner):
+        """
+        :param miner: builds templates and connects solved blocks
+        :type miner: Miner
+        """
+        self.miner = miner
+        self.blockchain = miner.blockchain
+        # work_id -> (block, target_difficulty).  Superseded templates on the same tip remain solvable
+        self.templates = OrderedDict()
+        self.current_work_id = None
+        self.next_nonce = 0
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def get_work(self):
+        """
+        :return: work_id, header_prefix, nonce_start, nonce_end (exclusive), target_difficulty and height
+        :rtype: dict
+        """
+        with self.lock:
+            if self._is_stale():
+                self._new_template()
+            block, target_difficulty = self.templates[self.current_work_id]
+            nonce_start = self.next_nonce
+            nonce_end = min(nonce_start + self.NONCE_RANGE, self.miner.MAX_NONCE + 1)
+            self.next_nonce = nonce_end
+            return {
+                'work_id': self.current_work_id,
+                'header_prefix': HeaderTemplate(block.block_header).header_prefix,
+                'nonce_start': nonce_start,
+                'nonce_end': nonce_end,
+                'target_difficulty': target_difficulty,
+                'height': block.height
+            }
+
+    def submit_work(self, work_id, nonce):
+        """
+        :param work_id: id returned by get_work
+        :type work_id: str
+        :param nonce: solved nonce
+        :type nonce: int
+        :return: accepted flag and, for rejected work, a reason
+        :rtype: dict
+        """
+        with self.lock:
+            template = self.templates.get(work_id)
+            if template is None:
+                return {'accepted': False, 'reason': 'stale'}
+            block, target_difficulty = template
+            if not 0 <= nonce <= self.miner.MAX_NONCE:
+                return {'accepted': False, 'reason': 'invalid nonce'}
+            block.block_header.nonce = nonce
+            if block.block_header.hash_difficulty < target_difficulty:
+                return {'accepted': False, 'reason': 'difficulty'}
+            logger.info("Block {} submitted at height {} and nonce {}"
+                        .format(block.block_header.hash, block.height, nonce))
+            if not self.miner.connect_block(block):
+                return {'accepted': False, 'reason': 'rejected'}
+            # every outstanding template now extends a replaced tip
+            self.templates.clear()
+            self.current_work_id = None
+            return {'accepted': True, 'hash': block.block_header.hash}
+
+    def _is_stale(self):
+        if self.current_work_id is None:
+            return True
+        if self.next_nonce > self.miner.MAX_NONCE or time.time() - self.created >= self.TEMPLATE_TTL:
+            # nonce space used up, or time to pick up newer mempool transactions
+            return True
+        block, target_difficulty = self.templates[self.current_work_id]
+        latest_block = self.blockchain.get_tallest_block_header()
+        tip_hash = latest_block[0].hash if latest_block is not None else ""
+        if tip_hash != block.block_header.previous_hash:
+            self.templates.clear()
+            return True
+        return False
+
+    def _new_template(self):
+        block = self.miner.create_block_template()
+        if self.current_work_id in self.templates:
+            previous_block = self.templates[self.current_work_id][0]
+            if previous_block.block_header.previous_hash == block.block_header.previous_hash:
+                # a fresh nonce space needs a distinct header
+                block.block_header.timestamp = max(block.block_header.timestamp,
+                                                   previous_block.block_header.timestamp + 1)
+        work_id = uuid.uuid4().hex
+        self.templates[work_id] = (block, self.blockchain.calculate_hash_difficulty())
+        while len(self.templates) > self.MAX_TEMPLATES:
+            self.templates.popitem(last=False)
+        self.current_work_id = work_id
+        self.next_nonce = 0
+        self.created = time.time()
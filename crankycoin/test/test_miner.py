@@ -1,7 +1,11 @@
+import json
+import os
+import shutil
+import tempfile
 import unittest
-from mock import Mock, patch, PropertyMock
-from crankycoin.miner import Miner
-from crankycoin.models.block import Block, BlockHeader
+from mock import Mock, patch
+from crankycoin.miner import Miner, MinerStats
+from crankycoin.models.block import Block, BlockHeader, HeaderTemplate
 from crankycoin.models.transaction import Transaction
 from crankycoin.repository.blockchain import Blockchain
 from crankycoin.repository.mempool import Mempool
@@ -21,24 +25,156 @@ class TestMiner(unittest.TestCase):
         self.subject.MAX_TRANSACTIONS_PER_BLOCK = self.MAX_TRANSACTIONS_PER_BLOCK
         self.subject.REWARD_ADDRESS = self.REWARD_ADDRESS
 
-    def test_mine_block_When_mempool_empty_Returns_block_with_coinbase(self):
+    def _mock_template(self):
         mock_block_header = Mock(BlockHeader)
         mock_block = Mock(Block)
         mock_block.block_header = mock_block_header
-        mock_hash_difficulty = PropertyMock(side_effect=[0, 0, 10])
-
-        type(mock_block_header).hash_difficulty = mock_hash_difficulty
         mock_block_header.hash = '0000000000111111111'
+        mock_block_header.previous_hash = '0000000000111111111'
+        mock_block.height = 126
 
         self.mock_blockchain.get_tallest_block_header.return_value = mock_block_header, 0, 125
         self.mock_blockchain.get_coinbase_hash_by_block_hash.return_value = "prevcoinbasehash"
         self.mock_blockchain.get_reward.return_value = 50
         self.mock_blockchain.calculate_hash_difficulty.return_value = 1
         self.mock_mempool.get_unconfirmed_transactions_chunk.return_value = []
+        return mock_block
+
+    def test_mine_block_When_mempool_empty_Returns_block_with_coinbase(self):
+        mock_block = self._mock_template()
+        self.subject.NONCE_BATCH_SIZE = 2
+        mock_header_template = Mock(HeaderTemplate)
+        mock_header_template.search.side_effect = [(None, 2), (3, 2)]
 
         with patch('crankycoin.miner.Block', return_value=mock_block) as patched_block, \
+                patch('crankycoin.miner.HeaderTemplate', return_value=mock_header_template), \
                 patch('time.time', return_value=1521946404):
             result = self.subject.mine_block()
 
-            self.assertEqual(self.mock_blockchain.calculate_hash_difficulty.call_count, 3)
+            self.assertEqual(self.mock_blockchain.calculate_hash_difficulty.call_count, 1)
+            self.assertEqual(self.mock_blockchain.get_tallest_block_header.call_count, 1)
             self.assertEqual(result, mock_block)
+            self.assertEqual(result.block_header.nonce, 3)
+            self.assertEqual(self.subject.stats.hash_count.value, 4)
+            self.assertEqual(self.subject.stats.templates_built.value, 1)
+            self.assertEqual(self.subject.stats.stale_templates.value, 0)
+
+    def test_mine_block_When_partitioned_Searches_worker_nonce_slice(self):
+        mock_block = self._mock_template()
+        self.subject.NONCE_BATCH_SIZE = 3
+        mock_header_template = Mock(HeaderTemplate)
+        mock_header_template.search.side_effect = [(None, 3), (17, 2)]
+
+        with patch('crankycoin.miner.Block', return_value=mock_block) as patched_block, \
+                patch('crankycoin.miner.HeaderTemplate', return_value=mock_header_template):
+            result = self.subject.mine_block(worker_index=1, worker_count=4)
+
+            self.assertEqual(patched_block.call_args[1]['nonce'], 1)
+            batches = [list(c[0][0]) for c in mock_header_template.search.call_args_list]
+            self.assertEqual(batches, [[1, 5, 9], [13, 17, 21]])
+            self.assertEqual(result.block_header.nonce, 17)
+
+    def test_mine_block_When_nonce_space_exhausted_Advances_timestamp(self):
+        mock_block = self._mock_template()
+        mock_block.block_header.timestamp = 1521946404
+        self.subject.MAX_NONCE = 5
+        self.subject.NONCE_BATCH_SIZE = 4
+        mock_header_template = Mock(HeaderTemplate)
+        mock_header_template.search.side_effect = [(None, 4), (None, 2), (0, 1)]
+
+        with patch('crankycoin.miner.Block', return_value=mock_block) as patched_block, \
+                patch('crankycoin.miner.HeaderTemplate', return_value=mock_header_template) as patched_template, \
+                patch('time.time', return_value=1521946404):
+            result = self.subject.mine_block()
+
+            batches = [list(c[0][0]) for c in mock_header_template.search.call_args_list]
+            self.assertEqual(batches, [[0, 1, 2, 3], [4, 5], [0, 1, 2, 3]])
+            self.assertEqual(result.block_header.timestamp, 1521946405)
+            self.assertEqual(patched_template.call_count, 2)
+
+    def test_mine_block_When_another_worker_found_block_Returns_none(self):
+        mock_block = self._mock_template()
+        self.mock_blockchain.calculate_hash_difficulty.side_effect = self._bump_tip_generation
+        mock_header_template = Mock(HeaderTemplate)
+        mock_header_template.search.return_value = (None, 64)
+
+        with patch('crankycoin.miner.Block', return_value=mock_block) as patched_block, \
+                patch('crankycoin.miner.HeaderTemplate', return_value=mock_header_template):
+            result = self.subject.mine_block(worker_index=0, worker_count=2)
+
+            self.assertIsNone(result)
+            self.assertEqual(self.subject.stats.hash_count.value, 64)
+            self.assertEqual(self.subject.stats.stale_templates.value, 1)
+
+    def test_mine_block_When_tip_notification_received_Returns_none(self):
+        mock_block = self._mock_template()
+        self.subject.tip_subscriber = Mock()
+        mock_header_template = Mock(HeaderTemplate)
+        mock_header_template.search.return_value = (None, 64)
+        tips = [None, {'hash': '0000000000111111111', 'height': 125}, {'hash': '0000000000222222222', 'height': 126}]
+
+        with patch('crankycoin.miner.Block', return_value=mock_block) as patched_block, \
+                patch('crankycoin.miner.HeaderTemplate', return_value=mock_header_template), \
+                patch('crankycoin.miner.ChainTip.poll', side_effect=tips) as patched_poll:
+            result = self.subject.mine_block()
+
+            self.assertIsNone(result)
+            self.assertEqual(patched_poll.call_count, 3)
+            self.assertEqual(self.mock_blockchain.get_tallest_block_header.call_count, 1)
+
+    def _bump_tip_generation(self, *args):
+        self.subject.tip_generation.value += 1
+        return 1
+
+    def test_connect_block_When_block_lane_full_Waits_and_warns(self):
+        mock_block = self._mock_template()
+        mock_block.block_header.to_json.return_value = "{}"
+        mock_block.transactions = []
+        self.mock_blockchain.add_block.return_value = True
+
+        with patch('crankycoin.miner.Queue.enqueue', return_value=False) as patched_enqueue, \
+                patch('crankycoin.miner.logger') as patched_logger:
+            result = self.subject.connect_block(mock_block)
+
+        self.assertTrue(result)
+        self.assertTrue(patched_enqueue.call_args[1]['wait'])
+        patched_logger.warn.assert_called_once()
+
+    def test_write_stats_Writes_snapshot_as_json(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.subject.STATS_FILE = os.path.join(temp_dir, "miner_stats.json")
+        self.subject.WORKER_PROCESSES = 2
+        self.subject.stats.record_template(0.004)
+        self.subject.stats.add(self.subject.stats.stale_templates)
+        self.subject.stats.record_block(True, 0.25)
+        self.subject.stats.record_block(False, 0.5)
+
+        self.subject.write_stats()
+
+        with open(self.subject.STATS_FILE) as stats_file:
+            stats = json.load(stats_file)
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['stale_rate'], 1.0)
+        self.assertAlmostEqual(stats['template_build_ms'], 4.0)
+        self.assertEqual((stats['blocks_found'], stats['blocks_accepted']), (2, 1))
+        self.assertAlmostEqual(stats['accept_latency_ms'], 250.0)
+        self.assertFalse(os.path.exists(self.subject.STATS_FILE + ".tmp"))
+
+
+class TestMinerStats(unittest.TestCase):
+
+    def setUp(self):
+        self.subject = MinerStats()
+        self.subject.WINDOW = 60
+
+    def test_snapshot_Reports_hash_rate_over_rolling_window(self):
+        samples = [(1000, 0), (1030, 3000), (1060, 9000), (1090, 9000)]
+        rates = []
+        for now, hashes in samples:
+            self.subject.hash_count.value = hashes
+            with patch('time.time', return_value=now):
+                rates.append(self.subject.snapshot()['hash_rate'])
+
+        self.assertEqual(rates, [0.0, 100.0, 150.0, 100.0])
+        self.assertEqual(len(self.subject.samples), 3)
@@ -2,11 +2,16 @@ import unittest
 
 from mock import patch, Mock, call
 
+from crankycoin.models.block import Block, CompactBlock
+from crankycoin.models.enums import MessageType, TransactionType
+from crankycoin.models.transaction import Transaction
 from crankycoin.node import NodeMixin, FullNode
 from crankycoin.repository.blockchain import Blockchain
 from crankycoin.repository.mempool import Mempool
 from crankycoin.repository.peers import Peers
 from crankycoin.services.api_client import ApiClient
+from crankycoin.services.block_downloader import BlockDownloader
+from crankycoin.services.bloom_filter import RollingBloomFilter
 from crankycoin.services.validator import Validator
 
 
@@ -71,3 +76,383 @@ class TestNode(unittest.TestCase):
         self.assertEqual(self.mock_api_client.method_calls, expected_request_nodes_calls)
         self.assertEqual(len(result), 2)
         self.assertEqual(set(result), {'111.222.333.444', '222.333.444.555'})
+
+
+class TestFullNodeCompactBlock(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_api_client = Mock(ApiClient)
+        self.mock_validator = Mock(Validator)
+        self.mock_blockchain = Mock(Blockchain)
+        self.mock_mempool = Mock(Mempool)
+        self.mock_mempool.has_orphan_block.return_value = False
+        self.subject = FullNode(Mock(Peers), self.mock_api_client, self.mock_blockchain, self.mock_mempool,
+                                self.mock_validator)
+        self.subject.HOST = '123.456.789.012'
+        self.coinbase = Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value, timestamp=1524041935,
+                                    signature="")
+        self.transactions = [Transaction("src{}".format(i), "dest", 1, 0, prev_hash="prev{}".format(i),
+                                         timestamp=1524041935, signature="sig") for i in range(4)]
+        self.block = Block(2, [self.coinbase] + self.transactions, "previous_hash", timestamp=1524041935)
+        self.compact_block = CompactBlock.from_transactions(2, self.block.block_header, self.block.transactions)
+        self.mock_blockchain.get_block_header_by_hash.return_value = None
+        self.mock_blockchain.get_transactions_by_hashes.return_value = {}
+        self.mock_blockchain.add_block.return_value = True
+        self.mock_validator.calculate_merkle_root.side_effect = Validator.calculate_merkle_root
+        self.mock_validator.validate_block_header.return_value = 2
+        self.mock_validator.validate_block.return_value = True
+        self.mock_validator.validate_transactions.return_value = True
+        self.mock_mempool.pop_orphan_blocks.return_value = []
+
+    def set_mempool(self, transactions):
+        by_hash = {transaction.tx_hash: transaction for transaction in transactions}
+        self.mock_mempool.get_unconfirmed_transaction_hashes.return_value = list(by_hash) + ["unrelated"]
+        self.mock_mempool.get_unconfirmed_transactions_by_hashes.side_effect = \
+            lambda tx_hashes: {tx_hash: by_hash[tx_hash] for tx_hash in tx_hashes if tx_hash in by_hash}
+
+    def test_process_compact_block_When_mempool_has_all_transactions_Adds_block_without_requests(self):
+        self.set_mempool(self.transactions)
+
+        result = self.subject._FullNode__process_compact_block(self.compact_block, "sender")
+
+        self.assertTrue(result)
+        self.mock_api_client.request_block_transactions.assert_not_called()
+        added_block = self.mock_blockchain.add_block.call_args[0][0]
+        self.assertEqual(added_block.transactions, self.block.transactions)
+        self.mock_mempool.remove_unconfirmed_transactions.assert_called_once_with(self.block.transactions[1:])
+        self.mock_api_client.broadcast_compact_block.assert_called_once()
+        self.mock_validator.validate_transactions.assert_not_called()
+
+    def test_process_compact_block_When_transactions_missing_Requests_them_in_one_round_trip(self):
+        ordered = self.block.transactions[1:]
+        self.set_mempool([ordered[0], ordered[2]])
+        self.mock_api_client.request_block_transactions.return_value = [ordered[1], ordered[3]]
+
+        result = self.subject._FullNode__process_compact_block(self.compact_block, "sender")
+
+        self.assertTrue(result)
+        self.mock_api_client.request_block_transactions.assert_called_once_with(
+            "sender", self.subject.FULL_NODE_PORT, self.block.block_header.hash, [2, 4])
+        self.mock_validator.validate_transactions.assert_called_once_with([ordered[1], ordered[3]])
+        self.assertEqual(self.mock_blockchain.add_block.call_args[0][0].transactions, self.block.transactions)
+
+    def test_process_compact_block_When_block_known_Does_nothing(self):
+        self.mock_blockchain.get_block_header_by_hash.return_value = (self.block.block_header, 0, 2)
+
+        result = self.subject._FullNode__process_compact_block(self.compact_block, "sender")
+
+        self.assertFalse(result)
+        self.mock_mempool.get_unconfirmed_transaction_hashes.assert_not_called()
+        self.mock_blockchain.add_block.assert_not_called()
+
+    def test_process_compact_block_When_rebuilt_block_mismatches_Falls_back_to_block_header(self):
+        self.set_mempool(self.transactions)
+        self.compact_block.short_ids[0] = self.compact_block.short_ids[1]
+
+        with patch.object(FullNode, '_FullNode__process_block_header', return_value=True) as patched_process:
+            self.subject._FullNode__process_compact_block(self.compact_block, "sender")
+
+        patched_process.assert_called_once_with(self.compact_block.block_header, "sender")
+        self.mock_blockchain.add_block.assert_not_called()
+
+
+class TestFullNodeInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_api_client = Mock(ApiClient)
+        self.mock_validator = Mock(Validator)
+        self.mock_blockchain = Mock(Blockchain)
+        self.mock_mempool = Mock(Mempool)
+        self.mock_mempool.has_orphan_block.return_value = False
+        self.subject = FullNode(Mock(Peers), self.mock_api_client, self.mock_blockchain, self.mock_mempool,
+                                self.mock_validator)
+        self.subject.HOST = '123.456.789.012'
+        self.transactions = [Transaction("src{}".format(i), "dest", 1, 0, prev_hash="prev{}".format(i),
+                                         timestamp=1524041935, signature="sig") for i in range(2)]
+        self.mock_blockchain.get_transactions_by_hashes.return_value = {}
+        self.mock_mempool.get_unconfirmed_transactions_by_hashes.return_value = {}
+        self.seen_inventory = RollingBloomFilter(1000, 600, 0.000001)
+        patcher = patch('crankycoin.node.seen_inventory', self.seen_inventory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_worker(self, msg):
+        # the worker loops forever.  The second dequeue ends it
+        with patch('crankycoin.node.Queue.dequeue', side_effect=[msg, KeyboardInterrupt]):
+            with self.assertRaises(KeyboardInterrupt):
+                self.subject.worker()
+
+    def test_worker_When_transactions_fetched_Marks_only_stored_ones_seen(self):
+        tx_hashes = [transaction.tx_hash for transaction in self.transactions]
+        self.mock_api_client.request_transactions.return_value = self.transactions
+        self.mock_validator.validate_transaction.side_effect = [True, False]
+
+        self.run_worker({'host': 'peer', 'type': MessageType.UNCONFIRMED_TRANSACTION_INV.value, 'data': tx_hashes})
+
+        self.assertIn(tx_hashes[0], self.seen_inventory)
+        self.assertNotIn(tx_hashes[1], self.seen_inventory)
+
+    def test_worker_When_block_fetch_fails_Does_not_mark_block_seen(self):
+        self.mock_blockchain.get_block_header_by_hash.side_effect = lambda block_hash: \
+            None if block_hash == "missing" else Mock()
+        self.mock_api_client.request_block_header.return_value = None
+
+        self.run_worker({'host': 'peer', 'type': MessageType.BLOCK_INV.value, 'data': ["known", "missing"]})
+
+        self.assertIn("known", self.seen_inventory)
+        self.assertNotIn("missing", self.seen_inventory)
+
+    def test_worker_When_block_pooled_as_orphan_Marks_seen_and_does_not_download_again(self):
+        block = Block(3, [Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value,
+                                      timestamp=1524041935, signature="")], "1" * 64, timestamp=1524041935)
+        block_hash = block.block_header.hash
+        pooled = set()
+
+        def add_orphan_block(orphan, sender):
+            pooled.add(orphan.block_header.hash)
+            return True
+
+        self.mock_mempool.has_orphan_block.side_effect = pooled.__contains__
+        self.mock_mempool.add_orphan_block.side_effect = add_orphan_block
+        self.mock_mempool.get_orphan_chain.return_value = (1, "1" * 64)
+        self.mock_blockchain.get_block_header_by_hash.return_value = None
+        self.mock_api_client.request_block_header.return_value = block.block_header
+        self.mock_api_client.request_block.return_value = block
+        self.mock_validator.validate_block_header.return_value = None
+        self.mock_validator.validate_headers.return_value = True
+        self.subject.ORPHAN_SYNC_LENGTH = 10
+
+        self.run_worker({'host': 'peer', 'type': MessageType.BLOCK_INV.value, 'data': [block_hash]})
+        self.run_worker({'host': 'other', 'type': MessageType.BLOCK_INV.value, 'data': [block_hash]})
+
+        self.assertIn(block_hash, self.seen_inventory)
+        self.mock_api_client.request_block_header.assert_called_once()
+        self.mock_api_client.request_block.assert_called_once()
+
+
+class TestFullNodeSynchronize(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_api_client = Mock(ApiClient)
+        self.mock_validator = Mock(Validator)
+        self.mock_blockchain = Mock(Blockchain)
+        self.mock_peers = Mock(Peers)
+        self.mock_peers.get_all_peers.return_value = ["peer", "other"]
+        self.mock_mempool = Mock(Mempool)
+        self.mock_mempool.has_orphan_block.return_value = False
+        self.mock_mempool.pop_orphan_blocks.return_value = []
+        self.subject = FullNode(self.mock_peers, self.mock_api_client, self.mock_blockchain, self.mock_mempool,
+                                self.mock_validator)
+        self.subject.HOST = '123.456.789.012'
+        self.genesis = Block(1, [self.coinbase(1)], "0" * 64, timestamp=1524041935)
+        self.block_2 = Block(2, [self.coinbase(2)], self.genesis.block_header.hash, timestamp=1524041935)
+        self.block_3 = Block(3, [self.coinbase(3)], self.block_2.block_header.hash, timestamp=1524041935)
+        known = {self.genesis.block_header.hash: (self.genesis.block_header, 0, 1)}
+        self.mock_blockchain.get_block_header_by_hash.side_effect = known.get
+        self.mock_blockchain.get_height.return_value = 1
+        self.mock_blockchain.add_block.return_value = True
+        self.mock_api_client.request_height.return_value = 3
+        self.mock_blockchain.get_block_locator.return_value = [self.genesis.block_header.hash]
+        self.mock_api_client.request_fork_point.return_value = (self.genesis.block_header.hash, 1)
+        self.mock_api_client.audit.return_value = [block.block_header.hash for block in
+                                                   (self.genesis, self.block_2, self.block_3)]
+        self.mock_validator.validate_block_header.side_effect = lambda block_header, tx_hashes: \
+            2 if block_header.previous_hash == self.genesis.block_header.hash else 3
+        self.mock_validator.validate_block.return_value = True
+
+    @staticmethod
+    def coinbase(height):
+        return Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value, timestamp=1524041935 + height,
+                           signature="")
+
+    def test_synchronize_Requests_missing_blocks_in_one_range(self):
+        self.subject.HEADERS_FIRST_SYNC = False
+        self.mock_api_client.request_blocks.return_value = [self.block_2, self.block_3]
+
+        self.subject._FullNode__synchronize("peer")
+
+        self.mock_api_client.request_fork_point.assert_called_once_with(
+            "peer", self.subject.FULL_NODE_PORT, [self.genesis.block_header.hash])
+        self.mock_api_client.audit.assert_called_once_with("peer", 1, 3)
+        self.mock_api_client.request_blocks.assert_called_once_with("peer", self.subject.FULL_NODE_PORT, 2, 3)
+        self.mock_api_client.request_block_header.assert_not_called()
+        self.assertEqual([call[0][0] for call in self.mock_blockchain.add_block.call_args_list],
+                         [self.block_2, self.block_3])
+
+    def test_synchronize_When_block_not_in_peer_inventory_Stops(self):
+        self.subject.HEADERS_FIRST_SYNC = False
+        self.mock_api_client.request_blocks.return_value = [self.block_3, self.block_2]
+
+        self.subject._FullNode__synchronize("peer")
+
+        self.mock_blockchain.add_block.assert_not_called()
+
+    def test_synchronize_headers_first_Validates_headers_and_connects_blocks_from_every_peer(self):
+        self.mock_api_client.MAX_HEADERS_BATCH = 2000
+        self.mock_api_client.request_headers.return_value = [self.block_2.block_header, self.block_3.block_header]
+        self.mock_validator.validate_headers.return_value = True
+        self.mock_validator.validate_transactions.return_value = True
+        self.mock_api_client.request_blocks.side_effect = \
+            lambda node, port, start, end: [self.block_2, self.block_3][start - 2:end - 1]
+
+        with patch.object(BlockDownloader, 'CHUNK_SIZE', 1):
+            connected = self.subject._FullNode__synchronize("peer")
+
+        self.assertEqual(connected, 2)
+        self.mock_api_client.request_headers.assert_called_once_with("peer", self.subject.FULL_NODE_PORT, 2, 3)
+        self.mock_validator.validate_headers.assert_called_once_with(
+            self.genesis.block_header.hash, [self.block_2.block_header, self.block_3.block_header])
+        self.assertEqual([call[0][0] for call in self.mock_blockchain.add_block.call_args_list],
+                         [self.block_2, self.block_3])
+        # the bodies are spread across both peers and the blocks are not relayed one by one
+        self.assertEqual({call[0][0] for call in self.mock_api_client.request_blocks.call_args_list},
+                         {"peer", "other"})
+        self.mock_api_client.broadcast_compact_block.assert_not_called()
+        self.mock_api_client.broadcast_block_inv.assert_called_once_with([self.block_3.block_header.hash],
+                                                                         self.subject.HOST)
+
+    def test_synchronize_headers_first_When_header_chain_invalid_Downloads_no_blocks(self):
+        self.mock_api_client.MAX_HEADERS_BATCH = 2000
+        self.mock_api_client.request_headers.return_value = [self.block_3.block_header]
+        self.mock_validator.validate_headers.return_value = False
+
+        connected = self.subject._FullNode__synchronize("peer")
+
+        self.assertEqual(connected, 0)
+        self.mock_api_client.request_blocks.assert_not_called()
+        self.mock_blockchain.add_block.assert_not_called()
+
+    def test_synchronize_headers_first_When_fork_between_locator_blocks_Skips_shared_blocks(self):
+        block_4 = Block(4, [self.coinbase(4)], self.block_3.block_header.hash, timestamp=1524041935)
+        local_block_5 = Block(5, [self.coinbase(5)], block_4.block_header.hash, timestamp=1524041935)
+        peer_block_5 = Block(5, [self.coinbase(50)], block_4.block_header.hash, timestamp=1524041935)
+        peer_block_6 = Block(6, [self.coinbase(6)], peer_block_5.block_header.hash, timestamp=1524041935)
+        known = {block.block_header.hash: (block.block_header, 0, block.height)
+                 for block in (self.genesis, self.block_2, self.block_3, block_4, local_block_5)}
+        self.mock_blockchain.get_block_header_by_hash.side_effect = known.get
+        self.mock_blockchain.get_height.return_value = 5
+        self.mock_api_client.request_height.return_value = 6
+        # the peer shares blocks 1 to 4, so the fork lies between the locator blocks at heights 3 and 5
+        self.mock_blockchain.get_block_locator.return_value = [local_block_5.block_header.hash,
+                                                               self.block_3.block_header.hash,
+                                                               self.genesis.block_header.hash]
+        self.mock_api_client.request_fork_point.return_value = (self.block_3.block_header.hash, 3)
+        self.mock_api_client.audit.return_value = [block_4.block_header.hash, peer_block_5.block_header.hash]
+        self.mock_blockchain.get_hashes_range.return_value = [block_4.block_header.hash]
+        self.mock_api_client.MAX_HEADERS_BATCH = 2000
+        self.mock_api_client.request_headers.return_value = [peer_block_5.block_header, peer_block_6.block_header]
+        self.mock_api_client.request_blocks.return_value = [peer_block_5, peer_block_6]
+        self.mock_validator.validate_headers.return_value = True
+        self.mock_validator.validate_transactions.return_value = True
+        self.mock_validator.validate_block_header.side_effect = lambda block_header, tx_hashes: \
+            known[block_header.previous_hash][2] + 1 if block_header.previous_hash in known else None
+        self.mock_blockchain.add_block.side_effect = lambda block: \
+            known.setdefault(block.block_header.hash, (block.block_header, 1, block.height)) is not None
+
+        connected = self.subject._FullNode__synchronize("peer")
+
+        self.assertEqual(connected, 2)
+        self.mock_api_client.audit.assert_called_once_with("peer", 4, 5)
+        self.mock_api_client.request_headers.assert_called_once_with("peer", self.subject.FULL_NODE_PORT, 5, 6)
+        self.mock_validator.validate_headers.assert_called_once_with(
+            block_4.block_header.hash, [peer_block_5.block_header, peer_block_6.block_header])
+        self.assertEqual([call[0][0] for call in self.mock_blockchain.add_block.call_args_list],
+                         [peer_block_5, peer_block_6])
+
+    def test_find_fork_point_When_fork_deep_below_locator_Bisects_the_gap(self):
+        # our main chain runs to height 5000 and the peer's leaves it above height 3210
+        local_hash = "local{}".format
+        peer_hash = lambda height: local_hash(height) if height <= 3210 else "peer{}".format(height)
+        self.mock_blockchain.get_block_locator.return_value = [local_hash(5000), local_hash(2000), local_hash(1)]
+        self.mock_api_client.request_fork_point.return_value = (local_hash(2000), 2000)
+        self.mock_blockchain.get_block_header_by_hash.side_effect = lambda block_hash: \
+            (block_hash, 0, int(block_hash[len("local"):]))
+        self.mock_api_client.audit.side_effect = lambda node, start, end: [peer_hash(start), peer_hash(end)]
+        self.mock_blockchain.get_hashes_range.side_effect = lambda start, stop: [local_hash(start)]
+
+        fork_point = self.subject._FullNode__find_fork_point("peer")
+
+        self.assertEqual(fork_point, (local_hash(3210), 0, 3210))
+        self.assertLessEqual(self.mock_api_client.audit.call_count, 12)
+
+    def test_synchronize_When_no_common_block_Stops(self):
+        self.mock_api_client.request_fork_point.return_value = None
+
+        connected = self.subject._FullNode__synchronize("peer")
+
+        self.assertEqual(connected, 0)
+        self.mock_api_client.request_headers.assert_not_called()
+        self.mock_blockchain.add_block.assert_not_called()
+
+
+class TestFullNodeOrphanBlocks(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_api_client = Mock(ApiClient)
+        self.mock_validator = Mock(Validator)
+        self.mock_blockchain = Mock(Blockchain)
+        self.mock_mempool = Mock(Mempool)
+        self.mock_mempool.has_orphan_block.return_value = False
+        self.subject = FullNode(Mock(Peers), self.mock_api_client, self.mock_blockchain, self.mock_mempool,
+                                self.mock_validator)
+        self.subject.HOST = '123.456.789.012'
+        self.block_2 = Block(2, [self.coinbase(2)], "1" * 64, timestamp=1524041935)
+        self.block_3 = Block(3, [self.coinbase(3)], self.block_2.block_header.hash, timestamp=1524041935)
+        self.block_4 = Block(4, [self.coinbase(4)], self.block_3.block_header.hash, timestamp=1524041935)
+        self.compact_block_3 = CompactBlock.from_transactions(3, self.block_3.block_header, self.block_3.transactions)
+        self.known = {}
+        self.mock_blockchain.get_block_header_by_hash.side_effect = self.known.get
+        self.mock_blockchain.add_block.return_value = True
+        self.mock_mempool.get_unconfirmed_transaction_hashes.return_value = []
+        self.mock_mempool.get_unconfirmed_transactions_by_hashes.return_value = {}
+        self.mock_mempool.add_orphan_block.return_value = True
+        self.mock_validator.calculate_merkle_root.side_effect = Validator.calculate_merkle_root
+        self.mock_validator.validate_headers.return_value = True
+        self.mock_validator.validate_block.return_value = True
+        self.mock_validator.validate_block_header.side_effect = lambda block_header, tx_hashes: \
+            self.known[block_header.previous_hash][2] + 1 if block_header.previous_hash in self.known else None
+
+    @staticmethod
+    def coinbase(height):
+        return Transaction("0", "miner", 50, 0, tx_type=TransactionType.COINBASE.value, timestamp=1524041935 + height,
+                           signature="")
+
+    def test_process_compact_block_When_parent_unknown_Holds_block_without_synchronizing(self):
+        self.mock_mempool.get_orphan_chain.return_value = (1, self.block_2.block_header.hash)
+
+        with patch.object(FullNode, '_FullNode__synchronize') as patched_synchronize:
+            result = self.subject._FullNode__process_compact_block(self.compact_block_3, "sender")
+
+        self.assertFalse(result)
+        orphan, sender = self.mock_mempool.add_orphan_block.call_args[0]
+        self.assertEqual(orphan.block_header, self.block_3.block_header)
+        self.assertEqual(sender, "sender")
+        patched_synchronize.assert_not_called()
+        self.mock_blockchain.add_block.assert_not_called()
+
+    def test_process_compact_block_When_orphan_chain_long_Synchronizes(self):
+        self.mock_mempool.get_orphan_chain.return_value = (self.subject.ORPHAN_SYNC_LENGTH, "missing")
+
+        with patch.object(FullNode, '_FullNode__synchronize') as patched_synchronize:
+            self.subject._FullNode__process_compact_block(self.compact_block_3, "sender")
+
+        patched_synchronize.assert_called_once_with("sender")
+
+    def test_process_block_When_orphans_wait_on_it_Connects_them_recursively(self):
+        self.known["1" * 64] = (None, 0, 1)
+        orphans = {self.block_2.block_header.hash: [(self.block_3, "peer3")],
+                   self.block_3.block_header.hash: [(self.block_4, "peer4")]}
+        self.mock_mempool.pop_orphan_blocks.side_effect = lambda block_hash: orphans.pop(block_hash, [])
+
+        def add_block(block):
+            self.known[block.block_header.hash] = (block.block_header, 0, block.height)
+            return True
+
+        self.mock_blockchain.add_block.side_effect = add_block
+
+        result = self.subject._FullNode__process_block(self.block_2, "sender")
+
+        self.assertTrue(result)
+        self.assertEqual([call[0][0] for call in self.mock_blockchain.add_block.call_args_list],
+                         [self.block_2, self.block_3, self.block_4])
+        self.assertEqual(self.mock_api_client.broadcast_compact_block.call_count, 3)
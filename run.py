@@ -21,6 +21,7 @@ from crankycoin.repository.mempool import Mempool
 from crankycoin.repository.peers import Peers
 from crankycoin.services.validator import Validator
 from crankycoin.services.api_client import ApiClient
+from crankycoin.services.hasher import Hasher
 
 _PY3 = sys.version_info[0] > 2
 if not _PY3:
@@ -103,7 +104,8 @@ def full():
         mempoolcount
         getmempool
         getunconfirmedtx <tx hash>
-        mine <start | stop>
+        mine <start | stop | status>
+        rebuildbalances
         quit or exit
     '''
     peers = Peers()
@@ -187,10 +189,25 @@ def full():
                             print("\n\nminer shutting down...\n\n")
                             mining = False
                             miner.shutdown()
+                    elif cmd_split[1] == "status":
+                        if mining is True:
+                            stats = miner.get_stats()
+                            print("\n{} worker(s) hashing at {:.1f} hashes/s\n"
+                                  "{} of {} templates stale, {:.1f} ms per template\n"
+                                  "{} of {} blocks accepted, {:.1f} ms from find to accept\n"
+                                  .format(stats['workers'], stats['hash_rate'], stats['stale_templates'],
+                                          stats['templates_built'], stats['template_build_ms'],
+                                          stats['blocks_accepted'], stats['blocks_found'],
+                                          stats['accept_latency_ms']))
+                        else:
+                            print("\nminer is not running\n")
                     else:
-                        print("\nRequires: start | stop")
+                        print("\nRequires: start | stop | status")
                 else:
-                    print("\nRequires: start | stop")
+                    print("\nRequires: start | stop | status")
+            elif cmd_split[0] == "rebuildbalances":
+                blockchain.rebuild_balances()
+                print("\nBalances rebuilt from transaction history\n")
             elif cmd_split[0] in ("quit", "exit"):
                 if mining is True:
                     print("\n\nminer shutting down...\n\n")
@@ -207,12 +224,15 @@ def full():
 
 def main(argv):
     parser = argparse.ArgumentParser(description='Starts a ' + config['network']['name'] + ' node')
-    parser.add_argument('mode', metavar='type', nargs='?', default=None, help='client | full')
+    parser.add_argument('mode', metavar='type', nargs='?', default=None, help='client | full | hasher')
+    parser.add_argument('--node', default=config['user']['ip'], help='full node serving getwork (hasher mode)')
     args = parser.parse_args()
     if args.mode == "client":
         client()
     elif args.mode == "full":
         full()
+    elif args.mode == "hasher":
+        Hasher(args.node).run()
     else:
         print("Node operation mode not specified")
 